@@ -1,38 +1,68 @@
 #!/usr/bin/python
 import json
 import os
-import requests
 import socket
+import threading
+from collections import OrderedDict
 import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as HandlerTimeout
 from datetime import datetime, timedelta, timezone
 from time import sleep
-from azure.storage.blob import BlobServiceClient
-from azure.identity import ClientSecretCredential
-from azure.core.exceptions import ResourceExistsError
+
+# requests and the Azure SDKs are imported where they are first used, so the
+# decision logic can be imported and replayed offline (see listener_replay.py)
 
 
 # Provide your Azure AD app details
 tenant_id = "<tenant_id>"
 client_id = "<client_id>"
 client_secret = "<client_secret>"
+_credential = None
 
-# Initialize ClientSecretCredential
-clSeccredential = ClientSecretCredential(tenant_id, client_id, client_secret)
+def credential():
+    # ClientSecretCredential, created on first use
+    global _credential
+    if _credential is None:
+        from azure.identity import ClientSecretCredential
+        _credential = ClientSecretCredential(tenant_id, client_id, client_secret)
+    return _credential
 
 
 # The URL to access the metadata service
-# local testing URL (uncomment for local testing with mock server)
+# local testing URL (set SCHEDULED_EVENTS_URL for local testing with mock server)
 #metadata_SEurl ="http://127.0.0.1/metadata/scheduledevents"
 # Retrieve Scheduled Events from Azure IMDS
-metadata_SEurl ="http://169.254.169.254/metadata/scheduledevents"
+metadata_SEurl = os.environ.get("SCHEDULED_EVENTS_URL", "http://169.254.169.254/metadata/scheduledevents")
 # This must be sent otherwise the request will be ignored
 SEheader = {'Metadata' : 'true'}
 # Current version of the API
 SEquery_params = {'api-version':'2020-07-01'}
 
 
+# Where Preempt events are uploaded. For offline load tests point
+# BLOB_ACCOUNT_URL at the mock server's blob stand-in, e.g.
+# http://127.0.0.1/blob (started with SCHEDULED_EVENTS_BLOB_STORE=memory).
+# Plain http targets are local stand-ins and are used without a credential.
+BLOB_ACCOUNT_URL = os.environ.get("BLOB_ACCOUNT_URL", "https://<storageaccount>.blob.core.windows.net")
+BLOB_CONTAINER = os.environ.get("BLOB_CONTAINER", "spotvmentity")
+_blob_service_client = None
+_blob_client_lock = threading.Lock()
+
+def blob_service_client():
+    # One client for the whole run, so uploads reuse its connection pool
+    global _blob_service_client
+    with _blob_client_lock:
+        if _blob_service_client is None:
+            from azure.storage.blob import BlobServiceClient
+            account_credential = None if BLOB_ACCOUNT_URL.startswith("http://") else credential()
+            _blob_service_client = BlobServiceClient(account_url=BLOB_ACCOUNT_URL, credential=account_credential)
+        return _blob_service_client
+
+
 # Retrieve VM metadata from Azure IMDS, fall back to hostname / empty strings
 def _imds_computetext(field: str) -> str:
+    import requests
     resp = requests.get(
         f"http://169.254.169.254/metadata/instance/compute/{field}",
         headers={"Metadata": "true"},
@@ -41,68 +71,510 @@ def _imds_computetext(field: str) -> str:
     )
     return resp.text.strip()
 
-try:
-    vm_name         = _imds_computetext("name")
-    subscription_id = _imds_computetext("subscriptionId")
-    resource_group  = _imds_computetext("resourceGroupName")
-except Exception:
-    vm_name         = socket.gethostname()
-    subscription_id = ""
-    resource_group  = ""
+_vm_identity = None
+
+def vm_identity():
+    """
+    Return (vm name, subscription id, resource group), looked up from IMDS the
+    first time they are needed.
+    """
+    global _vm_identity
+    if _vm_identity is None:
+        try:
+            _vm_identity = (
+                _imds_computetext("name"),
+                _imds_computetext("subscriptionId"),
+                _imds_computetext("resourceGroupName")
+            )
+        except Exception:
+            _vm_identity = (socket.gethostname(), "", "")
+    return _vm_identity
+
+# How Preempt events are written: "blob" uploads one JSON blob per event,
+# "batch" appends compact NDJSON records to one append blob per VM and hour
+# (RestartVM/<vm>/<yyyymmddhh>.ndjson), or to local rolling files under
+# PREEMPT_BATCH_DIR when that is set. Batches are written once they reach
+# PREEMPT_BATCH_MAX_BYTES or their oldest record is PREEMPT_BATCH_MAX_SECONDS
+# old, and on exit.
+PREEMPT_OUTPUT = os.environ.get("PREEMPT_OUTPUT", "blob")
+PREEMPT_BATCH_DIR = os.environ.get("PREEMPT_BATCH_DIR")
+PREEMPT_BATCH_MAX_BYTES = int(os.environ.get("PREEMPT_BATCH_MAX_BYTES", 1024 * 1024))
+PREEMPT_BATCH_MAX_SECONDS = float(os.environ.get("PREEMPT_BATCH_MAX_SECONDS", 10))
+PREEMPT_JOURNAL_PATH = os.environ.get(
+    "PREEMPT_JOURNAL_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "preempt_journal.ndjson")
+)
+
+class PreemptBatchWriter:
+    """
+    Buffers Preempt records and writes them in batches. Every record is
+    appended to a local journal and fsynced before append() returns, so a
+    record the handler has acknowledged survives a crash before its batch is
+    written; the journal is emptied once the batch is stored, and replayed by
+    recover() on the next start. A crash between storing a batch and emptying
+    the journal writes those records again, so readers dedupe on EventId.
+    Records go to the hour of their DetectedAt, so a batch that spans an hour
+    boundary is split across both hours' files.
+    """
+    # A single append block holds at most 4 MiB
+    BLOCK_SIZE = 4 * 1024 * 1024
+
+    def __init__(self, journal_path, max_bytes, max_seconds, directory=None):
+        self.journal_path = journal_path
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.directory = directory
+        # (hour, NDJSON line) in arrival order
+        self._buffer = []
+        self._buffered_bytes = 0
+        # Bytes of the first hour's batch already stored by a write that then
+        # failed, so a retry carries on after them instead of repeating them
+        self._committed = 0
+        self._oldest = None
+        self._created_blobs = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._journal = open(journal_path, "ab")
+        self._flusher = threading.Thread(target=self._flush_when_due, name="preempt-flusher", daemon=True)
+        self._flusher.start()
+
+    def recover(self):
+        """
+        Queue the records left in the journal by a previous run and write them.
+        A torn last line (the process died mid-append) was never acknowledged
+        and is dropped.
+        """
+        with open(self.journal_path, "rb") as f:
+            lines = f.read().splitlines(keepends=True)
+        recovered = [line for line in lines if line.endswith(b"\n")]
+        with self._lock:
+            # Rewrite the journal without the torn line
+            self._truncate_journal()
+            for line in recovered:
+                self._journal.write(line)
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = {}
+                self._buffer_line(_record_hour(record), line)
+            self._sync_journal()
+            self._try_flush_locked()
+        return len(recovered)
+
+    def append(self, record):
+        line = json.dumps(record, separators=(",", ":")).encode("utf-8") + b"\n"
+        with self._lock:
+            self._journal.write(line)
+            self._sync_journal()
+            self._buffer_line(_record_hour(record), line)
+            if self._buffered_bytes >= self.max_bytes:
+                self._try_flush_locked()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def close(self):
+        self._stopped.set()
+        self._flusher.join()
+        with self._lock:
+            # Whatever can't be written now stays in the journal for the next start
+            self._try_flush_locked()
+        self._journal.close()
+
+    def _buffer_line(self, hour, line):
+        if not self._buffer:
+            self._oldest = time.monotonic()
+        self._buffer.append((hour, line))
+        self._buffered_bytes += len(line)
+
+    def _sync_journal(self):
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    def _truncate_journal(self):
+        self._journal.truncate(0)
+        self._sync_journal()
+
+    def _flush_when_due(self):
+        while not self._stopped.wait(min(self.max_seconds / 2, 1.0)):
+            with self._lock:
+                if self._buffer and time.monotonic() - self._oldest >= self.max_seconds:
+                    self._try_flush_locked()
+
+    def _try_flush_locked(self):
+        try:
+            self._flush_locked()
+        except Exception as e:
+            # The journal still holds the batch; the next flush retries it
+            print(f"Preempt batch write failed: {e}")
+
+    def _flush_locked(self):
+        if not self._buffer:
+            return
+        vm_name = vm_identity()[0]
+        start = time.perf_counter()
+        failed = True
+        try:
+            # One write per hour, oldest first; each stored hour leaves the buffer
+            while self._buffer:
+                hour = self._buffer[0][0]
+                count = 1
+                while count < len(self._buffer) and self._buffer[count][0] == hour:
+                    count += 1
+                data = b"".join(line for _, line in self._buffer[:count])
+                if self.directory:
+                    self._write_file(os.path.join(self.directory, f"{vm_name}-{hour}.ndjson"), data)
+                else:
+                    self._append_blob(f"RestartVM/{vm_name}/{hour}.ndjson", data)
+                del self._buffer[:count]
+                self._buffered_bytes -= len(data)
+                self._committed = 0
+            failed = False
+        finally:
+            _record_timing("batch_write", time.perf_counter() - start, failed=failed)
+        self._truncate_journal()
+
+    def _write_file(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "ab") as f:
+            f.write(data[self._committed:])
+            f.flush()
+            os.fsync(f.fileno())
+        self._committed = len(data)
+
+    def _append_blob(self, blob_name, data):
+        from azure.core import MatchConditions
+        from azure.core.exceptions import ResourceExistsError
+        blob_client = blob_service_client().get_blob_client(container=BLOB_CONTAINER, blob=blob_name)
+        if blob_name not in self._created_blobs:
+            try:
+                blob_client.create_append_blob(match_condition=MatchConditions.IfMissing)
+            except ResourceExistsError:
+                # Written to by an earlier run this hour
+                pass
+            self._created_blobs.add(blob_name)
+        for offset in range(self._committed, len(data), self.BLOCK_SIZE):
+            block = data[offset:offset + self.BLOCK_SIZE]
+            blob_client.append_block(block)
+            self._committed = offset + len(block)
+
+def _record_hour(record):
+    # yyyymmddhh of the record's DetectedAt (UTC), or of now if it has none
+    try:
+        detected_at = datetime.fromisoformat(record["DetectedAt"])
+    except (KeyError, TypeError, ValueError):
+        detected_at = datetime.now(timezone.utc)
+    return detected_at.astimezone(timezone.utc).strftime("%Y%m%d%H")
+
+_preempt_writer = None
+_preempt_writer_lock = threading.Lock()
+
+def preempt_writer():
+    global _preempt_writer
+    with _preempt_writer_lock:
+        if _preempt_writer is None:
+            _preempt_writer = PreemptBatchWriter(
+                PREEMPT_JOURNAL_PATH, PREEMPT_BATCH_MAX_BYTES, PREEMPT_BATCH_MAX_SECONDS, PREEMPT_BATCH_DIR
+            )
+        return _preempt_writer
 
 def write_preempt_event(event):
     # Build the entity (same as tststrtbl.py)
     row_key = f"{'EventId'}_{datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S%f')}"
 
     # Append VM metadata to the event payload
+    vm_name, subscription_id, resource_group = vm_identity()
     event["DetectedAt"] = datetime.now(timezone.utc).isoformat()
     event["VMName"] = vm_name
     event["SubscriptionId"] = subscription_id
     event["ResourceGroup"] = resource_group
 
+    if PREEMPT_OUTPUT == "batch":
+        # Durable once journaled; the blob or file write happens per batch
+        preempt_writer().append(event)
+        return
+
     # Blob path: RestartVM/<RowKey>.json
     blob_name = f"RestartVM/{row_key}.json"
     blob_content = json.dumps(event, indent=2).encode("utf-8")
-    with BlobServiceClient(
-        account_url="https://<storageaccount>.blob.core.windows.net",
-        credential=clSeccredential
-    ) as blob_service_client:
-        blob_client = blob_service_client.get_blob_client(
-            container="spotvmentity",
-            blob=blob_name
-        )
+    blob_client = blob_service_client().get_blob_client(
+        container=BLOB_CONTAINER,
+        blob=blob_name
+    )
+    start = time.perf_counter()
+    failed = True
+    try:
         blob_client.upload_blob(blob_content, overwrite=True)
-        print(f"Entity written to blob spotvmentity/{blob_name} successfully.")
+        failed = False
+    finally:
+        # Upload latency shows up next to the handler timings
+        _record_timing("blob_upload", time.perf_counter() - start, failed=failed)
+    print(f"Entity written to blob {BLOB_CONTAINER}/{blob_name} successfully.")
 
 
-def get_scheduled_events():           
-    resp = requests.get(metadata_SEurl, headers = SEheader, params = SEquery_params)
-    print(resp)
-    data = resp.json()
-    return data
+class HttpTransport:
+    """
+    Talks to the scheduled events endpoint over HTTP. listener_replay.py swaps
+    in a transport that replays recorded documents instead.
+    """
+    def __init__(self, url, headers, params):
+        self.url = url
+        self.headers = headers
+        self.params = params
 
-def confirm_scheduled_event(event_id):  
-    # This payload confirms a single event with id event_id
-    # You can confirm multiple events in a single request if needed      
-    payload = json.dumps({"StartRequests": [{"EventId": event_id }]})
-    response = requests.post(metadata_SEurl, 
-                            headers= SEheader,
-                            params = SEquery_params, 
-                            data = payload)    
-    return response.status_code
+    def get_scheduled_events(self):
+        import requests
+        resp = requests.get(self.url, headers = self.headers, params = self.params)
+        print(resp)
+        data = resp.json()
+        return data
+
+    def confirm_scheduled_event(self, event_id):
+        import requests
+        # This payload confirms a single event with id event_id
+        # You can confirm multiple events in a single request if needed
+        payload = json.dumps({"StartRequests": [{"EventId": event_id }]})
+        response = requests.post(self.url,
+                                headers= self.headers,
+                                params = self.params,
+                                data = payload)
+        return response.status_code
+
+class SystemClock:
+    def monotonic(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        sleep(seconds)
+
+# Where documents come from and approvals go, and what the poll loop sleeps on
+transport = HttpTransport(metadata_SEurl, SEheader, SEquery_params)
+clock = SystemClock()
+
+def get_scheduled_events():
+    return transport.get_scheduled_events()
+
+def confirm_scheduled_event(event_id):
+    # Raise on a rejected approval, so the handler fails and the next poll retries it
+    status_code = transport.confirm_scheduled_event(event_id)
+    if not 200 <= status_code < 300:
+        raise RuntimeError(f"Approval of event {event_id} failed with HTTP {status_code}")
+    return status_code
 
 def log(event): 
     # This is an optional placeholder for logging events to your system 
     print(event["Description"])
     return
 
+# Event handlers, matched on (EventType, EventSource, EventStatus) in
+# registration order; None matches any value and the first match wins.
+# Each handler runs on its pool with a timeout, so a slow blob upload on the
+# "io" pool never holds up approvals on the "approvals" pool.
+HANDLERS = []
+HANDLER_POOLS = {
+    "approvals": ThreadPoolExecutor(max_workers=4, thread_name_prefix="approvals"),
+    "io": ThreadPoolExecutor(max_workers=4, thread_name_prefix="io"),
+}
+# Per-handler timing: calls, total and max seconds, timeouts and errors
+handler_timings = {}
+_timings_lock = threading.Lock()
+
+# Processed (EventId, EventStatus) pairs, so each handler runs once per event
+# state across polls and scheduled-task restarts. The cache is a bounded LRU
+# persisted to a small JSON file next to this script (None: not persisted).
+PROCESSED_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "processed_events.json")
+PROCESSED_CACHE_SIZE = 1000
+processed_events = OrderedDict()
+_in_flight = set()
+_processed_lock = threading.Lock()
+
+def load_processed_events(path=None):
+    """
+    Load the processed-event cache written by a previous run, if any. A
+    missing or malformed cache leaves the cache empty.
+    """
+    path = path or PROCESSED_CACHE_PATH
+    if path is None:
+        return
+    loaded = OrderedDict()
+    try:
+        with open(path) as f:
+            pairs = json.load(f)
+    except (OSError, ValueError):
+        pairs = []
+    # Anything but a list of [EventId, EventStatus] strings is treated as corrupt
+    if isinstance(pairs, list) and all(
+        isinstance(pair, list) and len(pair) == 2 and all(isinstance(part, str) for part in pair)
+        for pair in pairs
+    ):
+        for event_id, event_status in pairs[-PROCESSED_CACHE_SIZE:]:
+            loaded[(event_id, event_status)] = None
+    with _processed_lock:
+        processed_events.clear()
+        processed_events.update(loaded)
+
+def save_processed_events(path=None):
+    """
+    Persist the processed-event cache, replacing the file atomically so a crash
+    mid-write never leaves a truncated cache behind.
+    """
+    path = path or PROCESSED_CACHE_PATH
+    if path is None:
+        return
+    with _processed_lock:
+        pairs = [list(key) for key in processed_events]
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(pairs, f)
+    os.replace(temp_path, path)
+
+def _event_key(event):
+    return (event.get("EventId"), event.get("EventStatus"))
+
+def _claim_event(event):
+    """
+    Return True if the event state still needs handling, and mark it in flight
+    so a later poll does not start it again while it runs.
+    """
+    key = _event_key(event)
+    with _processed_lock:
+        if key in processed_events:
+            processed_events.move_to_end(key)
+            return False
+        if key in _in_flight:
+            return False
+        _in_flight.add(key)
+        return True
+
+def _finish_event(event, succeeded):
+    key = _event_key(event)
+    with _processed_lock:
+        _in_flight.discard(key)
+        if succeeded:
+            processed_events[key] = None
+            if len(processed_events) > PROCESSED_CACHE_SIZE:
+                processed_events.popitem(last=False)
+
+def handler(event_type=None, event_source=None, event_status=None, when=None, pool="approvals", timeout=10):
+    """
+    Register a function as the handler for events matching the given
+    EventType, EventSource and EventStatus. when is an optional extra
+    predicate on the event.
+    """
+    def register(func):
+        HANDLERS.append({
+            "match": (event_type, event_source, event_status),
+            "when": when,
+            "pool": pool,
+            "timeout": timeout,
+            "func": func,
+            "name": func.__name__
+        })
+        return func
+    return register
+
+def find_handler(event):
+    key = (event.get("EventType"), event.get("EventSource"), event.get("EventStatus"))
+    for entry in HANDLERS:
+        if all(expected is None or expected == actual for expected, actual in zip(entry["match"], key)):
+            if entry["when"] is None or entry["when"](event):
+                return entry
+    return None
+
+def _record_timing(name, seconds=0.0, timed_out=False, failed=False):
+    with _timings_lock:
+        timing = handler_timings.setdefault(
+            name, {"calls": 0, "total": 0.0, "max": 0.0, "timeouts": 0, "errors": 0}
+        )
+        if timed_out:
+            timing["timeouts"] += 1
+            return
+        timing["calls"] += 1
+        timing["total"] += seconds
+        timing["max"] = max(timing["max"], seconds)
+        if failed:
+            timing["errors"] += 1
+
+def _run_handler(entry, event):
+    start = time.perf_counter()
+    failed = False
+    try:
+        entry["func"](event)
+    except Exception as e:
+        failed = True
+        print(f"Handler {entry['name']} failed for event {event.get('EventId')}: {e}")
+    finally:
+        _record_timing(entry["name"], time.perf_counter() - start, failed=failed)
+        # Failed handlers are retried on the next poll
+        _finish_event(event, not failed)
+
+def dispatch_events(events):
+    """
+    Run the matching handler for every event concurrently and wait for them,
+    giving up on any handler that runs past its timeout. A timed-out handler
+    keeps running in the background but no longer holds up this document.
+    Event states that were already handled, or are still being handled, are
+    skipped.
+    """
+    submitted = []
+    for event in events:
+        entry = find_handler(event)
+        if entry is None or not _claim_event(event):
+            continue
+        future = HANDLER_POOLS[entry["pool"]].submit(_run_handler, entry, event)
+        submitted.append((entry, event, future, time.monotonic() + entry["timeout"]))
+    for entry, event, future, deadline in submitted:
+        try:
+            future.result(timeout=max(deadline - time.monotonic(), 0))
+        except HandlerTimeout:
+            _record_timing(entry["name"], timed_out=True)
+            print(f"Handler {entry['name']} timed out for event {event.get('EventId')}")
+
+def print_handler_timings():
+    with _timings_lock:
+        for name, timing in sorted(handler_timings.items()):
+            average = timing["total"] / timing["calls"] if timing["calls"] else 0
+            print(f"{name}: {timing['calls']} calls, avg {average * 1000:.1f} ms, "
+                  f"max {timing['max'] * 1000:.1f} ms, {timing['timeouts']} timeouts, {timing['errors']} errors")
+
+# Events that have already started, logged for tracking
+@handler(event_status="Started")
+def handle_started(event):
+    log(event)
+
+@handler(event_type="Preempt", pool="io", timeout=30)
+def handle_preempt(event):
+    log(event)
+    write_preempt_event(event)
+
+# Approve all user initiated events. These are typically created by an
+# administrator and approving them immediately can help to avoid delays
+# in admin actions
+@handler(event_source="User")
+def handle_user_event(event):
+    confirm_scheduled_event(event["EventId"])
+
+# For this application, freeze events less that 9 seconds are considered
+# no impact. This will immediately approve them
+@handler(event_type="Freeze", when=lambda event: 0 <= int(event["DurationInSeconds"]) < 9)
+def handle_short_freeze(event):
+    confirm_scheduled_event(event["EventId"])
+
+# Events that may be impactful (for example reboot or redeploy) may need custom
+# handling for your application
+@handler()
+def handle_impactful_event(event):
+    #TODO Custom handling for impactful events
+    log(event)
+
 def advanced_sample(last_document_incarnation): 
     # Poll every second to see if there are new scheduled events to process
     # Since some events may have necessarily short warning periods, it is 
     # recommended to poll frequently
     found_document_incarnation = last_document_incarnation
     while (last_document_incarnation == found_document_incarnation):
-        sleep(1)
+        clock.sleep(1)
         payload = get_scheduled_events()    
         found_document_incarnation = payload["DocumentIncarnation"]        
         
@@ -110,33 +582,8 @@ def advanced_sample(last_document_incarnation):
     # even if you won't be actioning on them right away
     for event in payload["Events"]:
         print(event)
-        # Events that have already started, logged for tracking
-        if (event["EventStatus"] == "Started"):
-            log(event)
-
-        elif (event["EventType"] == "Preempt"):
-            log(event)
-            write_preempt_event(event)
-            
-
-        # Approve all user initiated events. These are typically created by an 
-        # administrator and approving them immediately can help to avoid delays 
-        # in admin actions
-        elif (event["EventSource"] == "User"):
-            confirm_scheduled_event(event["EventId"])            
-            
-        # For this application, freeze events less that 9 seconds are considered
-        # no impact. This will immediately approve them
-        elif (event["EventType"] == "Freeze" and 
-            int(event["DurationInSeconds"]) >= 0  and 
-            int(event["DurationInSeconds"]) < 9):
-            confirm_scheduled_event(event["EventId"])
-            
-        # Events that may be impactful (for example reboot or redeploy) may need custom 
-        # handling for your application
-        else: 
-            #TODO Custom handling for impactful events
-            log(event)
+    dispatch_events(payload["Events"])
+    save_processed_events()
     print("Processed events from document: " + str(found_document_incarnation))
     
     return found_document_incarnation
@@ -144,6 +591,13 @@ def advanced_sample(last_document_incarnation):
 def main():
     # This will track the last set of events seen 
     last_document_incarnation = "-1"
+    # Events handled by earlier runs are skipped, so a restart doesn't repeat work
+    load_processed_events()
+    if PREEMPT_OUTPUT == "batch":
+        # Write Preempt records a previous run journaled but never stored
+        recovered = preempt_writer().recover()
+        if recovered:
+            print(f"Recovered {recovered} journaled Preempt records")
     # the task scheduler granularity is 5 minutes, so this sample will run for 5 minutes before exiting and within this 5 minutes it will poll for new events every 5 seconds. You can adjust this as needed
     max_duration = timedelta(minutes=5)
     poll_interval = 5  # seconds
@@ -151,8 +605,11 @@ def main():
 
     while (datetime.now(timezone.utc) - start_time) < max_duration:
         last_document_incarnation = advanced_sample(last_document_incarnation)
-        sleep(poll_interval)
+        clock.sleep(poll_interval)
 
+    if _preempt_writer is not None:
+        _preempt_writer.close()
+    print_handler_timings()
     print("Reached 5-minute time limit. Exiting.")
 
 if __name__ == '__main__':
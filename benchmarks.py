@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+In-process micro-benchmarks for the code that runs on every poll.
+
+Each case builds its own app with main.create_app() and drives it through the
+Flask test client (no network) at 1, 100 and 10k events/VMs, and measures
+ops/sec and peak bytes allocated per op.
+
+Allocations are deterministic, so they are compared against the committed
+baseline (benchmark_baseline.json) everywhere. Throughput depends on the
+machine and its load, so it is reported relative to a calibration loop run
+in the same process, and only compared against a speed baseline recorded on
+the same machine (benchmark_baseline.local.json, not committed). The script
+exits non-zero when a case regresses past the configured thresholds.
+
+    python benchmarks.py                    # compare against the baselines
+    python benchmarks.py --record-speed     # record this machine's speed baseline
+    python benchmarks.py --update-baseline  # record a new allocation baseline
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+
+import main
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+SPEED_BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.local.json")
+DEFAULT_SIZES = [1, 100, 10000]
+BENCH_SCENARIO = "Live Migration - Dev Timing"
+
+
+def _resources(size):
+    return [f"vmss_vm{i}" for i in range(size)]
+
+
+def _new_app():
+    app = main.create_app({"CLOCK": main.ManualClock()})
+    app.extensions["simulator"].active_scenario = BENCH_SCENARIO
+    return app
+
+
+def _publish_scheduled(simulator, size):
+    """
+    Make a Scheduled event covering `size` VMs the current event.
+    """
+    scenario = simulator.scenarios[BENCH_SCENARIO]
+    simulator.last_event = {
+        "EventId": str(uuid.uuid4()),
+        "Scenario": BENCH_SCENARIO,
+        "EventStatus": "Scheduled",
+        "ActiveScenario": scenario,
+        "NotBefore": simulator.compute_not_before(scenario),
+        "Resources": _resources(size)
+    }
+    simulator.last_doc_incarnation += 1
+
+
+def _playback_events(simulator, size):
+    return [simulator.start_playback_event(BENCH_SCENARIO, [vm]) for vm in _resources(size)]
+
+
+def case_get_scheduledevents(app, size):
+    # size stored events, one of which changes before every poll, so each GET
+    # renders a new document rather than hitting the memoized one
+    client = app.test_client(use_cookies=False)
+    simulator = app.extensions["simulator"]
+    changing = _playback_events(simulator, size)[-1]
+
+    def op():
+        simulator.publish_event(changing)
+        client.get("/metadata/scheduledevents?api-version=2020-07-01")
+    return op
+
+
+def case_get_scheduledevents_cached(app, size):
+    # Repeated polls of an unchanged document: the memoized fast path
+    client = app.test_client(use_cookies=False)
+    _publish_scheduled(app.extensions["simulator"], size)
+
+    def op():
+        client.get("/metadata/scheduledevents?api-version=2020-07-01")
+    return op
+
+
+def case_post_scheduledevents(app, size):
+    # size stored Scheduled events; every POST approves one of them for real,
+    # which moves it to Started and renders the new document. The event is put
+    # back to Scheduled before the next POST.
+    client = app.test_client(use_cookies=False)
+    simulator = app.extensions["simulator"]
+    scheduled = _playback_events(simulator, size)[-1]
+    body = json.dumps({"StartRequests": [{"EventId": scheduled["EventId"]}]})
+
+    def op():
+        simulator.publish_event(scheduled)
+        client.post(
+            "/metadata/scheduledevents?api-version=2020-07-01",
+            data=body,
+            headers={"Metadata": "true"}
+        )
+    return op
+
+
+def case_parse_startrequests(app, size):
+    body = json.dumps({"StartRequests": [{"EventId": str(uuid.uuid4())} for _ in range(size)]})
+
+    def op():
+        main.parse_start_requests(json.loads(body))
+    return op
+
+
+def case_generate_event(app, size):
+    client = app.test_client(use_cookies=False)
+    form = {"event_status": "Scheduled", "resources": ",".join(_resources(size))}
+
+    def op():
+        client.post("/generate-event", data=form)
+    return op
+
+
+def case_get_scheduledevents_delta(app, size):
+    # size stored events, one of which changes between polls; the delta
+    # should cost the same however many events the document holds
+    client = app.test_client(use_cookies=False)
+    simulator = app.extensions["simulator"]
+    changing = _playback_events(simulator, size)[-1]
+
+    def op():
+        since = simulator.last_doc_incarnation
+        simulator.publish_event(changing)
+        client.get(f"/metadata/scheduledevents/delta?since={since}&api-version=2020-07-01")
+    return op
+
+
+def case_auto_run_tick(app, size):
+    # One tick is one clock.sleep(1) step of auto_run_scenario; a full run of
+    # the scenario is timed and divided by the number of ticks it took.
+    simulator = app.extensions["simulator"]
+    scenario = simulator.scenarios[BENCH_SCENARIO]
+    ticks = sum(scenario["EventStatus"].values())
+
+    def op():
+        simulator.last_event = None
+        simulator.auto_run_scenario(threading.Event())
+    op.ops_per_call = ticks
+    return op
+
+
+# (name, factory, sized). Unsized cases only run once.
+CASES = [
+    ("get_scheduledevents", case_get_scheduledevents, True),
+    ("get_scheduledevents_cached", case_get_scheduledevents_cached, True),
+    ("post_scheduledevents", case_post_scheduledevents, True),
+    ("parse_startrequests", case_parse_startrequests, True),
+    ("generate_event", case_generate_event, True),
+    ("get_scheduledevents_delta", case_get_scheduledevents_delta, True),
+    ("auto_run_tick", case_auto_run_tick, False),
+]
+
+
+def calibration_op():
+    # A fixed pure-Python workload; throughput is reported relative to it, so
+    # a slower or busier machine scales every case (and this) alike
+    json.loads(json.dumps({str(i): [i, str(i)] for i in range(50)}))
+
+
+def machine_id():
+    return f"{platform.node()}/{platform.machine()}/{os.cpu_count()} CPUs/Python {platform.python_version()}"
+
+
+def _timed_slice(op, seconds):
+    ops_per_call = getattr(op, "ops_per_call", 1)
+    calls = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < seconds:
+        op()
+        calls += 1
+        elapsed = time.perf_counter() - start
+    return calls * ops_per_call / elapsed
+
+
+def measure(op, min_time, repeats=5):
+    """
+    Return (ops/sec, speed relative to calibration_op(), peak bytes allocated
+    per op) for a benchmark op. The op's time is split into repeats slices,
+    each followed by a slice of the calibration loop; the relative speed is
+    the median of the paired ratios, so load that comes and goes during the
+    run affects both sides of a pair alike.
+    """
+    ops_per_call = getattr(op, "ops_per_call", 1)
+    op()  # warm up caches and lazy imports
+    best = 0.0
+    ratios = []
+    for _ in range(repeats):
+        ops_per_sec = _timed_slice(op, min_time / repeats)
+        ratios.append(ops_per_sec / _timed_slice(calibration_op, min_time / repeats / 4))
+        best = max(best, ops_per_sec)
+    ratios.sort()
+    relative_speed = ratios[len(ratios) // 2]
+
+    # Stray allocations (caches filling, the GC) only ever add, so take the smallest
+    peaks = []
+    tracemalloc.start()
+    try:
+        for _ in range(5):
+            tracemalloc.reset_peak()
+            baseline, _ = tracemalloc.get_traced_memory()
+            op()
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append(max(peak - baseline, 0))
+    finally:
+        tracemalloc.stop()
+    alloc_per_op = min(peaks) / ops_per_call
+    return best, relative_speed, alloc_per_op
+
+
+def run_benchmarks(sizes, min_time, name_filter=None, repeats=5):
+    results = {}
+    for name, factory, sized in CASES:
+        for size in (sizes if sized else [1]):
+            key = f"{name}[{size}]" if sized else name
+            if name_filter and name_filter not in key:
+                continue
+            # Don't let garbage from the previous case's app be collected on this one's time
+            gc.collect()
+            ops_per_sec, relative_speed, alloc_per_op = measure(factory(_new_app(), size), min_time, repeats)
+            results[key] = {
+                "ops_per_sec": round(ops_per_sec, 1),
+                "relative_speed": round(relative_speed, 6),
+                "alloc_bytes_per_op": round(alloc_per_op)
+            }
+            print(f"{key:<36} {ops_per_sec:>14,.1f} ops/s {relative_speed:>12,.4g}x cal {alloc_per_op:>14,.0f} B/op")
+    return results
+
+
+def compare_allocations(results, baseline, alloc_threshold):
+    """
+    Return regression messages for results that allocate more per op than
+    the baseline allows.
+    """
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if not base:
+            continue
+        # Small absolute slack so tiny cases don't fail on a few stray bytes
+        max_alloc = base["alloc_bytes_per_op"] * (1 + alloc_threshold) + 1024
+        if result["alloc_bytes_per_op"] > max_alloc:
+            regressions.append(
+                f"{key}: {result['alloc_bytes_per_op']:,} B/op is above baseline "
+                f"{base['alloc_bytes_per_op']:,} B/op by more than {alloc_threshold:.0%}"
+            )
+    return regressions
+
+
+def compare_speed(results, speed_baseline, ops_threshold):
+    """
+    Return regression messages for results slower than a speed baseline
+    recorded on this machine. Speeds are relative to the calibration loop, so
+    a uniformly slower run (a busy machine) does not count as a regression.
+    """
+    regressions = []
+    cases = speed_baseline.get("Cases", {})
+    for key, result in results.items():
+        base = cases.get(key)
+        if not base:
+            continue
+        if result["relative_speed"] < base["relative_speed"] * (1 - ops_threshold):
+            regressions.append(
+                f"{key}: {result['relative_speed']:.4g}x calibration is below baseline "
+                f"{base['relative_speed']:.4g}x by more than {ops_threshold:.0%}"
+            )
+    return regressions
+
+
+def _write_json(path, document):
+    with open(path, "w") as f:
+        json.dump(document, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the scheduled events hot paths")
+    parser.add_argument("--sizes", type=str, default=",".join(str(s) for s in DEFAULT_SIZES), help="Comma separated event/VM counts")
+    parser.add_argument("--min-time", type=float, default=0.5, help="Seconds to run each case")
+    parser.add_argument("--repeats", type=int, default=5, help="Timed runs per case; the best one counts")
+    parser.add_argument("--filter", type=str, help="Only run cases whose name contains this string")
+    parser.add_argument("--baseline", type=str, default=BASELINE_PATH, help="Allocation baseline file")
+    parser.add_argument("--speed-baseline", type=str, default=SPEED_BASELINE_PATH, help="Speed baseline file for this machine")
+    parser.add_argument("--update-baseline", action="store_true", help="Write the allocations as the new baseline")
+    parser.add_argument("--record-speed", action="store_true", help="Write the speeds as this machine's speed baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed relative speed regression (fraction)")
+    parser.add_argument("--alloc-threshold", type=float, default=0.10, help="Allowed allocation regression (fraction)")
+
+    args = parser.parse_args()
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    results = run_benchmarks(sizes, args.min_time, args.filter, args.repeats)
+
+    if args.update_baseline or args.record_speed:
+        if args.update_baseline:
+            baseline = {}
+            if os.path.exists(args.baseline):
+                with open(args.baseline) as f:
+                    baseline = json.load(f)
+            baseline.update({key: {"alloc_bytes_per_op": r["alloc_bytes_per_op"]} for key, r in results.items()})
+            _write_json(args.baseline, baseline)
+            print(f"Allocation baseline written to {args.baseline}")
+        if args.record_speed:
+            speed_baseline = {"Machine": machine_id(), "Cases": {}}
+            if os.path.exists(args.speed_baseline):
+                with open(args.speed_baseline) as f:
+                    speed_baseline = json.load(f)
+                if speed_baseline.get("Machine") != machine_id():
+                    speed_baseline = {"Machine": machine_id(), "Cases": {}}
+            speed_baseline["Cases"].update({key: {"relative_speed": r["relative_speed"]} for key, r in results.items()})
+            _write_json(args.speed_baseline, speed_baseline)
+            print(f"Speed baseline for {machine_id()} written to {args.speed_baseline}")
+        sys.exit(0)
+
+    regressions = []
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions += compare_allocations(results, json.load(f), args.alloc_threshold)
+    else:
+        print(f"No allocation baseline at {args.baseline}; run with --update-baseline first.")
+    speed_baseline = None
+    if os.path.exists(args.speed_baseline):
+        with open(args.speed_baseline) as f:
+            speed_baseline = json.load(f)
+    if speed_baseline is not None and speed_baseline.get("Machine") == machine_id():
+        regressions += compare_speed(results, speed_baseline, args.threshold)
+    else:
+        # Throughput from another machine says nothing about this one
+        print("\nNo speed baseline for this machine; speeds not compared (run with --record-speed first).")
+    if regressions:
+        print("\nRegressions:")
+        for message in regressions:
+            print(f"- {message}")
+        sys.exit(1)
+    print("\nNo regressions against baseline.")
@@ -0,0 +1,406 @@
+"""
+Local stand-in for Azure Blob Storage, so the Listener's Preempt uploads can
+be exercised and load-tested without a storage account.
+
+Enabled with the BLOB_STORE setting: "memory" keeps blobs in memory, any
+other value is a directory blobs are written under. The routes are mounted at
+/blob, so the Listener (or any azure-storage-blob client) uses
+http://<mock-server>/blob as its account URL with no credential. Supported
+calls are the ones block and append blob uploads and download_blob() make:
+
+    PUT /blob/<container>?restype=container         create container
+    PUT /blob/<container>/<blob>                     put a BlockBlob, or create an AppendBlob
+    PUT /blob/<container>/<blob>?comp=appendblock    append to an AppendBlob
+    PUT /blob/<container>/<blob>?comp=block          stage a block (Put Block)
+    PUT /blob/<container>/<blob>?comp=blocklist      commit staged blocks (Put Block List)
+    GET /blob/<container>/<blob>                     download, whole or a byte range
+    GET /blob                                        list blobs (JSON)
+    GET /metrics/blob                                upload latency and throughput
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+import uuid
+import xml.etree.ElementTree as ElementTree
+from collections import deque
+from email.utils import formatdate
+
+from flask import Blueprint, Response, current_app, jsonify, request
+
+
+class MemoryBlobs:
+    """
+    Blobs kept in a dict keyed by (container, blob name).
+    """
+    def __init__(self):
+        self._blobs = {}
+
+    def exists(self, container, name):
+        return (container, name) in self._blobs
+
+    def write(self, container, name, data):
+        self._blobs[(container, name)] = bytearray(data)
+
+    def append(self, container, name, data):
+        blob = self._blobs[(container, name)]
+        offset = len(blob)
+        blob += data
+        return offset
+
+    def read(self, container, name):
+        return bytes(self._blobs[(container, name)])
+
+    def list(self):
+        return [(container, name, len(data)) for (container, name), data in sorted(self._blobs.items())]
+
+
+class DirectoryBlobs:
+    """
+    Blobs written as files under root/<container>/<blob name>.
+    """
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, container, name):
+        path = os.path.abspath(os.path.join(self.root, container, name))
+        if not path.startswith(self.root + os.sep):
+            raise KeyError(name)
+        return path
+
+    def exists(self, container, name):
+        return os.path.isfile(self._path(container, name))
+
+    def write(self, container, name, data):
+        path = self._path(container, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def append(self, container, name, data):
+        path = self._path(container, name)
+        if not os.path.isfile(path):
+            raise KeyError(name)
+        with open(path, "ab") as f:
+            offset = f.tell()
+            f.write(data)
+        return offset
+
+    def read(self, container, name):
+        try:
+            with open(self._path(container, name), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            raise KeyError(name)
+
+    def list(self):
+        blobs = []
+        for directory, _, files in os.walk(self.root):
+            for file_name in files:
+                path = os.path.join(directory, file_name)
+                container, _, name = os.path.relpath(path, self.root).replace(os.sep, "/").partition("/")
+                blobs.append((container, name, os.path.getsize(path)))
+        return sorted(blobs)
+
+
+class BlobError(Exception):
+    """
+    A request the real service would refuse: HTTP status, x-ms-error-code and
+    message.
+    """
+    def __init__(self, status, code, message):
+        super().__init__(status, code, message)
+        self.status = status
+        self.code = code
+        self.message = message
+
+
+def _blob_not_found():
+    return BlobError(404, "BlobNotFound", "The specified blob does not exist.")
+
+
+def _invalid_block_list():
+    return BlobError(400, "InvalidBlockList", "The specified block list is invalid.")
+
+
+class BlobStore:
+    """
+    A blob backend plus upload metrics: count, bytes and the time each upload
+    took to receive and store, with throughput over the busy period. Blob
+    operations are serialized on one lock; names the backend can't store
+    raise KeyError, and requests the service would refuse raise BlobError.
+    """
+    def __init__(self, location, max_samples=10000):
+        self.blobs = MemoryBlobs() if location == "memory" else DirectoryBlobs(location)
+        self.location = location
+        self._append_blob_names = set()
+        # (container, blob) -> {block id: data} staged by Put Block
+        self._staged_blocks = {}
+        # (container, blob) -> [(block id, offset, length)] of the last Put Block List
+        self._committed_blocks = {}
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=max_samples)
+        self._uploads = 0
+        self._bytes = 0
+        self._first_upload = None
+        self._last_upload = None
+
+    def put_blob(self, container, name, data, blob_type="BlockBlob", if_none_match=False):
+        """
+        Store data as a block blob, or create an empty append blob.
+        """
+        key = (container, name)
+        with self._lock:
+            if if_none_match and self.blobs.exists(container, name):
+                raise BlobError(409, "BlobAlreadyExists", "The specified blob already exists.")
+            if blob_type == "AppendBlob":
+                self.blobs.write(container, name, b"")
+                self._append_blob_names.add(key)
+            else:
+                self.blobs.write(container, name, data)
+                self._append_blob_names.discard(key)
+            self._committed_blocks.pop(key, None)
+
+    def append_block(self, container, name, data):
+        """
+        Append data to an append blob and return the offset it landed at.
+        """
+        with self._lock:
+            if (container, name) not in self._append_blob_names and not self.blobs.exists(container, name):
+                raise _blob_not_found()
+            return self.blobs.append(container, name, data)
+
+    def stage_block(self, container, name, block_id, data):
+        """
+        Stage one uncommitted block of a block blob. A block id that is already
+        staged is refused rather than silently replaced.
+        """
+        with self._lock:
+            staged = self._staged_blocks.setdefault((container, name), {})
+            if block_id in staged:
+                raise _invalid_block_list()
+            staged[block_id] = bytes(data)
+
+    def commit_block_list(self, container, name, block_list):
+        """
+        Write a block blob from block_list, (kind, block id) pairs where kind
+        is Committed, Uncommitted or Latest as in a Put Block List body. Every
+        block must exist in the list it is taken from; the staged blocks are
+        discarded once the blob is written.
+        """
+        key = (container, name)
+        with self._lock:
+            staged = self._staged_blocks.get(key, {})
+            committed = {block_id: (offset, length) for block_id, offset, length in self._committed_blocks.get(key, ())}
+            current = self.blobs.read(container, name) if committed else b""
+            chunks = []
+            blocks = []
+            offset = 0
+            for kind, block_id in block_list:
+                if kind in ("Uncommitted", "Latest") and block_id in staged:
+                    data = staged[block_id]
+                elif kind in ("Committed", "Latest") and block_id in committed:
+                    start, length = committed[block_id]
+                    data = current[start:start + length]
+                else:
+                    raise _invalid_block_list()
+                chunks.append(data)
+                blocks.append((block_id, offset, len(data)))
+                offset += len(data)
+            body = b"".join(chunks)
+            self.blobs.write(container, name, body)
+            self._append_blob_names.discard(key)
+            self._staged_blocks.pop(key, None)
+            self._committed_blocks[key] = blocks
+            return body
+
+    def read(self, container, name):
+        """
+        Return a blob's contents and type (BlockBlob or AppendBlob).
+        """
+        with self._lock:
+            data = self.blobs.read(container, name)
+            return data, "AppendBlob" if (container, name) in self._append_blob_names else "BlockBlob"
+
+    def list(self):
+        """
+        (container, blob name, size) of every stored blob, sorted.
+        """
+        with self._lock:
+            return self.blobs.list()
+
+    def blob_type(self, container, name):
+        """
+        BlockBlob, AppendBlob or None if there is no such blob.
+        """
+        with self._lock:
+            if not self.blobs.exists(container, name):
+                return None
+            return "AppendBlob" if (container, name) in self._append_blob_names else "BlockBlob"
+
+    def staged_block_ids(self, container, name):
+        """
+        Ids of the blocks staged for a blob and not yet committed, in staging order.
+        """
+        with self._lock:
+            return list(self._staged_blocks.get((container, name), ()))
+
+    def committed_block_ids(self, container, name):
+        """
+        Ids of the blocks of the blob's last Put Block List, in blob order.
+        """
+        with self._lock:
+            return [block_id for block_id, _, _ in self._committed_blocks.get((container, name), ())]
+
+    def record_upload(self, size, seconds):
+        now = time.monotonic()
+        with self._lock:
+            self._uploads += 1
+            self._bytes += size
+            self._latencies.append(seconds)
+            self._first_upload = self._first_upload or now - seconds
+            self._last_upload = now
+
+    def report(self):
+        with self._lock:
+            samples = sorted(self._latencies)
+            elapsed = (self._last_upload - self._first_upload) if self._uploads else 0
+
+        def percentile(fraction):
+            return round(samples[min(int(len(samples) * fraction), len(samples) - 1)] * 1000, 3) if samples else None
+
+        return {
+            "Location": self.location,
+            "Uploads": self._uploads,
+            "Bytes": self._bytes,
+            "LatencyMs": {
+                "P50": percentile(0.5),
+                "P90": percentile(0.9),
+                "P99": percentile(0.99),
+                "Max": round(samples[-1] * 1000, 3) if samples else None
+            },
+            "UploadsPerSecond": round(self._uploads / elapsed, 1) if elapsed > 0 else None,
+            "BytesPerSecond": round(self._bytes / elapsed, 1) if elapsed > 0 else None
+        }
+
+
+bp = Blueprint("blobstore", __name__)
+
+# x-ms-range / Range values the SDKs send: bytes=<start>-[<end>]
+_BYTE_RANGE = re.compile(r"bytes=(\d+)-(\d*)$")
+
+
+def _store():
+    return current_app.extensions["blob_store"]
+
+
+def _error(status, code, message):
+    body = f'<?xml version="1.0" encoding="utf-8"?><Error><Code>{code}</Code><Message>{message}</Message></Error>'
+    return Response(body, status=status, mimetype="application/xml", headers={"x-ms-error-code": code})
+
+
+def _created(data, **headers):
+    return Response(status=201, headers=dict({
+        "ETag": f'"{hashlib.md5(data).hexdigest()}"',
+        "Last-Modified": formatdate(usegmt=True),
+        "x-ms-request-id": str(uuid.uuid4()),
+        "x-ms-version": request.headers.get("x-ms-version", "2021-08-06"),
+        "x-ms-request-server-encrypted": "false"
+    }, **headers))
+
+
+@bp.route('/blob/<container>', methods=['PUT'])
+def create_container(container):
+    return _created(b"")
+
+
+@bp.route('/blob/<container>/<path:blob_name>', methods=['PUT'])
+def put_blob(container, blob_name):
+    """
+    Store a block blob, create an append blob, append a block to one, or
+    stage and commit the blocks of a block blob.
+    """
+    start = time.perf_counter()
+    store = _store()
+    data = request.get_data()
+    comp = request.args.get("comp")
+    headers = {}
+    try:
+        if comp == "appendblock":
+            offset = store.append_block(container, blob_name, data)
+            headers = {"x-ms-blob-append-offset": str(offset), "x-ms-blob-committed-block-count": "1"}
+        elif comp == "block":
+            block_id = request.args.get("blockid")
+            if not block_id:
+                return _error(400, "InvalidQueryParameterValue", "Value for one of the query parameters specified in the request URI is invalid.")
+            store.stage_block(container, blob_name, block_id, data)
+        elif comp == "blocklist":
+            try:
+                block_list = [(element.tag, element.text or "") for element in ElementTree.fromstring(data)]
+            except ElementTree.ParseError:
+                return _error(400, "InvalidXmlDocument", "XML specified is not syntactically valid.")
+            data = store.commit_block_list(container, blob_name, block_list)
+        else:
+            store.put_blob(
+                container, blob_name, data,
+                blob_type=request.headers.get("x-ms-blob-type", "BlockBlob"),
+                if_none_match=request.headers.get("If-None-Match") == "*"
+            )
+    except BlobError as e:
+        return _error(e.status, e.code, e.message)
+    except KeyError:
+        return _error(400, "InvalidResourceName", "The specified resource name is not valid.")
+    if comp != "block":
+        store.record_upload(len(data), time.perf_counter() - start)
+    return _created(data, **headers)
+
+
+@bp.route('/blob/<container>/<path:blob_name>', methods=['GET'])
+def get_blob(container, blob_name):
+    try:
+        data, blob_type = _store().read(container, blob_name)
+    except KeyError:
+        return _error(404, "BlobNotFound", "The specified blob does not exist.")
+    headers = {
+        "x-ms-blob-type": blob_type,
+        "ETag": f'"{hashlib.md5(data).hexdigest()}"',
+        "Last-Modified": formatdate(usegmt=True),
+        "Accept-Ranges": "bytes",
+        "x-ms-request-id": str(uuid.uuid4()),
+        "x-ms-version": request.headers.get("x-ms-version", "2021-08-06")
+    }
+    requested = request.headers.get("x-ms-range") or request.headers.get("Range")
+    if not requested:
+        return Response(data, mimetype="application/octet-stream", headers=headers)
+    # Ranged downloads, as download_blob() makes them: 206 with Content-Range
+    match = _BYTE_RANGE.match(requested)
+    if match is None:
+        return _error(400, "InvalidHeaderValue", "The value for one of the HTTP headers is not in the correct format.")
+    start = int(match.group(1))
+    if start >= len(data):
+        response = _error(416, "InvalidRange", "The range specified is invalid for the current size of the resource.")
+        response.headers["Content-Range"] = f"bytes */{len(data)}"
+        return response
+    end = min(int(match.group(2)) if match.group(2) else len(data) - 1, len(data) - 1)
+    headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+    return Response(data[start:end + 1], status=206, mimetype="application/octet-stream", headers=headers)
+
+
+@bp.route('/blob', methods=['GET'])
+def list_blobs():
+    blobs = _store().list()
+    return jsonify({"Blobs": [
+        {"Container": container, "Name": name, "Size": size} for container, name, size in blobs
+    ]}), 200
+
+
+@bp.route('/metrics/blob', methods=['GET'])
+def blob_metrics():
+    return jsonify(_store().report()), 200
+
+
+def init_app(app, location):
+    app.extensions["blob_store"] = BlobStore(location)
+    app.register_blueprint(bp)
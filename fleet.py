@@ -0,0 +1,148 @@
+"""
+Statistical fleet-wide maintenance schedule generator.
+
+generate_schedule() samples a full per-VM maintenance schedule for a fleet
+with vectorized NumPy draws, and play_schedule() streams it into a
+simulator's event store on the shared deadline queue, one arrival at a time.
+"""
+import math
+
+import numpy as np
+
+import main
+import scenario_defaults
+from scenario_defaults import DEFAULT_MIX
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+ARRIVAL_DISTRIBUTIONS = ("poisson", "waves")
+
+
+def resolve_mix(mix, scenarios):
+    """
+    scenario_defaults.resolve_mix() with the weights as a NumPy array.
+    """
+    names, weights = scenario_defaults.resolve_mix(mix, scenarios)
+    return names, np.asarray(weights, dtype=np.float64)
+
+
+class FleetSchedule:
+    """
+    Maintenance events for a fleet, sorted by arrival time. Each row is an
+    arrival offset in seconds, a VM index and an index into scenario_names.
+    """
+    def __init__(self, times, vm_indices, scenario_indices, scenario_names, fleet_size, span_seconds, vm_prefix="vm"):
+        self.times = times
+        self.vm_indices = vm_indices
+        self.scenario_indices = scenario_indices
+        self.scenario_names = scenario_names
+        self.fleet_size = fleet_size
+        self.span_seconds = span_seconds
+        self.vm_prefix = vm_prefix
+
+    def __len__(self):
+        return len(self.times)
+
+    def vm_name(self, vm_index):
+        return f"{self.vm_prefix}{vm_index}"
+
+    def row(self, i):
+        return (
+            float(self.times[i]),
+            self.vm_name(int(self.vm_indices[i])),
+            self.scenario_names[self.scenario_indices[i]]
+        )
+
+    def rows(self):
+        """
+        Yield (offset_seconds, vm_name, scenario_name) in arrival order.
+        """
+        for i in range(len(self)):
+            yield self.row(i)
+
+    def for_vm(self, vm_index):
+        """
+        Return the rows scheduled for one VM.
+        """
+        return [self.row(i) for i in np.flatnonzero(self.vm_indices == vm_index)]
+
+    def count_by_scenario(self):
+        counts = np.bincount(self.scenario_indices, minlength=len(self.scenario_names))
+        return {name: int(count) for name, count in zip(self.scenario_names, counts)}
+
+
+def generate_schedule(fleet_size, span_days, rate_per_day=0.1, arrival="poisson", mix=None,
+                      wave_count=None, wave_width_hours=2.0, seed=None, vm_prefix="vm", scenarios=None):
+    """
+    Sample a maintenance schedule for fleet_size VMs over span_days simulated
+    days. Each VM gets Poisson(rate_per_day * span_days) events.
+
+    arrival picks how event times are spread:
+    - "poisson": uniformly over the span, i.e. a homogeneous Poisson process.
+    - "waves": clustered around wave_count maintenance waves (default one per
+      simulated day) with a normal spread of wave_width_hours.
+
+    Mix keys are looked up in scenarios, the predefined scenarios by default.
+    """
+    if not (math.isfinite(span_days) and span_days > 0):
+        raise ValueError("span_days must be a positive number")
+    if fleet_size < 0 or not (math.isfinite(rate_per_day) and rate_per_day >= 0):
+        raise ValueError("fleet_size and rate_per_day must be zero or more")
+    if not (math.isfinite(wave_width_hours) and wave_width_hours >= 0):
+        raise ValueError("wave_width_hours must be zero or more")
+    if arrival not in ARRIVAL_DISTRIBUTIONS:
+        raise ValueError(f"arrival must be one of {', '.join(ARRIVAL_DISTRIBUTIONS)}")
+    names, weights = resolve_mix(mix or DEFAULT_MIX, scenarios or main.default_scenarios())
+    rng = np.random.default_rng(seed)
+    span_seconds = span_days * SECONDS_PER_DAY
+
+    counts = rng.poisson(rate_per_day * span_days, size=fleet_size)
+    vm_indices = np.repeat(np.arange(fleet_size, dtype=np.int32), counts)
+    total = len(vm_indices)
+
+    if arrival == "poisson":
+        times = rng.uniform(0, span_seconds, size=total)
+    else:
+        wave_count = wave_count or max(int(round(span_days)), 1)
+        centers = rng.uniform(0, span_seconds, size=wave_count)
+        times = centers[rng.integers(0, wave_count, size=total)]
+        times += rng.normal(0, wave_width_hours * 3600, size=total)
+        np.clip(times, 0, span_seconds, out=times)
+
+    scenario_indices = rng.choice(len(names), size=total, p=weights).astype(np.int16)
+
+    order = np.argsort(times, kind="stable")
+    return FleetSchedule(
+        times[order],
+        vm_indices[order],
+        scenario_indices[order],
+        names,
+        fleet_size,
+        span_seconds,
+        vm_prefix
+    )
+
+
+def play_schedule(simulator, schedule, speed=1.0):
+    """
+    Stream a schedule into a simulator's event store. Only the next arrival is
+    queued at any time, so memory follows the active events rather than the
+    size of the schedule. speed > 1 plays simulated time faster than the clock.
+    """
+    if not len(schedule):
+        return
+    start = simulator.clock.monotonic()
+
+    def arrive(i):
+        # Publish every row due at this deadline, then queue the next arrival
+        elapsed = simulator.clock.monotonic() - start
+        while True:
+            _, vm_name, scenario_name = schedule.row(i)
+            simulator.start_playback_event(scenario_name, [vm_name], speed=speed)
+            i += 1
+            if i >= len(schedule) or schedule.times[i] / speed > elapsed:
+                break
+        if i < len(schedule):
+            simulator.deadline_queue.call_at(start + schedule.times[i] / speed, arrive, i)
+
+    simulator.deadline_queue.call_at(start + schedule.times[0] / speed, arrive, 0)
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""
+Offline replay harness for the Listener's decision logic.
+
+Feeds a recorded or generated stream of scheduled events documents through
+Listener.advanced_sample() in-process: the HTTP transport is replaced by one
+that serves the documents, and the poll loop sleeps on a replay clock that
+skips its sleeps instantly. Every decision the handlers make (confirm, log,
+upload) is recorded instead of performed, with its latency from the moment
+the event state appeared in the stream. Only the Listener's own processing
+time is counted towards that latency and towards decisions per second.
+
+Recorded streams are JSON lines files, one document per line, either bare
+IMDS documents (one poll interval apart) or {"At": seconds, "Document": {...}}.
+
+    python listener_replay.py --generate 1000000
+    python listener_replay.py --documents recorded.jsonl --report replay.json
+    python listener_replay.py --generate 10000 --save stream.jsonl
+"""
+import argparse
+import contextlib
+import json
+import random
+import threading
+import time
+import uuid
+from array import array
+
+import Listener
+import scenario_defaults
+
+
+class ReplayFinished(Exception):
+    """
+    Raised by the transport once every document has been served.
+    """
+
+
+class ReplayClock:
+    """
+    A clock whose sleeps return at once and move it forward. Real time spent
+    in the Listener counts too, so latencies include processing time; time
+    the transport spends producing documents is excluded.
+    """
+    def __init__(self):
+        self._start = time.perf_counter()
+        self._offset = 0.0
+        self.excluded = 0.0
+
+    def monotonic(self):
+        return self._offset + time.perf_counter() - self._start - self.excluded
+
+    def sleep(self, seconds):
+        self._offset += seconds
+
+
+class _NullWriter:
+    def write(self, text):
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+class DecisionRecorder:
+    """
+    Counts decisions per (EventType, decision) and keeps their latencies.
+    """
+    def __init__(self):
+        self.counts = {}
+        self.latencies = {}
+        self._lock = threading.Lock()
+
+    def record(self, decision, event_type, latency):
+        with self._lock:
+            key = (event_type, decision)
+            self.counts[key] = self.counts.get(key, 0) + 1
+            self.latencies.setdefault(event_type, array("d")).append(latency)
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    def by_event_type(self):
+        report = {}
+        for event_type, samples in sorted(self.latencies.items()):
+            samples = sorted(samples)
+
+            def percentile(fraction):
+                return round(samples[min(int(len(samples) * fraction), len(samples) - 1)] * 1000, 3)
+
+            report[event_type] = {
+                "Decisions": {
+                    decision: count for (recorded_type, decision), count in sorted(self.counts.items())
+                    if recorded_type == event_type
+                },
+                "LatencyMs": {"P50": percentile(0.5), "P90": percentile(0.9), "P99": percentile(0.99),
+                              "Max": round(samples[-1] * 1000, 3)}
+            }
+        return report
+
+
+class ReplayTransport:
+    """
+    Serves documents from a stream of (at, document) pairs as the replay
+    clock reaches them; a poll returns the newest document available, so a
+    Listener polling slower than the stream skips documents as it would live.
+    Remembers when each event state first appeared, for decision latency.
+    """
+    def __init__(self, documents, clock, recorder):
+        self.clock = clock
+        self.recorder = recorder
+        self.served = 0
+        self.available = 0
+        self._documents = iter(documents)
+        self._next = None
+        self._current = None
+        self._current_served = False
+        # EventId -> (EventType, EventStatus, time the state appeared)
+        self._states = {}
+        self._pull()
+
+    def _pull(self):
+        start = time.perf_counter()
+        self._next = next(self._documents, None)
+        self.clock.excluded += time.perf_counter() - start
+
+    def _consume(self, at, document):
+        self.available += 1
+        states = {}
+        for event in document.get("Events", []):
+            previous = self._states.get(event["EventId"])
+            status = event.get("EventStatus")
+            if previous is not None and previous[1] == status:
+                states[event["EventId"]] = previous
+            else:
+                states[event["EventId"]] = (event.get("EventType"), status, at)
+        self._states = states
+        self._current = document
+        self._current_served = False
+
+    def get_scheduled_events(self):
+        now = self.clock.monotonic()
+        while self._next is not None and self._next[0] <= now:
+            self._consume(*self._next)
+            self._pull()
+        if self._current_served and self._next is None:
+            raise ReplayFinished()
+        if self._current is None:
+            return {"DocumentIncarnation": 0, "Events": []}
+        if not self._current_served:
+            self._current_served = True
+            self.served += 1
+        return self._current
+
+    def record(self, decision, event_id):
+        state = self._states.get(event_id)
+        event_type, _, at = state if state is not None else (None, None, self.clock.monotonic())
+        self.recorder.record(decision, event_type, self.clock.monotonic() - at)
+
+    def confirm_scheduled_event(self, event_id):
+        self.record("confirm", event_id)
+        return 200
+
+
+def load_documents(path, interval=1.0):
+    """
+    Yield (at, document) pairs from a recorded JSON lines file without
+    reading it all first.
+    """
+    with open(path) as f:
+        index = 0
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            index += 1
+            if "Document" in record:
+                yield float(record["At"]), record["Document"]
+            else:
+                yield index * interval, record
+
+
+def save_documents(path, documents):
+    with open(path, "w") as f:
+        for at, document in documents:
+            f.write(json.dumps({"At": at, "Document": document}, separators=(",", ":")) + "\n")
+
+
+def generate_documents(count, seed=0, vms=10, arrival_rate=0.2, speed=60.0):
+    """
+    Yield count (at, document) pairs of a synthetic stream: events from the
+    default scenarios, picked with scenario_defaults.DEFAULT_MIX, arrive at arrival_rate
+    per second on random VMs and walk their states with the scenarios'
+    durations divided by speed. A document is produced whenever an event
+    arrives or changes state, one second of simulated time per step.
+    """
+    scenarios = scenario_defaults.default_scenarios()
+    names, weights = scenario_defaults.resolve_mix(scenario_defaults.DEFAULT_MIX, scenarios)
+    rng = random.Random(seed)
+    # Each active entry: [IMDS event, statuses, index into statuses, time of next change]
+    active = []
+    incarnation = 1
+    now = 0
+    produced = 0
+    while produced < count:
+        now += 1
+        changed = False
+        for entry in active:
+            event, statuses, idx, change_at = entry
+            if change_at is not None and now >= change_at:
+                scenario = scenarios[event["Scenario"]]
+                idx += 1
+                entry[2] = idx
+                entry[3] = now + scenario["EventStatus"][statuses[idx]] / speed if idx + 1 < len(statuses) else None
+                event["EventStatus"] = statuses[idx]
+                if statuses[idx] == "Started":
+                    event["NotBefore"] = ""
+                changed = True
+        active = [entry for entry in active if entry[0]["EventStatus"] not in ("Completed", "Canceled")]
+        if rng.random() < arrival_rate:
+            scenario_name = rng.choices(names, weights)[0]
+            scenario = scenarios[scenario_name]
+            statuses = list(scenario["EventStatus"])
+            event = {
+                "EventId": str(uuid.UUID(int=rng.getrandbits(128))),
+                "Scenario": scenario_name,
+                "EventStatus": statuses[0],
+                "EventType": scenario["EventType"],
+                "ResourceType": "VirtualMachine",
+                "Resources": [f"vm{rng.randrange(vms)}"],
+                "EventSource": scenario["EventSource"],
+                "NotBefore": "",
+                "Description": scenario["Description"],
+                "DurationInSeconds": scenario["DurationInSeconds"]
+            }
+            if statuses[0] == "Scheduled":
+                delay = scenario.get("NotBeforeDelayInSeconds", scenario.get("NotBeforeDelayInMinutes", 0) * 60)
+                event["NotBefore"] = f"T+{now + delay / speed:.0f}s"
+            change_at = now + scenario["EventStatus"][statuses[0]] / speed if len(statuses) > 1 else None
+            active.append([event, statuses, 0, change_at])
+            changed = True
+        if changed:
+            incarnation += 1
+            produced += 1
+            yield float(now), {
+                "DocumentIncarnation": incarnation,
+                # Fresh dicts per document, since handlers may add fields
+                "Events": [
+                    {key: value for key, value in entry[0].items() if key != "Scenario"} for entry in active
+                ]
+            }
+
+
+@contextlib.contextmanager
+def _installed(transport, clock):
+    """
+    Point the Listener at the replay transport and clock, record log and
+    upload decisions instead of printing and uploading, and put everything
+    back afterwards.
+    """
+    saved = (
+        Listener.transport, Listener.clock, Listener.log, Listener.write_preempt_event,
+        Listener.PROCESSED_CACHE_PATH
+    )
+    Listener.transport = transport
+    Listener.clock = clock
+    Listener.log = lambda event: transport.record("log", event["EventId"])
+    Listener.write_preempt_event = lambda event: transport.record("upload", event["EventId"])
+    Listener.PROCESSED_CACHE_PATH = None
+    with Listener._processed_lock:
+        Listener.processed_events.clear()
+        Listener._in_flight.clear()
+    with Listener._timings_lock:
+        Listener.handler_timings.clear()
+    try:
+        with contextlib.redirect_stdout(_NullWriter()):
+            yield
+    finally:
+        (Listener.transport, Listener.clock, Listener.log, Listener.write_preempt_event,
+         Listener.PROCESSED_CACHE_PATH) = saved
+
+
+def replay(documents):
+    """
+    Run Listener.advanced_sample() over documents, an iterable of (at,
+    document) pairs, and return the report.
+    """
+    clock = ReplayClock()
+    recorder = DecisionRecorder()
+    transport = ReplayTransport(documents, clock, recorder)
+    start = time.perf_counter()
+    with _installed(transport, clock):
+        incarnation = "-1"
+        try:
+            while True:
+                incarnation = Listener.advanced_sample(incarnation)
+        except ReplayFinished:
+            pass
+    wall = time.perf_counter() - start
+    listener_seconds = wall - clock.excluded
+    with Listener._timings_lock:
+        handler_timings = {name: dict(timing) for name, timing in Listener.handler_timings.items()}
+    return {
+        "DocumentsAvailable": transport.available,
+        "DocumentsServed": transport.served,
+        "Decisions": recorder.total,
+        "WallSeconds": round(wall, 3),
+        "ListenerSeconds": round(listener_seconds, 3),
+        "DocumentsPerSecond": round(transport.served / listener_seconds, 1) if listener_seconds > 0 else None,
+        "DecisionsPerSecond": round(recorder.total / listener_seconds, 1) if listener_seconds > 0 else None,
+        "ByEventType": recorder.by_event_type(),
+        "HandlerTimings": handler_timings
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay scheduled events documents through the Listener offline")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--documents", type=str, help="Recorded JSON lines file to replay")
+    source.add_argument("--generate", type=int, help="Number of synthetic documents to generate and replay")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for generated documents")
+    parser.add_argument("--vms", type=int, default=10, help="VMs named by generated events")
+    parser.add_argument("--arrival-rate", type=float, default=0.2, help="Generated events per simulated second")
+    parser.add_argument("--speed", type=float, default=60, help="Divide scenario durations by this in generated streams")
+    parser.add_argument("--save", type=str, help="Write the generated stream to this file instead of replaying it")
+    parser.add_argument("--report", type=str, help="Write the full report as JSON to this file")
+    args = parser.parse_args()
+
+    if args.documents:
+        documents = load_documents(args.documents)
+    else:
+        documents = generate_documents(args.generate, args.seed, args.vms, args.arrival_rate, args.speed)
+    if args.save:
+        save_documents(args.save, documents)
+        print(f"Stream written to {args.save}")
+        raise SystemExit(0)
+
+    report = replay(documents)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+
+    print(f"{report['DocumentsServed']:,} of {report['DocumentsAvailable']:,} documents served, "
+          f"{report['Decisions']:,} decisions in {report['ListenerSeconds']} s of Listener time "
+          f"({report['WallSeconds']} s wall)")
+    print(f"{report['DocumentsPerSecond']:,} documents/s, {report['DecisionsPerSecond']:,} decisions/s\n")
+    print(f"{'EventType':<10} {'Decisions':<36} {'P50 ms':>10} {'P99 ms':>10} {'Max ms':>10}")
+    for event_type, entry in report["ByEventType"].items():
+        decisions = ", ".join(f"{name} {count:,}" for name, count in entry["Decisions"].items())
+        latency = entry["LatencyMs"]
+        print(f"{str(event_type):<10} {decisions:<36} {latency['P50']:>10} {latency['P99']:>10} {latency['Max']:>10}")
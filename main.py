@@ -1,577 +1,1707 @@
-from flask import Flask, request, jsonify, render_template, redirect, url_for, flash
-from collections import OrderedDict
+from flask import Flask, Blueprint, Response, current_app, request, jsonify, render_template, redirect, url_for, flash, has_request_context
+from collections import OrderedDict, deque
+from functools import lru_cache
 import uuid
 from datetime import datetime, timedelta, timezone
+import argparse
+import csv
+import heapq
+import io
+import itertools
+import json
+import math
+import os
 import threading
 import time
 
-app = Flask(__name__)
-
-# Global variable to store the active scenario and last event
-active_scenario = None
-last_event = None
-last_doc_incarnation = 1
-app.secret_key = 'test_key'
-
-# Predefined scenarios
-# Dev timing scenarios have all their timings in seconds 
-# So instead of waiting 15 minutes for an event to appear, it'll take 15 seconds
-# to prevent waiting when testing locally.
-# The other scenarios have the timings convert the times to minutes to match what
-# would happen in production 
-scenarios = {
-    "Live Migration - Dev Timing": {
-        "EventId": str(uuid.uuid4()),
-        "NotBeforeDelayInMinutes": 15,
-        "StartedDurationInMinutes": 5,
-        "EventStatus": OrderedDict([
-            ("Scheduled", 15),
-            ("Started", 5),
-            ("Completed", 0)
-        ]),
-        "EventType": "Freeze",
-        "Description": "Virtual machine is being paused because of a memory-preserving Live Migration operation.",
-        "ScenarioDescription": """This scenario simulates a live migration. LMs 
-            can be triggered by the platform in the case of host maintenance or if 
-            there is a predicted host failure.""",
-        "EventSource": "Platform",
-        "DurationInSeconds": 5,
-    },
-    "User Reboot - Dev Timing": {
-        "EventId": str(uuid.uuid4()),
-        "NotBeforeDelayInMinutes": 15,
-        "StartedDurationInMinutes": 10,
-        "EventStatus": OrderedDict([
-            ("Scheduled", 15),
-            ("Started", 10),
-            ("Completed", 0)
-        ]),
-        "EventType": "Reboot",
-        "Description": "Virtual machine is going to be restarted as requested by authorized user.",
-        "ScenarioDescription": """This scenario simulates a reboot initiated by 
-            the user. This can be triggered via the portal or CLI if you'd like 
-            to test with a real reboot""",
-        "EventSource": "User",
-        "DurationInSeconds": -1,
-    },
-    "Host Agent Maintenance - Dev Timing": {
-        "EventId": str(uuid.uuid4()),
-        "NotBeforeDelayInMinutes": 15,
-        "StartedDurationInMinutes": 10,
-        "EventStatus": OrderedDict([
-            ("Scheduled", 15),
-            ("Started", 10),
-            ("Completed", 0)
-        ]),
-        "EventType": "Freeze",
-        "Description": "Host server is undergoing maintenance.",
-        "ScenarioDescription": """This scenario simulates host maintenance, which 
-            is the most common reason for a scheduled event. The VM is typically frozen for 
-            between 1 and 15 seconds, but the time between the started and completed 
-            events is longer to allow Azure to run health checks after the maintenance.""",
-        "EventSource": "Platform",
-        "DurationInSeconds": 9,
-    },
-    "Redeploy - Dev Timing": {
-        "EventId": str(uuid.uuid4()),
-        "NotBeforeDelayInMinutes": 15,
-        "StartedDurationInMinutes": 10,
-        "EventStatus": OrderedDict([
-            ("Scheduled", 15),
-            ("Started", 10),
-            ("Completed", 0)
-        ]),
-        "EventType": "Redeploy",
-        "Description": "Virtual machine has encountered a failure.",
-        "ScenarioDescription": """This scenario simulates a platform-initiated redeploy "
-            due to a host failure.""",
-        "EventSource": "Platform",
-        "DurationInSeconds": -1
-    },
-    "User Redeploy - Dev Timing": {
-        "EventId": str(uuid.uuid4()),
-        "NotBeforeDelayInMinutes": 15,
-        "StartedDurationInMinutes": 10,
-        "EventStatus": OrderedDict([
-            ("Scheduled", 15),
-            ("Started", 10),
-            ("Completed", 0)
-        ]),
-        "EventType": "Redeploy",
-        "Description": "Virtual machine is going to be redeployed as requested by authorized user.",
-        "ScenarioDescription": """This scenario simulates a redeploy initiated by 
-            the user. This event can also be triggered via the portal or CLI""",
-        "EventSource": "User",
-        "DurationInSeconds": -1
-    },
-    "Canceled Maintenance - Dev Timing": {
-        "EventId": str(uuid.uuid4()),
-        "NotBeforeDelayInMinutes": 15,
-        "StartedDurationInMinutes": 10,
-        "EventStatus": OrderedDict([
-            ("Scheduled", 8),
-            ("Canceled", 0)
-        ]),
-        "EventType": "Freeze",
-        "Description": "Host server is undergoing maintenance.",
-        "ScenarioDescription": """This scenario simulates the rare case where a 
-            maintenance event that was canceled. This can happen if Azure detects other 
-            hosts receiving the same maintenance event are failing health checks. The 
-            system will cancel any pending maintenance events and pause the maintenance until
-            a root cause can be determined.""",
-        "EventSource": "Platform",
-        "DurationInSeconds": 9,
-    },
-    "Live Migration": {
-        "EventId": str(uuid.uuid4()),
-        "NotBeforeDelayInMinutes": 15,
-        "StartedDurationInMinutes": 5,
-        "EventStatus": OrderedDict([
-            ("Scheduled", 15 * 60),
-            ("Started", 5 * 60),
-            ("Completed", 0)
-        ]),
-        "EventType": "Freeze",
-        "Description": "Virtual machine is being paused because of a memory-preserving Live Migration operation.",
-        "ScenarioDescription": """This scenario simulates a live migration. LMs 
-            can be triggered by the platform in the case of host maintenance or if 
-            there is a predicted host failure.""",
-        "EventSource": "Platform",
-        "DurationInSeconds": 5,
-    },
-    "User Reboot": {
-        "EventId": str(uuid.uuid4()),
-        "NotBeforeDelayInMinutes": 15,
-        "StartedDurationInMinutes": 10,
-        "EventStatus": OrderedDict([
-            ("Scheduled", 15 * 60),
-            ("Started", 10 * 60),
-            ("Completed", 0)
-        ]),
-        "EventType": "Reboot",
-        "Description": "Virtual machine is going to be restarted as requested by authorized user.",
-        "ScenarioDescription": """This scenario simulates a reboot initiated by 
-            the user. This can be triggered via the portal or CLI if you'd like 
-            to test with a real reboot""",
-        "EventSource": "User",
-        "DurationInSeconds": -1,
-    },
-    "Host Agent Maintenance": {
-        "EventId": str(uuid.uuid4()),
-        "NotBeforeDelayInMinutes": 15,
-        "StartedDurationInMinutes": 10,
-        "EventStatus": OrderedDict([
-            ("Scheduled", 15 * 60),
-            ("Started", 10 * 60),
-            ("Completed", 0)
-        ]),
-        "EventType": "Freeze",
-        "Description": "Host server is undergoing maintenance.",
-        "ScenarioDescription": """This scenario simulates host maintenance, which 
-            is the most common reason for a scheduled event. The VM is typically frozen for 
-            between 1 and 15 seconds, but the time between the started and completed 
-            events is longer to allow Azure to run health checks after the maintenance.""",
-        "EventSource": "Platform",
-        "DurationInSeconds": 9,
-    },
-    "Redeploy": {
-        "EventId": str(uuid.uuid4()),
-        "NotBeforeDelayInMinutes": 15,
-        "StartedDurationInMinutes": 10,
-        "EventStatus": OrderedDict([
-            ("Scheduled", 15 * 60),
-            ("Started", 10 * 60),
-            ("Completed", 0)
-        ]),
-        "EventType": "Redeploy",
-        "Description": "Virtual machine has encountered a failure.",
-        "ScenarioDescription": """This scenario simulates a platform-initiated redeploy "
-            due to a host failure.""",
-        "EventSource": "Platform",
-        "DurationInSeconds": -1
-    },
-    "User Redeploy": {
-        "EventId": str(uuid.uuid4()),
-        "NotBeforeDelayInMinutes": 15,
-        "StartedDurationInMinutes": 10,
-        "EventStatus": OrderedDict([
-            ("Scheduled", 15 * 60),
-            ("Started", 10 * 60),
-            ("Completed", 0)
-        ]),
-        "EventType": "Redeploy",
-        "Description": "Virtual machine is going to be redeployed as requested by authorized user.",
-        "ScenarioDescription": """This scenario simulates a redeploy initiated by 
-            the user. This event can also be triggered via the portal or CLI""",
-        "EventSource": "User",
-        "DurationInSeconds": -1
-    },
-    "Canceled Maintenance": {
-        "EventId": str(uuid.uuid4()),
-        "NotBeforeDelayInMinutes": 15,
-        "StartedDurationInMinutes": 10,
-        "EventStatus": OrderedDict([
-            ("Scheduled", 8 * 60),
-            ("Canceled", 0)
-        ]),
-        "EventType": "Freeze",
-        "Description": "Host server is undergoing maintenance.",
-        "ScenarioDescription": """This scenario simulates the rare case where a 
-            maintenance event that was canceled. This can happen if Azure detects other 
-            hosts receiving the same maintenance event are failing health checks. The 
-            system will cancel any pending maintenance events and pause the maintenance until
-            a root cause can be determined.""",
-        "EventSource": "Platform",
-        "DurationInSeconds": 9,
-    },
-    # Add scenario for Spot VM Eviction
-    "Spot Eviction": {
-        "EventId": str(uuid.uuid4()),
-        "NotBeforeDelayInMinutes": 15,
-        "StartedDurationInMinutes": 5,
-        "ResourceType": "VirtualMachine",
-        "Resources": [
-            "vm1"
-        ],
-        "EventStatus": OrderedDict([
-            ("Scheduled", 15),
-            ("Started", 5),
-            ("Completed", 0)
-        ]),
-        "EventType": "Preempt",
-        "Description": "The Virtual Machine will be evicted.",
-        "ScenarioDescription": """This scenario simulates eviction of a Spot Virtual Machine.
-            The Spot Virtual Machine is being deleted (ephemeral disks are lost). This event is made available on a best effort basis""",
-        "EventSource": "Platform",
-        "DurationInSeconds": -1,
-    }
-    # Add more scenarios as needed
+import profiling
+from scenario_defaults import default_scenarios
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+class SystemClock:
+    """
+    Wall clock used when the server runs normally.
+    """
+    def now(self):
+        return datetime.now(timezone.utc)
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+class ManualClock:
+    """
+    Clock that only moves when told to. sleep() advances time instantly, so
+    auto-run playback finishes without waiting on the wall clock.
+    """
+    def __init__(self, start=None):
+        self._start = start or datetime(2025, 7, 1, tzinfo=timezone.utc)
+        self._elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def now(self):
+        return self._start + timedelta(seconds=self._elapsed)
+
+    def monotonic(self):
+        return self._elapsed
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+    def advance(self, seconds):
+        with self._lock:
+            self._elapsed += seconds
+
+class DeadlineQueue:
+    """
+    Shared timer for event playback. Callbacks are queued against
+    clock.monotonic() deadlines and run in deadline order, either by a
+    background thread (start()) when running on the SystemClock, or by
+    run_until()/run_until_idle(), which move the clock forward themselves.
+    """
+    def __init__(self, clock=None):
+        self.clock = clock or SystemClock()
+        self._heap = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._heap)
+
+    def call_at(self, deadline, callback, *args):
+        """
+        Run callback(*args) once clock.monotonic() reaches deadline. Returns an
+        entry that can be passed to cancel().
+        """
+        entry = [deadline, next(self._counter), callback, args, False]
+        with self._condition:
+            heapq.heappush(self._heap, entry)
+            self._condition.notify()
+        return entry
+
+    def call_later(self, delay, callback, *args):
+        return self.call_at(self.clock.monotonic() + delay, callback, *args)
+
+    def cancel(self, entry):
+        # Cancelled entries stay in the heap and are skipped when popped
+        entry[4] = True
+
+    def clear(self):
+        with self._condition:
+            self._heap.clear()
+
+    def next_deadline(self):
+        with self._condition:
+            while self._heap and self._heap[0][4]:
+                heapq.heappop(self._heap)
+            return self._heap[0][0] if self._heap else None
+
+    def run_due(self):
+        """
+        Run every callback whose deadline has passed. Returns how many ran.
+        """
+        ran = 0
+        while True:
+            with self._condition:
+                if not self._heap or self._heap[0][0] > self.clock.monotonic():
+                    return ran
+                deadline, _, callback, args, cancelled = heapq.heappop(self._heap)
+            if not cancelled:
+                callback(*args)
+                ran += 1
+
+    def run_until(self, deadline):
+        """
+        Run callbacks in order up to deadline, sleeping on the clock between them.
+        """
+        while True:
+            next_deadline = self.next_deadline()
+            if next_deadline is None or next_deadline > deadline:
+                break
+            self.clock.sleep(max(next_deadline - self.clock.monotonic(), 0))
+            self.run_due()
+        self.clock.sleep(max(deadline - self.clock.monotonic(), 0))
+
+    def run_until_idle(self):
+        """
+        Run callbacks in order until nothing is left queued.
+        """
+        while True:
+            next_deadline = self.next_deadline()
+            if next_deadline is None:
+                return
+            self.clock.sleep(max(next_deadline - self.clock.monotonic(), 0))
+            self.run_due()
+
+    def start(self):
+        """
+        Run due callbacks on a background thread. Only used on the
+        SystemClock; with a ManualClock drive the queue with run_until().
+        """
+        if not isinstance(self.clock, SystemClock):
+            return
+        with self._condition:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._heap:
+                    self._condition.wait()
+                delay = self._heap[0][0] - self.clock.monotonic()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+            self.run_due()
+
+def parse_start_requests(data):
+    """
+    Return the set of EventIds approved by a StartRequests POST body.
+    Malformed entries are ignored.
+    """
+    start_requests = data.get("StartRequests", []) if isinstance(data, dict) else []
+    if not isinstance(start_requests, list):
+        return set()
+    event_ids = set()
+    for request_entry in start_requests:
+        if isinstance(request_entry, dict):
+            event_id = request_entry.get("EventId")
+            if event_id:
+                event_ids.add(event_id)
+    return event_ids
+
+# JSON encoders that return bytes. orjson is used when it is installed unless
+# SCHEDULED_EVENTS_JSON_BACKEND=json; both produce the same documents.
+def _stdlib_json_dumps(obj):
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+# (dumps, loads) per backend
+JSON_BACKENDS = {"json": (_stdlib_json_dumps, json.loads)}
+if orjson is not None:
+    JSON_BACKENDS["orjson"] = (orjson.dumps, orjson.loads)
+
+class EventSerializer:
+    """
+    The event layout of one Scheduled Events api-version: which optional fields
+    it carries, whether resource names get the underscore prefix of the
+    2017-03-01 preview, and the event types that only later versions describe
+    (hidden_event_types), which are left out of its documents. Custom event
+    types from user scenarios are served by every version.
+    """
+    def __init__(self, api_version, hidden_event_types=(), fields=(), resource_prefix=""):
+        self.api_version = api_version
+        self.hidden_event_types = frozenset(hidden_event_types)
+        self.fields = frozenset(fields)
+        self.resource_prefix = resource_prefix
+
+    def scenario_fragments(self, scenario, json_dumps):
+        """
+        Pre-encode the fields that are constant for a scenario: everything
+        around EventId, EventStatus, Resources and NotBefore.
+        """
+        fields = self.fields
+        source = b',"EventSource":' + json_dumps(scenario["EventSource"]) if "EventSource" in fields else b""
+        description = b',"Description":' + json_dumps(scenario["Description"]) if "Description" in fields else b""
+        duration = (
+            b',"DurationInSeconds":' + json_dumps(scenario["DurationInSeconds"])
+            if "DurationInSeconds" in fields else b""
+        )
+        return (
+            b',"EventType":' + json_dumps(scenario["EventType"]) + b',"ResourceType":"VirtualMachine","Resources":',
+            source + b',"NotBefore":',
+            description + duration + b'}'
+        )
+
+# Scheduled Events api-versions, oldest first, with what each one added
+_API_VERSIONS = [
+    # Public preview; IaaS VM resource names carry a leading underscore
+    ("2017-03-01", {"hidden_event_types": ["Preempt", "Terminate"], "resource_prefix": "_"}),
+    # Underscore prefix dropped
+    ("2017-08-01", {"hidden_event_types": ["Preempt", "Terminate"]}),
+    # Spot VM eviction (Preempt)
+    ("2017-11-01", {"hidden_event_types": ["Terminate"]}),
+    # Scale set instance termination (Terminate)
+    ("2019-01-01", {}),
+    ("2019-04-01", {"fields": ["Description"]}),
+    ("2019-08-01", {"fields": ["Description", "EventSource"]}),
+    ("2020-07-01", {"fields": ["Description", "EventSource", "DurationInSeconds"]}),
+]
+NEWEST_API_VERSION = _API_VERSIONS[-1][0]
+# Serializer per api-version, built once; requests without api-version get the newest
+EVENT_SERIALIZERS = {version: EventSerializer(version, **options) for version, options in _API_VERSIONS}
+EVENT_SERIALIZERS[None] = EVENT_SERIALIZERS[NEWEST_API_VERSION]
+# Body IMDS answers unknown api-versions with
+_BAD_API_VERSION_BODY = json.dumps({
+    "error": "Bad request. api-version was not specified in the correct format. "
+             "Please refer to IMDS documentation for supported api-versions.",
+    "newest-versions": [version for version, _ in reversed(_API_VERSIONS)][:3]
+}).encode("utf-8")
+
+def bad_api_version_response():
+    return Response(_BAD_API_VERSION_BODY, status=400, mimetype="application/json")
+
+class RenderedDocument:
+    """
+    An encoded IMDS document, plus the EventIds it serves in Scheduled state
+    so reaction tracking doesn't have to decode the body.
+    """
+    __slots__ = ("body", "scheduled")
+
+    def __init__(self, body, scheduled):
+        self.body = body
+        self.scheduled = scheduled
+
+    def to_dict(self):
+        return json.loads(self.body)
+
+def document_response(document, status=200):
+    return Response(document.body, status=status, mimetype="application/json")
+
+class ReactionTracker:
+    """
+    Measures how quickly clients react to Scheduled events: when each EventId
+    was published, when it was first served to each client (detection) and
+    when that client approved it with StartRequests (approval). Per-event
+    samples are kept for the most recent max_events EventIds; the aggregate
+    histograms cover everything since the server started, with Counts[i]
+    holding the samples that fell between bucket i - 1 and bucket i.
+    """
+    BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000, 300000, 900000)
+
+    def __init__(self, clock=None, max_events=10000):
+        self.clock = clock or SystemClock()
+        self.max_events = max_events
+        self._events = OrderedDict()
+        self._histograms = {name: [0] * (len(self.BUCKETS_MS) + 1) for name in ("Detection", "Approval", "EndToEnd")}
+        # The scheduled ids last stamped for each client, so polls of an
+        # unchanged (memoized) document skip the per-event walk
+        self._last_served = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _observe(self, name, seconds):
+        milliseconds = seconds * 1000
+        counts = self._histograms[name]
+        for i, bound in enumerate(self.BUCKETS_MS):
+            if milliseconds <= bound:
+                counts[i] += 1
+                return
+        counts[-1] += 1
+
+    def published(self, event):
+        with self._lock:
+            if event["EventId"] in self._events:
+                return
+            self._events[event["EventId"]] = {
+                "EventType": event["ActiveScenario"]["EventType"],
+                "Scenario": event["Scenario"],
+                "PublishedAt": self.clock.monotonic(),
+                "PublishedTimestamp": self.clock.now().strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+                "Clients": {}
+            }
+            if len(self._events) > self.max_events:
+                self._events.popitem(last=False)
+
+    def served(self, scheduled_ids, client):
+        """
+        Note the first time each Scheduled event in a response reached client.
+        scheduled_ids is the tuple of a RenderedDocument; serving the same
+        document to the same client again costs one lookup.
+        """
+        now = None
+        with self._lock:
+            if self._last_served.get(client) is scheduled_ids:
+                return
+            self._last_served[client] = scheduled_ids
+            self._last_served.move_to_end(client)
+            if len(self._last_served) > self.max_events:
+                self._last_served.popitem(last=False)
+            for event_id in scheduled_ids:
+                tracked = self._events.get(event_id)
+                if tracked is None or client in tracked["Clients"]:
+                    continue
+                now = self.clock.monotonic() if now is None else now
+                tracked["Clients"][client] = {"FirstServedAt": now, "ApprovedAt": None}
+                self._observe("Detection", now - tracked["PublishedAt"])
+
+    def approved(self, event_ids, client):
+        """
+        Note the first StartRequests approval of each EventId from client.
+        event_ids should only hold the approvals that moved an event out of
+        Scheduled (see Simulator.approve).
+        """
+        now = self.clock.monotonic()
+        with self._lock:
+            for event_id in event_ids:
+                tracked = self._events.get(event_id)
+                if tracked is None:
+                    continue
+                seen = tracked["Clients"].setdefault(client, {"FirstServedAt": None, "ApprovedAt": None})
+                if seen["ApprovedAt"] is not None:
+                    continue
+                seen["ApprovedAt"] = now
+                if seen["FirstServedAt"] is not None:
+                    self._observe("Approval", now - seen["FirstServedAt"])
+                self._observe("EndToEnd", now - tracked["PublishedAt"])
+
+    def rows(self):
+        """
+        One row per (EventId, client) with latencies in milliseconds.
+        """
+        def elapsed(start, end):
+            return None if start is None or end is None else round((end - start) * 1000, 3)
+
+        with self._lock:
+            rows = []
+            for event_id, tracked in self._events.items():
+                for client, seen in tracked["Clients"].items():
+                    rows.append({
+                        "EventId": event_id,
+                        "EventType": tracked["EventType"],
+                        "Scenario": tracked["Scenario"],
+                        "Client": client,
+                        "PublishedAt": tracked["PublishedTimestamp"],
+                        "DetectionMs": elapsed(tracked["PublishedAt"], seen["FirstServedAt"]),
+                        "ApprovalMs": elapsed(seen["FirstServedAt"], seen["ApprovedAt"]),
+                        "EndToEndMs": elapsed(tracked["PublishedAt"], seen["ApprovedAt"])
+                    })
+            return rows
+
+    def report(self):
+        rows = self.rows()
+        with self._lock:
+            histograms = {
+                name: {
+                    "BucketsMs": list(self.BUCKETS_MS) + ["+Inf"],
+                    "Counts": list(counts),
+                    "Total": sum(counts)
+                }
+                for name, counts in self._histograms.items()
+            }
+        summary = {}
+        for name in ("DetectionMs", "ApprovalMs", "EndToEndMs"):
+            samples = sorted(row[name] for row in rows if row[name] is not None)
+            summary[name] = {
+                "Count": len(samples),
+                "P50": samples[len(samples) // 2] if samples else None,
+                "P90": samples[int(len(samples) * 0.9)] if samples else None,
+                "P99": samples[int(len(samples) * 0.99)] if samples else None,
+                "Max": samples[-1] if samples else None
+            }
+        return {"Summary": summary, "Histograms": histograms, "Events": rows}
+
+class TransitionTracker:
+    """
+    Measures how far automatic state transitions (playback on the deadline
+    queue and auto-run) land from their deadline: NotBefore for a Scheduled
+    event moving to Started, the end of the state's duration otherwise. The
+    most recent max_samples transitions are kept; the histogram covers
+    everything since the server started.
+    """
+    BUCKETS_MS = (0.1, 0.5, 1, 2, 5, 10, 25, 50, 100, 250, 1000)
+
+    def __init__(self, max_samples=10000):
+        self._samples = deque(maxlen=max_samples)
+        self._counts = [0] * (len(self.BUCKETS_MS) + 1)
+        self._lock = threading.Lock()
+
+    def observed(self, event, error_seconds):
+        """
+        Note that event reached its current state error_seconds after its deadline.
+        """
+        milliseconds = round(error_seconds * 1000, 3)
+        with self._lock:
+            self._samples.append({
+                "EventId": event["EventId"],
+                "Scenario": event["Scenario"],
+                "EventStatus": event["EventStatus"],
+                "ErrorMs": milliseconds
+            })
+            for i, bound in enumerate(self.BUCKETS_MS):
+                if milliseconds <= bound:
+                    self._counts[i] += 1
+                    break
+            else:
+                self._counts[-1] += 1
+
+    def __len__(self):
+        return len(self._samples)
+
+    def report(self):
+        with self._lock:
+            rows = list(self._samples)
+            counts = list(self._counts)
+        samples = sorted(abs(row["ErrorMs"]) for row in rows)
+        return {
+            "Summary": {
+                "Count": len(samples),
+                "P50": samples[len(samples) // 2] if samples else None,
+                "P90": samples[int(len(samples) * 0.9)] if samples else None,
+                "P99": samples[int(len(samples) * 0.99)] if samples else None,
+                "Max": samples[-1] if samples else None
+            },
+            "Histogram": {"BucketsMs": list(self.BUCKETS_MS) + ["+Inf"], "Counts": counts, "Total": sum(counts)},
+            "Transitions": rows
+        }
+
+@lru_cache(maxsize=32)
+def update_domain_resources(scale_set_name, update_domains, instances_per_domain):
+    """
+    Return one tuple of instance names per update domain. Instances are placed
+    round-robin across domains, as scale sets do. The tuples are cached and
+    shared by every event for the same layout, so large resource sets are only
+    stored once.
+    """
+    return tuple(
+        tuple(
+            f"{scale_set_name}_{domain + i * update_domains}"
+            for i in range(instances_per_domain)
+        )
+        for domain in range(update_domains)
+    )
+
+def _caller():
+    return request.remote_addr if has_request_context() else None
+
+def _client_id():
+    # Listeners sharing one address can tell themselves apart with X-Client-Id
+    return request.headers.get("X-Client-Id") or request.remote_addr
+
+# Settings every app starts with; create_app(config) overrides any of them.
+# CLOCK and SCENARIOS default to a SystemClock and default_scenarios().
+DEFAULT_CONFIG = {
+    "SECRET_KEY": "test_key",
+    # Bounded history of every published document (one record per transition,
+    # identified by its DocumentIncarnation). Records evicted from the ring
+    # buffer are appended to HISTORY_OVERFLOW_PATH as JSON lines when it is set.
+    "HISTORY_SIZE": 10000,
+    "HISTORY_OVERFLOW_PATH": None,
+    # Incarnations kept in the change log behind /metadata/scheduledevents/delta.
+    # Clients further behind than this get a full snapshot instead of a delta.
+    "CHANGE_LOG_SIZE": 10000,
+    # Optional map of caller address -> resource name. When a caller is listed
+    # here its polls are filtered to its own events, as if each VM had its own IMDS.
+    "RESOURCE_BY_CALLER": {},
+    "REACTION_MAX_EVENTS": 10000,
+    # Recent automatic transitions kept by /metrics/transitions
+    "TRANSITION_MAX_SAMPLES": 10000,
+    "JSON_BACKEND": os.environ.get("SCHEDULED_EVENTS_JSON_BACKEND", "orjson"),
+    # Request profiling (see profiling.py) is only installed when PROFILE_DIR
+    # is set. Then one request in PROFILE_EVERY_N (0: none) and every request
+    # with the PROFILE_HEADER header is profiled; the newest PROFILE_KEEP are kept.
+    "PROFILE_DIR": os.environ.get("SCHEDULED_EVENTS_PROFILE_DIR"),
+    "PROFILE_EVERY_N": int(os.environ.get("SCHEDULED_EVENTS_PROFILE_EVERY_N", 0)),
+    "PROFILE_HEADER": "X-Profile-Request",
+    "PROFILE_KEEP": 100,
+    # Local blob storage stand-in for Listener uploads (see blobstore.py):
+    # "memory", a directory to store blobs in, or None to leave /blob off
+    "BLOB_STORE": os.environ.get("SCHEDULED_EVENTS_BLOB_STORE"),
 }
 
-@app.route('/', methods=['GET', 'POST'])
+class Simulator:
+    """
+    All state of one mock IMDS: the scenarios, the interactive event
+    (last_event), events played back from event_store, the shared deadline
+    queue, history, reaction tracking and render caches. Each app built by
+    create_app() owns one, so several simulators can run side by side in one
+    process without sharing anything.
+    """
+    # Rendered IMDS documents keyed by (EventId, DocumentIncarnation, api-version).
+    # The UI and both IMDS verbs share this cache, so each event state is only
+    # rendered once however many pollers and dashboards read it.
+    RENDER_CACHE_SIZE = 64
+    RENDERED_EVENT_CACHE_SIZE = 100000
+
+    def __init__(self, config=None):
+        self.config = config if config is not None else dict(DEFAULT_CONFIG, RESOURCE_BY_CALLER={})
+        self.scenarios = self.config.get("SCENARIOS") or default_scenarios()
+        clock = self.config.get("CLOCK") or SystemClock()
+        # Every time source goes through this clock; tests swap in a ManualClock
+        self.deadline_queue = DeadlineQueue(clock)
+        self.reaction_tracker = ReactionTracker(clock, self.config.get("REACTION_MAX_EVENTS", 10000))
+        self.transition_tracker = TransitionTracker(self.config.get("TRANSITION_MAX_SAMPLES", 10000))
+        self._clock = clock
+
+        self.active_scenario = None
+        self.last_event = None
+        self.last_doc_incarnation = 1
+        self.resources_list = ["vmss_vm1"]
+
+        # Events played back alongside last_event (fleet schedules and other
+        # multi-event playback), keyed by EventId in publish order. Every change
+        # bumps DocumentIncarnation under state_lock.
+        self.event_store = OrderedDict()
+        self.state_lock = threading.RLock()
+        # Pending deadline-queue entries for stored events, keyed by EventId
+        self._pending_transitions = {}
+        # Inverted index of event_store: resource name -> {EventId: None} in publish
+        # order, so a per-VM poll only touches the events that name that VM
+        self._events_by_resource = {}
+
+        self.history = deque(maxlen=self.config.get("HISTORY_SIZE", 10000))
+        self._history_sequence = itertools.count(1)
+        self._history_lock = threading.Lock()
+        self._history_overflow_file = None
+        # Which events each DocumentIncarnation changed, oldest first:
+        # (incarnation, ((EventId, Resources), ...)), or (incarnation, None)
+        # when playback was cleared. Deltas are built from it for incarnations
+        # after _change_log_floor; anything older has been evicted. Guarded by
+        # _history_lock, like history.
+        self.change_log = deque(maxlen=self.config.get("CHANGE_LOG_SIZE", 10000))
+        self._change_log_floor = self.last_doc_incarnation
+        # (EventId, Resources) of last_event as of the latest change log entry,
+        # so replacing or dropping the interactive event logs the old one too
+        self._logged_last_event = None
+
+        self._rendered_documents = OrderedDict()
+        # Rendered stored events: EventId -> {(EventStatus, api-version): bytes}
+        # for the event's current state, so a document change only renders the
+        # events that actually changed. Dropped when the event leaves the store.
+        self._rendered_events = OrderedDict()
+        # Pre-encoded static fields per scenario and api-version, keyed by
+        # (scenario name, id(scenario), api-version)
+        self._static_fragments = {}
+        self._render_lock = threading.Lock()
+        # Resources of the current last_event as a set, built once per event
+        self._last_event_resources = (None, frozenset())
+        self.json_dumps, self.json_loads = JSON_BACKENDS.get(
+            self.config.get("JSON_BACKEND", "orjson"), JSON_BACKENDS["json"]
+        )
+
+        self.auto_run_thread = None
+        self.stop_auto_run = threading.Event()
+
+    @property
+    def clock(self):
+        return self._clock
+
+    @clock.setter
+    def clock(self, clock):
+        self._clock = clock
+        self.deadline_queue.clock = clock
+        self.reaction_tracker.clock = clock
+
+    def set_json_backend(self, name):
+        """
+        Switch the JSON backend used for IMDS requests and responses ("json" or
+        "orjson") and drop everything rendered with the previous one.
+        """
+        self.json_dumps, self.json_loads = JSON_BACKENDS[name]
+        with self._render_lock:
+            self._static_fragments.clear()
+            self._rendered_events.clear()
+            self._rendered_documents.clear()
+
+    def schedule_not_before(self, scenario, speed=1.0):
+        """
+        Return the NotBefore timestamp for a Scheduled event of the given
+        scenario and the clock.monotonic() deadline it stands for, when an
+        unapproved event moves to Started. The delay is NotBeforeDelayInSeconds
+        when the scenario sets it, else NotBeforeDelayInMinutes. NotBefore has
+        whole-second resolution, so it is rounded up to the next second and the
+        deadline falls exactly on it; speed > 1 brings the deadline forward.
+        """
+        delay = scenario.get("NotBeforeDelayInSeconds", scenario.get("NotBeforeDelayInMinutes", 0) * 60)
+        now = self.clock.now()
+        not_before = now + timedelta(seconds=delay)
+        if not_before.microsecond:
+            not_before = not_before.replace(microsecond=0) + timedelta(seconds=1)
+        deadline = self.clock.monotonic() + (not_before - now).total_seconds() / speed
+        return not_before.strftime("%Y-%m-%dT%H:%M:%SZ"), deadline
+
+    def compute_not_before(self, scenario):
+        """
+        Return the NotBefore timestamp for a Scheduled event of the given scenario.
+        """
+        return self.schedule_not_before(scenario)[0]
+
+    def _starts_at_not_before(self, event):
+        # A Scheduled event whose next state is Started moves on at NotBefore
+        statuses = list(event["ActiveScenario"]["EventStatus"])
+        idx = statuses.index(event["EventStatus"])
+        return (
+            event["EventStatus"] == "Scheduled" and event.get("NotBeforeDeadline") is not None
+            and idx + 1 < len(statuses) and statuses[idx + 1] == "Started"
+        )
+
+    def transition_deadline(self, event, speed=1.0):
+        """
+        Return the clock.monotonic() deadline of an event's next automatic
+        transition: its NotBefore deadline when a Scheduled event starts next,
+        otherwise the end of its current state's duration (scaled by speed).
+        """
+        if self._starts_at_not_before(event):
+            return event["NotBeforeDeadline"]
+        return self.clock.monotonic() + event["ActiveScenario"]["EventStatus"][event["EventStatus"]] / speed
+
+    def _scenario_fragments(self, event, serializer):
+        """
+        Return the static pieces of an event's encoding for its scenario and
+        api-version. Only EventId, EventStatus, Resources and NotBefore are
+        spliced in between them.
+        """
+        scenario_details = event["ActiveScenario"]
+        key = (event["Scenario"], id(scenario_details), serializer.api_version)
+        fragments = self._static_fragments.get(key)
+        if fragments is None:
+            # Keep the scenario alive so its id can't be reused by another dict
+            fragments = serializer.scenario_fragments(scenario_details, self.json_dumps) + (scenario_details,)
+            self._static_fragments[key] = fragments
+        return fragments
+
+    def render_event(self, event, api_version=None):
+        """
+        Encode one event state in IMDS wire format for api_version (default:
+        the newest). Completed and Canceled events render as None since they
+        drop out of the document, as do event types the version predates.
+        Started events have an empty NotBefore, and every other status keeps the
+        NotBefore stored on the event when it was generated.
+        """
+        event_status = event["EventStatus"]
+        serializer = EVENT_SERIALIZERS[api_version]
+        if event_status in ["Completed", "Canceled"] or event["ActiveScenario"]["EventType"] in serializer.hidden_event_types:
+            return None
+        not_before_time = event.get("NotBefore")
+        # If status is Started, NotBefore must be an empty string
+        if event_status == "Started":
+            not_before_time = ""
+        resources = event.get("Resources", ["vmss_vm1"])
+        if serializer.resource_prefix:
+            resources = [serializer.resource_prefix + resource for resource in resources]
+        json_dumps = self.json_dumps
+        with profiling.phase("serialization"):
+            type_fragment, source_fragment, details_fragment, _ = self._scenario_fragments(event, serializer)
+            return b"".join([
+                b'{"EventId":', json_dumps(event["EventId"]),
+                b',"EventStatus":', json_dumps(event_status),
+                type_fragment, json_dumps(resources),
+                source_fragment, json_dumps(not_before_time if not_before_time else ""),
+                details_fragment
+            ])
+
+    def _render_stored_event(self, event, api_version):
+        event_id = event["EventId"]
+        key = (event["EventStatus"], api_version)
+        with self._render_lock:
+            renderings = self._rendered_events.get(event_id)
+            if renderings is not None and key in renderings:
+                return renderings[key]
+        rendered = self.render_event(event, api_version)
+        with self._render_lock:
+            renderings = self._rendered_events.get(event_id)
+            # Only the current state's renderings are worth keeping
+            if renderings is None or next(iter(renderings))[0] != key[0]:
+                renderings = self._rendered_events[event_id] = {}
+            renderings[key] = rendered
+            if len(self._rendered_events) > self.RENDERED_EVENT_CACHE_SIZE:
+                self._rendered_events.popitem(last=False)
+        return rendered
+
+    def _assemble_document(self, incarnation, events, api_version, render_first=False):
+        """
+        Splice rendered event fragments into a document. With render_first the
+        first event is last_event, which is rendered directly rather than cached
+        per event.
+        """
+        fragments = []
+        scheduled = []
+        for i, event in enumerate(events):
+            if render_first and i == 0:
+                rendered = self.render_event(event, api_version)
+            else:
+                rendered = self._render_stored_event(event, api_version)
+            if rendered:
+                fragments.append(rendered)
+                if event["EventStatus"] == "Scheduled":
+                    scheduled.append(event["EventId"])
+        with profiling.phase("serialization"):
+            body = b"".join([
+                b'{"DocumentIncarnation":', self.json_dumps(incarnation),
+                b',"Events":[', b",".join(fragments), b']}'
+            ])
+        return RenderedDocument(body, tuple(scheduled))
+
+    def _event_names_resource(self, event, resource):
+        event_id, resources = self._last_event_resources
+        if event_id != event["EventId"]:
+            resources = frozenset(event.get("Resources", ["vmss_vm1"]))
+            self._last_event_resources = (event["EventId"], resources)
+        return resource in resources
+
+    def render_resource_document(self, event, incarnation, resource, api_version=None):
+        """
+        Build the document as seen by one resource: only the events whose Resources
+        include it. Stored events come from the inverted index, so the cost follows
+        the number of matching events rather than the size of the document.
+        """
+        include_event = bool(event) and self._event_names_resource(event, resource)
+        with self.state_lock:
+            stored_events = [self.event_store[event_id] for event_id in self._events_by_resource.get(resource, ())]
+        events = [event] + stored_events if include_event else stored_events
+        return self._assemble_document(incarnation, events, api_version, render_first=include_event)
+
+    def render_document(self, event, incarnation, api_version=None, resource=None):
+        """
+        Build the IMDS scheduled events document for the given incarnation: the
+        interactive event (last_event) followed by any events played back from
+        event_store. With a resource, only that resource's events are included.
+        """
+        if resource:
+            return self.render_resource_document(event, incarnation, resource, api_version)
+        key = (event["EventId"] if event else None, incarnation, api_version)
+        with self._render_lock:
+            document = self._rendered_documents.get(key)
+            if document is not None:
+                self._rendered_documents.move_to_end(key)
+                return document
+
+        with self.state_lock:
+            stored_events = list(self.event_store.values())
+            # Only cache documents that match the store as it is now
+            cacheable = incarnation == self.last_doc_incarnation
+        events = [event] + stored_events if event else stored_events
+        document = self._assemble_document(incarnation, events, api_version, render_first=bool(event))
+
+        if cacheable:
+            with self._render_lock:
+                self._rendered_documents[key] = document
+                if len(self._rendered_documents) > self.RENDER_CACHE_SIZE:
+                    self._rendered_documents.popitem(last=False)
+        return document
+
+    def current_document(self, api_version=None, resource=None):
+        """
+        Render the document IMDS is serving right now.
+        """
+        return self.render_document(self.last_event, self.last_doc_incarnation, api_version, resource)
+
+    def record_transition(self, event, source, caller=None, removed=None):
+        """
+        Append a history record for a published document. event is the event that
+        changed (None for resets), source says what triggered the change and caller
+        is the client address for request-driven changes. removed is the
+        interactive event when it was dropped without a replacement.
+        """
+        record = {
+            "Sequence": next(self._history_sequence),
+            "Timestamp": self.clock.now().strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+            "DocumentIncarnation": self.last_doc_incarnation,
+            "EventId": event["EventId"] if event else None,
+            "EventStatus": event["EventStatus"] if event else None,
+            "Scenario": event["Scenario"] if event else None,
+            "Resources": event.get("Resources", ["vmss_vm1"]) if event else [],
+            "Source": source,
+            "Caller": caller
+        }
+        if event and event["EventStatus"] == "Scheduled":
+            self.reaction_tracker.published(event)
+        history = self.history
+        with self._history_lock:
+            if len(history) == history.maxlen and self.config.get("HISTORY_OVERFLOW_PATH"):
+                if self._history_overflow_file is None:
+                    self._history_overflow_file = open(self.config["HISTORY_OVERFLOW_PATH"], "a", buffering=1)
+                self._history_overflow_file.write(json.dumps(history[0]) + "\n")
+            history.append(record)
+            self._log_change(event, removed)
+        return record
+
+    def history_page(self, cursor=0, limit=100, filters=(), resource=None):
+        """
+        Return up to limit history records after the record with Sequence
+        cursor, oldest first, that match every (field, value) in filters and
+        name resource (when given). NextCursor is None once the end of the
+        buffer is reached; Truncated is True when records after the cursor
+        have already been evicted.
+        """
+        page = []
+        next_cursor = None
+        with self._history_lock:
+            history = self.history
+            first_sequence = history[0]["Sequence"] if history else cursor + 1
+            # Sequences are contiguous in the buffer, so the cursor maps to an index
+            start = max(cursor + 1 - first_sequence, 0)
+            for record in itertools.islice(history, start, None):
+                if all(record[field] == value for field, value in filters) and (
+                    resource is None or resource in record["Resources"]
+                ):
+                    page.append(record)
+                    if len(page) == limit:
+                        next_cursor = record["Sequence"]
+                        break
+        return {
+            "Records": page,
+            "NextCursor": next_cursor,
+            "Truncated": 0 < cursor and cursor + 1 < first_sequence
+        }
+
+    def _log_change(self, event, removed=None):
+        # Called with _history_lock held, once per DocumentIncarnation
+        if removed is not None:
+            changed = [(removed["EventId"], removed.get("Resources", ["vmss_vm1"]))]
+            self._logged_last_event = None
+        elif event is None:
+            changed = None
+        else:
+            changed = [(event["EventId"], event.get("Resources", ["vmss_vm1"]))]
+            last_event = self.last_event
+            logged = (last_event["EventId"], last_event.get("Resources", ["vmss_vm1"])) if last_event else None
+            if self._logged_last_event is not None and self._logged_last_event != logged:
+                changed.append(self._logged_last_event)
+            self._logged_last_event = logged
+        change_log = self.change_log
+        if len(change_log) == change_log.maxlen:
+            self._change_log_floor = change_log[0][0]
+        change_log.append((self.last_doc_incarnation, changed))
+
+    def document_delta(self, since, api_version=None, resource=None):
+        """
+        Build the changes to the document after incarnation since: the current
+        state of every event added or changed since then (Events) and the
+        EventIds that have left the document (Removed). The cost follows the
+        number of changes, not the size of the document. When since is older
+        than the change log (or newer than the document), or playback was
+        cleared since then, a full snapshot is returned with Full set instead.
+        """
+        changed = {}
+        full = True
+        with self._history_lock:
+            change_log = self.change_log
+            incarnation = change_log[-1][0] if change_log else self._change_log_floor
+            if self._change_log_floor <= since <= incarnation:
+                full = False
+                for logged_incarnation, events in reversed(change_log):
+                    if logged_incarnation <= since:
+                        break
+                    if events is None:
+                        full = True
+                        break
+                    for event_id, resources in events:
+                        if event_id not in changed and (resource is None or resource in resources):
+                            changed[event_id] = resources
+        if full:
+            document = self.current_document(api_version, resource)
+            return RenderedDocument(document.body[:-1] + b',"Full":true,"Removed":[]}', document.scheduled)
+
+        fragments = []
+        scheduled = []
+        removed = []
+        last_event = self.last_event
+        for event_id in reversed(changed):
+            if last_event is not None and last_event["EventId"] == event_id:
+                rendered = self.render_event(last_event, api_version)
+                event = last_event
+            else:
+                with self.state_lock:
+                    event = self.event_store.get(event_id)
+                rendered = self._render_stored_event(event, api_version) if event is not None else None
+            if rendered is None:
+                removed.append(event_id)
+                continue
+            fragments.append(rendered)
+            if event["EventStatus"] == "Scheduled":
+                scheduled.append(event_id)
+        with profiling.phase("serialization"):
+            body = b"".join([
+                b'{"DocumentIncarnation":', self.json_dumps(incarnation),
+                b',"Events":[', b",".join(fragments),
+                b'],"Full":false,"Since":', self.json_dumps(since),
+                b',"Removed":', self.json_dumps(removed), b'}'
+            ])
+        return RenderedDocument(body, tuple(scheduled))
+
+    def generate_event(self, event_status, resources, source="generate-event", caller=None):
+        """
+        Make a new event of the active scenario the current event (last_event).
+        """
+        scenario = self.scenarios[self.active_scenario]
+        # Set NotBefore time for the event
+        not_before_time = not_before_deadline = None
+        if event_status == "Scheduled":
+            not_before_time, not_before_deadline = self.schedule_not_before(scenario)
+        event = {
+            "EventId": str(uuid.uuid4()),
+            "Scenario": self.active_scenario,
+            "EventStatus": event_status,
+            "ActiveScenario": scenario,
+            "NotBefore": not_before_time,
+            "NotBeforeDeadline": not_before_deadline,
+            "Resources": resources if resources else ["vmss_vm1"]
+        }
+        with self.state_lock:
+            self.last_event = event
+            self.last_doc_incarnation += 1
+            self.record_transition(event, source, caller)
+        return event
+
+    def approve(self, approved_ids, caller=None):
+        """
+        Apply StartRequests approvals: approved Scheduled events move to their
+        next state straight away. Returns the EventIds that did move; approvals
+        of unknown events or events no longer Scheduled change nothing.
+        """
+        started = set()
+        for event_id in approved_ids:
+            if event_id in self.event_store:
+                event = self.advance_playback_event(event_id, "start-request", caller, expected_status="Scheduled")
+                if event is not None and event["EventStatus"] != "Scheduled":
+                    started.add(event_id)
+        # Check and replace last_event under state_lock, so auto-run can't publish in between
+        with self.state_lock:
+            last_event = self.last_event
+            if approved_ids and last_event:
+                # Check if eventId matches and current event is Scheduled
+                if (
+                    last_event.get("EventId") in approved_ids
+                    and last_event.get("EventStatus") == "Scheduled"
+                ):
+                    scenario = last_event["ActiveScenario"]
+                    event_statuses = list(scenario["EventStatus"].keys())
+                    try:
+                        idx = event_statuses.index("Scheduled")
+                        # Move to next status if possible
+                        if idx + 1 < len(event_statuses):
+                            next_status = event_statuses[idx + 1]
+                            # Keep NotBefore unchanged
+                            event_id = str(uuid.uuid4())
+                            event = {
+                                "EventId": event_id,
+                                "Scenario": last_event["Scenario"],
+                                "EventStatus": next_status,
+                                "ActiveScenario": scenario,
+                                "NotBefore": last_event.get("NotBefore"),
+                                "Resources": last_event.get("Resources", ["vmss_vm1"])
+                            }
+                            self.last_event = event
+                            self.last_doc_incarnation += 1
+                            self.record_transition(event, "start-request", caller)
+                            started.add(last_event["EventId"])
+                            # Do NOT stop auto-run; let playback continue
+                    except ValueError:
+                        pass  # "Scheduled" not found, do nothing
+        return started
+
+    def auto_run_scenario(self, stop_event=None):
+        """
+        Play the active scenario through all of its states, waiting on the clock
+        between them. stop_event is the Event this run watches; it defaults to the
+        current stop_auto_run so a later restart does not leave this run going.
+        """
+        stop_event = stop_event or self.stop_auto_run
+        clock = self.clock
+        active_scenario = self.active_scenario
+        scenario = self.scenarios[active_scenario]
+        event_statuses = list(scenario["EventStatus"].keys())
+        not_before_time = None
+        # Deadline the current state was due to end at, once it ended on time
+        due = None
+        # The current event, when something else published it
+        adopted = None
+        idx = 0
+        while idx < len(event_statuses):
+            status = event_statuses[idx]
+            last_event = self.last_event
+            if stop_event.is_set() or (last_event is not None and self.active_scenario != last_event.get("Scenario", None)):
+                break
+            # Only set NotBefore for the first event if not already set
+            if idx == 0:
+                if last_event is None or last_event.get("NotBefore") is None:
+                    if status == "Scheduled":
+                        not_before_time, not_before_deadline = self.schedule_not_before(scenario)
+                    else:
+                        not_before_time = not_before_deadline = None
+                else:
+                    not_before_time = last_event.get("NotBefore")
+                    not_before_deadline = last_event.get("NotBeforeDeadline")
+            else:
+                not_before_time = last_event.get("NotBefore") if last_event is not None else None
+                not_before_deadline = last_event.get("NotBeforeDeadline") if last_event is not None else None
+            if adopted is not None:
+                # Already published by a StartRequest or the NotBefore deadline
+                event, adopted = adopted, None
+            else:
+                event = {
+                    "EventId": str(uuid.uuid4()),
+                    "Scenario": active_scenario,
+                    "EventStatus": status,
+                    "ActiveScenario": scenario,
+                    "NotBefore": not_before_time,
+                    "NotBeforeDeadline": not_before_deadline
+                }
+                with self.state_lock:
+                    self.last_event = event
+                    self.last_doc_incarnation += 1
+                    self.record_transition(event, "auto-run")
+            if due is not None:
+                self.transition_tracker.observed(event, clock.monotonic() - due)
+                due = None
+
+            # Wait until the state's deadline, but if the user POSTs to advance the state,
+            # continue with the new state straight away.
+            deadline = self.transition_deadline(event)
+            timed = None
+            if self._starts_at_not_before(event):
+                # Scheduled -> Started happens at NotBefore on the shared deadline
+                # queue, as it does for playback events
+                timed = self.deadline_queue.call_at(deadline, self._auto_run_not_before, event["EventId"], deadline)
+                self.deadline_queue.start()
+            waited = False
+            # Sleep at most a second at a time to allow interruption by POST,
+            # and exactly up to the deadline on the last step
+            while True:
+                remaining = deadline - clock.monotonic()
+                if remaining <= 0 and timed is not None:
+                    # Without a queue thread (ManualClock) nothing else runs the
+                    # entry; it only starts the event once, whoever gets there first
+                    self.deadline_queue.cancel(timed)
+                    self._auto_run_not_before(event["EventId"], deadline)
+                    timed = None
+                elif remaining <= 0:
+                    if waited and idx + 1 < len(event_statuses):
+                        due = deadline
+                    idx += 1  # Only increment if not interrupted by POST
+                    break
+                elif stop_event.is_set():
+                    break
+                else:
+                    clock.sleep(remaining if remaining < 1 else 1)
+                    waited = True
+                current_event = self.last_event
+                if current_event is None:
+                    if timed is not None:
+                        self.deadline_queue.cancel(timed)
+                    return  # Reset by /stop-auto-run or /set-scenario while sleeping
+                # If the event has advanced (e.g., via POST), break early and continue with the new state
+                if current_event["EventStatus"] != status:
+                    if timed is not None:
+                        self.deadline_queue.cancel(timed)
+                    # Find the new index based on the updated status
+                    try:
+                        idx = event_statuses.index(current_event["EventStatus"])
+                        adopted = current_event
+                    except ValueError:
+                        idx += 1  # fallback: just move to next
+                    break
+
+        # After reaching the last state, keep returning the same event until user changes scenario
+
+    def _auto_run_not_before(self, event_id, deadline):
+        # Runs on the deadline queue (or the auto-run thread, if it wakes first):
+        # start auto-run's Scheduled event unless it was approved or replaced
+        with self.state_lock:
+            event = self.last_event
+            if event is None or event["EventId"] != event_id or event["EventStatus"] != "Scheduled":
+                return
+            event = dict(event, EventId=str(uuid.uuid4()), EventStatus="Started")
+            self.last_event = event
+            self.last_doc_incarnation += 1
+            self.record_transition(event, "auto-run")
+        self.transition_tracker.observed(event, self.clock.monotonic() - deadline)
+
+    def start_auto_run(self):
+        """
+        Stop any previous auto-run and play the active scenario on a new thread.
+        """
+        self.stop_auto_run.set()  # Stop any previous auto-run
+        self.stop_auto_run = threading.Event()  # Reset event
+        self.auto_run_thread = threading.Thread(target=self.auto_run_scenario, args=(self.stop_auto_run,), daemon=True)
+        self.auto_run_thread.start()
+
+    def drop_last_event(self, source, caller=None):
+        """
+        Take the interactive event out of the document. This publishes a new
+        DocumentIncarnation whose change log entry names the event, so delta
+        clients see it in Removed.
+        """
+        with self.state_lock:
+            last_event = self.last_event
+            if last_event is None:
+                return
+            self.last_event = None
+            self.last_doc_incarnation += 1
+            self.record_transition(None, source, caller, removed=last_event)
+
+    def reset(self):
+        """
+        Stop auto-run and drop the current event and all playback.
+        """
+        self.stop_auto_run.set()
+        self.stop_auto_run = threading.Event()
+        self.drop_last_event("reset", _caller())
+        self.clear_playback()
+
+    def publish_event(self, event, source="playback", caller=None):
+        """
+        Add or update an event in event_store, bump DocumentIncarnation and record
+        the transition in history. Completed and Canceled events are dropped from
+        the store.
+        """
+        event_id = event["EventId"]
+        event_store = self.event_store
+        events_by_resource = self._events_by_resource
+        with self.state_lock:
+            if event["EventStatus"] in ["Completed", "Canceled"]:
+                with self._render_lock:
+                    self._rendered_events.pop(event_id, None)
+                if event_store.pop(event_id, None) is not None:
+                    for resource in event["Resources"]:
+                        event_ids = events_by_resource.get(resource)
+                        if event_ids is not None:
+                            event_ids.pop(event_id, None)
+                            if not event_ids:
+                                del events_by_resource[resource]
+            else:
+                if event_id not in event_store:
+                    for resource in event["Resources"]:
+                        events_by_resource.setdefault(resource, {})[event_id] = None
+                event_store[event_id] = event
+            self.last_doc_incarnation += 1
+            self.record_transition(event, source, caller)
+
+    def start_playback_event(self, scenario_name, resources, speed=1.0, on_complete=None, event_id=None):
+        """
+        Publish a Scheduled (or first-status) event for scenario_name into
+        event_store and queue its later states on deadline_queue, scaled down by
+        speed. on_complete(event) is called once the event reaches its last state.
+        """
+        scenario = self.scenarios[scenario_name]
+        event_statuses = list(scenario["EventStatus"].keys())
+        if not event_statuses:
+            return None
+        first_status = event_statuses[0]
+        not_before_time = not_before_deadline = None
+        if first_status == "Scheduled":
+            not_before_time, not_before_deadline = self.schedule_not_before(scenario, speed)
+        event = {
+            "EventId": event_id or str(uuid.uuid4()),
+            "Scenario": scenario_name,
+            "EventStatus": first_status,
+            "ActiveScenario": scenario,
+            "NotBefore": not_before_time,
+            "NotBeforeDeadline": not_before_deadline,
+            "Resources": resources,
+            "Speed": speed,
+            "OnComplete": on_complete
+        }
+        with self.state_lock:
+            self.publish_event(event)
+            self._queue_next_transition(event)
+        return event
+
+    def _queue_next_transition(self, event):
+        # Called with state_lock held, so only one entry is pending per event
+        scenario = event["ActiveScenario"]
+        event_statuses = list(scenario["EventStatus"].keys())
+        idx = event_statuses.index(event["EventStatus"])
+        if idx + 1 >= len(event_statuses):
+            self._pending_transitions.pop(event["EventId"], None)
+            if event["OnComplete"]:
+                event["OnComplete"](event)
+            return
+        deadline = self.transition_deadline(event, event["Speed"])
+        self._pending_transitions[event["EventId"]] = self.deadline_queue.call_at(
+            deadline, self._timed_transition, event["EventId"], event["EventStatus"], deadline
+        )
+
+    def _timed_transition(self, event_id, status, deadline):
+        # Runs on the deadline queue; how late it ran is the transition error
+        error = self.clock.monotonic() - deadline
+        event = self.advance_playback_event(event_id, expected_status=status)
+        if event is not None:
+            self.transition_tracker.observed(event, error)
+
+    def advance_playback_event(self, event_id, source="playback", caller=None, expected_status=None):
+        """
+        Move a stored event to its next state now. The EventId stays the same
+        across states, as it does on the platform. With expected_status, the
+        event only moves if it is still in that state, so a StartRequest and a
+        deadline that land together advance it once; None is returned otherwise.
+        """
+        with self.state_lock:
+            event = self.event_store.get(event_id)
+            if event is None or (expected_status is not None and event["EventStatus"] != expected_status):
+                return None
+            entry = self._pending_transitions.pop(event_id, None)
+            if entry is not None:
+                self.deadline_queue.cancel(entry)
+            event_statuses = list(event["ActiveScenario"]["EventStatus"].keys())
+            idx = event_statuses.index(event["EventStatus"])
+            if idx + 1 >= len(event_statuses):
+                return event
+            event = dict(event, EventStatus=event_statuses[idx + 1])
+            self.publish_event(event, source, caller)
+            self._queue_next_transition(event)
+        return event
+
+    def clear_playback(self):
+        """
+        Drop every stored event and everything queued on the deadline queue,
+        including fleet arrivals that have not been published yet.
+        """
+        with self.state_lock:
+            self.deadline_queue.clear()
+            self._pending_transitions.clear()
+            self._events_by_resource.clear()
+            with self._render_lock:
+                self._rendered_events.clear()
+            if self.event_store:
+                self.event_store.clear()
+                self.last_doc_incarnation += 1
+                self.record_transition(None, "clear-playback", _caller())
+
+    def start_rolling_maintenance(self, scenario_name, speed=1.0, **overrides):
+        """
+        Walk a maintenance wave through a scale set's update domains. Each domain
+        gets its own event from scenario_name, with at most MaxConcurrentDomains in
+        flight; the next domain starts when one completes. overrides replace keys
+        of the scenario's ScaleSet settings.
+        """
+        scale_set = dict(self.scenarios[scenario_name]["ScaleSet"], **overrides)
+        domains = update_domain_resources(
+            scale_set["Name"],
+            int(scale_set["UpdateDomains"]),
+            int(scale_set["InstancesPerDomain"])
+        )
+        pending = iter(domains)
+
+        def start_next(completed_event=None):
+            resources = next(pending, None)
+            if resources is not None:
+                self.start_playback_event(scenario_name, resources, speed=speed, on_complete=start_next)
+
+        for _ in range(max(int(scale_set["MaxConcurrentDomains"]), 1)):
+            start_next()
+        return domains
+
+    def close(self):
+        """
+        Stop playback and release the history overflow file.
+        """
+        self.reset()
+        with self._history_lock:
+            if self._history_overflow_file is not None:
+                self._history_overflow_file.close()
+                self._history_overflow_file = None
+
+bp = Blueprint("simulator", __name__)
+
+def current_simulator():
+    """
+    Return the Simulator of the app handling the current request.
+    """
+    return current_app.extensions["simulator"]
+
+@bp.route('/', methods=['GET', 'POST'])
 def index():
     """
     Render the main page with the scenario and event status selection form.
     Allow user to set the resources array.
     """
-    global resources_list
+    sim = current_simulator()
     # Handle resource input from the form
     if request.method == 'POST':
         resources_input = request.form.get('resources', 'vmss_vm1')
         # Split by comma and strip whitespace
-        resources_list = [r.strip() for r in resources_input.split(',') if r.strip()]
+        sim.resources_list = [r.strip() for r in resources_input.split(',') if r.strip()]
     else:
-        resources_list = ['vmss_vm1']
+        sim.resources_list = ['vmss_vm1']
 
     # Prepare IMDS event format for the last event, if it exists
     imds_event = None
-    if last_event:
-        scenario_details = last_event["ActiveScenario"]
-        event_status = last_event["EventStatus"]
-        if event_status in scenario_details["EventStatus"] and event_status in ["Completed", "Canceled"]:
-            imds_event = {
-                "DocumentIncarnation": last_doc_incarnation,
-                "Events": []
-            }
-        else:
-            if event_status == "Scheduled":
-                offset = scenario_details.get("NotBeforeDelayInMinutes", 0)
-                not_before_time = (datetime.utcnow() + timedelta(minutes=offset)).strftime("%Y-%m-%dT%H:%M:%SZ")
-            else:
-                not_before_time = ""
-            imds_event = {
-                "DocumentIncarnation": last_doc_incarnation,
-                "Events": [
-                    {
-                        "EventId": last_event["EventId"],
-                        "EventStatus": event_status,
-                        "EventType": scenario_details["EventType"],
-                        "ResourceType": "VirtualMachine",
-                        "Resources": resources_list if resources_list else ["vmss_vm1"],
-                        "EventSource": scenario_details["EventSource"],
-                        "NotBefore": not_before_time,
-                        "Description": scenario_details["Description"],
-                        "DurationInSeconds": scenario_details["DurationInSeconds"]
-                    }
-                ]
-            }
+    if sim.last_event:
+        imds_event = sim.current_document().to_dict()
     return render_template(
         'index.html',
-        scenarios=scenarios,
-        active_scenario=active_scenario,
-        last_event=last_event,
-        last_doc_incarnation=last_doc_incarnation,
+        scenarios=sim.scenarios,
+        active_scenario=sim.active_scenario,
+        last_event=sim.last_event,
+        last_doc_incarnation=sim.last_doc_incarnation,
         imds_event=imds_event,
-        resources=','.join(resources_list) if 'resources_list' in globals() else 'vmss_vm1'
+        resources=','.join(sim.resources_list)
     )
 
-@app.route('/set-scenario', methods=['POST'])
+@bp.route('/set-scenario', methods=['POST'])
 def set_scenario():
     """
     Set the active scenario based on user selection from the web UI.
     Also resets last_event so NotBefore is recalculated for the new scenario.
     """
-    global active_scenario, last_event
+    sim = current_simulator()
     scenario_name = request.form.get("scenario")
-    if scenario_name not in scenarios:
-        return redirect(url_for('index'))
+    if scenario_name not in sim.scenarios:
+        return redirect(url_for('.index'))
 
-    active_scenario = scenario_name
-    last_event = None  # Reset event state so NotBefore is recalculated
-    return redirect(url_for('index'))
+    sim.active_scenario = scenario_name
+    sim.drop_last_event("set-scenario", _caller())  # Reset event state so NotBefore is recalculated
+    return redirect(url_for('.index'))
 
-@app.route('/generate-event', methods=['POST'])
+@bp.route('/generate-event', methods=['POST'])
 def generate_event():
     """
     Generate a mock event based on the active scenario and user-selected event status.
     """
-    global last_event, last_doc_incarnation, active_scenario, resources_list
-    if not active_scenario:
+    sim = current_simulator()
+    if not sim.active_scenario:
         flash("No active scenario. Please set a scenario first.", "error")
-        return redirect(url_for('index'))
+        return redirect(url_for('.index'))
 
     event_status = request.form.get("event_status")
-    if event_status not in scenarios[active_scenario]["EventStatus"]:
+    if event_status not in sim.scenarios[sim.active_scenario]["EventStatus"]:
         flash("Invalid event status selected.", "error")
-        return redirect(url_for('index'))
+        return redirect(url_for('.index'))
 
     # Get resources from form or use default
     resources_input = request.form.get('resources', 'vmss_vm1')
-    resources_list = [r.strip() for r in resources_input.split(',') if r.strip()]
-
-    # Set NotBefore time for the event
-    scenario = scenarios[active_scenario]
-    not_before_time = None
-    if event_status == "Scheduled":
-        offset = scenario.get("NotBeforeDelayInMinutes", 0)
-        not_before_time = (datetime.now(timezone.utc) + timedelta(minutes=offset)).strftime("%Y-%m-%dT%H:%M:%SZ")
-
-    event_id = str(uuid.uuid4())
-    event = {
-        "EventId": event_id,
-        "Scenario": active_scenario,
-        "EventStatus": event_status,
-        "ActiveScenario": scenario,
-        "NotBefore": not_before_time,
-        "Resources": resources_list if resources_list else ["vmss_vm1"]
-    }
-    last_event = event
-    last_doc_incarnation += 1
+    sim.resources_list = [r.strip() for r in resources_input.split(',') if r.strip()]
+    sim.generate_event(event_status, sim.resources_list, caller=_caller())
     flash(f"New event generated", "success")
-    return redirect(url_for('index'))
+    return redirect(url_for('.index'))
+
+@bp.route('/metrics/reaction', methods=['GET'])
+def reaction_metrics_route():
+    """
+    Report detection (publish -> first served) and approval (first served ->
+    StartRequests) latency per EventId and client, with aggregate histograms.
+    ?format=csv exports the per-event rows.
+    """
+    reaction_tracker = current_simulator().reaction_tracker
+    if request.args.get("format") == "csv":
+        output = io.StringIO()
+        writer = csv.DictWriter(output, fieldnames=[
+            "EventId", "EventType", "Scenario", "Client", "PublishedAt", "DetectionMs", "ApprovalMs", "EndToEndMs"
+        ])
+        writer.writeheader()
+        writer.writerows(reaction_tracker.rows())
+        return Response(
+            output.getvalue(),
+            mimetype="text/csv",
+            headers={"Content-Disposition": "attachment; filename=reaction.csv"}
+        )
+    return jsonify(reaction_tracker.report()), 200
+
+@bp.route('/metrics/transitions', methods=['GET'])
+def transition_metrics_route():
+    """
+    Report how far automatic transitions landed from their deadline
+    (NotBefore, or the end of the state's duration), in milliseconds.
+    """
+    return jsonify(current_simulator().transition_tracker.report()), 200
+
+@bp.route('/history', methods=['GET'])
+def history_route():
+    """
+    Page through the history ring buffer, oldest first.
+    cursor: Sequence of the last record already seen (default 0: start of buffer)
+    limit: page size, at most 1000
+    event_id, status, source, scenario, resource: optional filters
+    NextCursor is null once the end of the buffer is reached; Truncated is true
+    when records after the cursor have already been evicted.
+    """
+    sim = current_simulator()
+    try:
+        cursor = int(request.args.get("cursor", 0))
+        limit = min(max(int(request.args.get("limit", 100)), 1), 1000)
+    except ValueError:
+        return jsonify({"error": "cursor and limit must be integers"}), 400
+    filters = [
+        (field, request.args[arg])
+        for field, arg in [
+            ("EventId", "event_id"),
+            ("EventStatus", "status"),
+            ("Source", "source"),
+            ("Scenario", "scenario")
+        ]
+        if request.args.get(arg)
+    ]
+    resource = request.args.get("resource")
 
-@app.route('/metadata/scheduledevents', methods=['GET', 'POST'])
+    return jsonify(sim.history_page(cursor, limit, filters, resource)), 200
+
+def caller_resource():
+    """
+    Return the resource the current IMDS request is filtered to: the
+    resource query parameter, or the resource mapped to the caller's address
+    in RESOURCE_BY_CALLER. None means the full document.
+    """
+    return request.args.get('resource') or current_app.config["RESOURCE_BY_CALLER"].get(request.remote_addr)
+
+@bp.route('/metadata/scheduledevents', methods=['GET', 'POST'])
 def imds_scheduledevents():
     """
     Respond as if this is the IMDS scheduled events endpoint.
-    GET: Returns the last generated event in IMDS format.
+    GET: Returns the last generated event and any played-back events in IMDS format.
+         ?resource=<name> (or a RESOURCE_BY_CALLER entry) returns only that resource's events.
     POST: Handles StartRequests to advance event state if EventId matches and status is Scheduled.
+    api-version picks the response shape (default: the newest); unknown versions get a 400.
     """
-    global last_event, last_doc_incarnation, stop_auto_run, auto_run_thread
+    sim = current_simulator()
+    api_version = request.args.get('api-version')
+    if api_version not in EVENT_SERIALIZERS:
+        return bad_api_version_response()
 
     # Handle POST for StartRequests
     if request.method == 'POST':
-        if not last_event:
-            return jsonify({
-                "DocumentIncarnation": last_doc_incarnation,
-                "Events": []
-            }), 400
+        if not sim.last_event and not sim.event_store:
+            return document_response(sim.render_document(None, sim.last_doc_incarnation, api_version), 400)
 
         try:
-            data = request.get_json(force=True)
+            with profiling.phase("serialization"):
+                data = sim.json_loads(request.get_data())
         except Exception:
             return jsonify({"error": "Invalid JSON"}), 400
 
-        start_requests = data.get("StartRequests", [])
-        if start_requests and isinstance(start_requests, list):
-            event_id_in_request = start_requests[0].get("EventId")
-            # Check if eventId matches and current event is Scheduled
-            if (
-                event_id_in_request == last_event.get("EventId")
-                and last_event.get("EventStatus") == "Scheduled"
-            ):
-                scenario = last_event["ActiveScenario"]
-                event_statuses = list(scenario["EventStatus"].keys())
-                try:
-                    idx = event_statuses.index("Scheduled")
-                    # Move to next status if possible
-                    if idx + 1 < len(event_statuses):
-                        next_status = event_statuses[idx + 1]
-                        # Keep NotBefore unchanged
-                        event_id = str(uuid.uuid4())
-                        event = {
-                            "EventId": event_id,
-                            "Scenario": last_event["Scenario"],
-                            "EventStatus": next_status,
-                            "ActiveScenario": scenario,
-                            "NotBefore": last_event.get("NotBefore"),
-                            "Resources": last_event.get("Resources", ["vmss_vm1"])
-                        }
-                        last_event = event
-                        last_doc_incarnation += 1
-                        # Do NOT stop auto-run; let playback continue
-                        # (Remove or comment out: stop_auto_run.set())
-                except ValueError:
-                    pass  # "Scheduled" not found, do nothing
-
-        # Return the current event after processing
-        event = last_event
-        scenario_details = event["ActiveScenario"]
-        event_status = event["EventStatus"]
-        not_before_time = event.get("NotBefore")
-        resources = event.get("Resources", ["vmss_vm1"])
+        with profiling.phase("state"):
+            approved_ids = parse_start_requests(data)
+            started = sim.approve(approved_ids, _caller())
+            sim.reaction_tracker.approved(started, _client_id())
 
-        # If the event is Completed or Canceled, return an empty Events list
-        if event_status in scenario_details["EventStatus"] and event_status in ["Completed", "Canceled"]:
-            return jsonify({
-                "DocumentIncarnation": last_doc_incarnation,
-                "Events": []
-            }), 200
+    # Return the current event in IMDS format (after processing any POST)
+    with profiling.phase("render"):
+        document = sim.current_document(api_version, caller_resource())
+    with profiling.phase("state"):
+        sim.reaction_tracker.served(document.scheduled, _client_id())
+    with profiling.phase("response"):
+        return document_response(document)
 
-        # If status is Started, NotBefore must be an empty string
-        if event_status == "Started":
-            not_before_time = ""
+@bp.route('/metadata/scheduledevents/delta', methods=['GET'])
+def imds_scheduledevents_delta():
+    """
+    Changes to the IMDS document since the incarnation a client already has.
+    ?since=<DocumentIncarnation> returns the events added or changed since
+    then and the EventIds removed; without since, or once since has left the
+    change log, the whole document is returned with Full set. api-version and
+    resource work as they do on /metadata/scheduledevents.
+    """
+    sim = current_simulator()
+    api_version = request.args.get('api-version')
+    if api_version not in EVENT_SERIALIZERS:
+        return bad_api_version_response()
+    try:
+        # Incarnations start at 1, so no since always gets the full document
+        since = int(request.args.get("since", 0))
+    except ValueError:
+        return jsonify({"error": "since must be an integer DocumentIncarnation"}), 400
+    with profiling.phase("render"):
+        document = sim.document_delta(since, api_version, caller_resource())
+    with profiling.phase("state"):
+        sim.reaction_tracker.served(document.scheduled, _client_id())
+    with profiling.phase("response"):
+        return document_response(document)
 
-        imds_event = {
-            "EventId": event["EventId"],
-            "EventStatus": event_status,
-            "EventType": scenario_details["EventType"],
-            "ResourceType": "VirtualMachine",
-            "Resources": resources,
-            "EventSource": scenario_details["EventSource"],
-            "NotBefore": not_before_time if not_before_time else "",
-            "Description": scenario_details["Description"],
-            "DurationInSeconds": scenario_details["DurationInSeconds"]
-        }
-        return jsonify({
-            "DocumentIncarnation": last_doc_incarnation,
-            "Events": [imds_event]
-        }), 200
-
-    # Existing GET logic below...
-    if not last_event:
-        return jsonify({
-            "DocumentIncarnation": last_doc_incarnation,
-            "Events": []
-        }), 200
-
-    event = last_event
-    scenario_details = event["ActiveScenario"]
-    event_status = event["EventStatus"]
-    not_before_time = event.get("NotBefore")
-    resources = event.get("Resources", ["vmss_vm1"])
-
-    if event_status in scenario_details["EventStatus"] and event_status in ["Completed", "Canceled"]:
-        return jsonify({
-            "DocumentIncarnation": last_doc_incarnation,
-            "Events": []
-        }), 200
-
-    if event_status == "Started":
-        not_before_time = ""
-
-    imds_event = {
-        "EventId": event["EventId"],
-        "EventStatus": event_status,
-        "EventType": scenario_details["EventType"],
-        "ResourceType": "VirtualMachine",
-        "Resources": resources,
-        "EventSource": scenario_details["EventSource"],
-        "NotBefore": not_before_time if not_before_time else "",
-        "Description": scenario_details["Description"],
-        "DurationInSeconds": scenario_details["DurationInSeconds"]
-    }
+@bp.route('/fleet-schedule', methods=['POST'])
+def fleet_schedule_route():
+    """
+    Generate a statistical fleet-wide maintenance schedule and play it back
+    into event_store. Accepts form fields or a JSON body; see fleet.py for the
+    parameters.
+    """
+    import fleet  # NumPy is only needed when a fleet schedule is requested
+    sim = current_simulator()
+    params = request.get_json(silent=True) or request.form
+    try:
+        speed = float(params.get("speed", 1.0))
+        if not (math.isfinite(speed) and speed > 0):
+            raise ValueError("speed must be a positive number")
+        schedule = fleet.generate_schedule(
+            fleet_size=int(params.get("fleet_size", 100)),
+            span_days=float(params.get("span_days", 1)),
+            rate_per_day=float(params.get("rate_per_day", 0.1)),
+            arrival=params.get("arrival", "poisson"),
+            mix=params.get("mix") if isinstance(params.get("mix"), dict) else None,
+            seed=int(params["seed"]) if params.get("seed") is not None else None,
+            vm_prefix=params.get("vm_prefix", "vm"),
+            scenarios=sim.scenarios
+        )
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    fleet.play_schedule(sim, schedule, speed=speed)
+    sim.deadline_queue.start()
     return jsonify({
-        "DocumentIncarnation": last_doc_incarnation,
-        "Events": [imds_event]
-    }), 200
-
-auto_run_thread = None
-stop_auto_run = threading.Event()
-
-def auto_run_scenario():
-    global last_event, last_doc_incarnation, active_scenario, stop_auto_run
-    scenario = scenarios[active_scenario]
-    event_statuses = list(scenario["EventStatus"].keys())
-    durations = list(scenario["EventStatus"].values())
-    not_before_time = None
-    idx = 0
-    while idx < len(event_statuses):
-        status = event_statuses[idx]
-        if stop_auto_run.is_set() or (last_event is not None and active_scenario != last_event.get("Scenario", None)):
-            break
-        # Only set NotBefore for the first event if not already set
-        if idx == 0:
-            if last_event is None or last_event.get("NotBefore") is None:
-                if status == "Scheduled":
-                    offset = scenario.get("NotBeforeDelayInMinutes", 0)
-                    not_before_time = (datetime.now(timezone.utc) + timedelta(minutes=offset)).strftime("%Y-%m-%dT%H:%M:%SZ")
-                else:
-                    not_before_time = None
-            else:
-                not_before_time = last_event.get("NotBefore") if last_event is not None else None
-        else:
-            not_before_time = last_event.get("NotBefore") if last_event is not None else None
-        event_id = str(uuid.uuid4())
-        event = {
-            "EventId": event_id,
-            "Scenario": active_scenario,
-            "EventStatus": status,
-            "ActiveScenario": scenario,
-            "NotBefore": not_before_time
-        }
-        last_event = event
-        last_doc_incarnation += 1
-
-        # Wait for the duration of the current state, but if the user POSTs to advance the state,
-        # the idx will be incremented externally and the sleep will be for the next state's duration.
-        sleep_time = durations[idx] if idx < len(durations) else 0
-        # Sleep in small increments to allow interruption by POST
-        slept = 0
-        while slept < sleep_time:
-            if stop_auto_run.is_set():
-                break
-            time.sleep(1)
-            slept += 1
-            # If the event has advanced (e.g., via POST), break early and continue with the new state
-            if last_event["EventStatus"] != status:
-                # Find the new index based on the updated status
-                try:
-                    idx = event_statuses.index(last_event["EventStatus"])
-                except ValueError:
-                    idx += 1  # fallback: just move to next
-                break
-        else:
-            idx += 1  # Only increment if not interrupted by POST
+        "Events": len(schedule),
+        "FleetSize": schedule.fleet_size,
+        "SpanSeconds": schedule.span_seconds,
+        "Speed": speed,
+        "EventsByScenario": schedule.count_by_scenario()
+    }), 202
 
-    # After reaching the last state, keep returning the same event until user changes scenario
+@bp.route('/timeline', methods=['POST'])
+def timeline_route():
+    """
+    Play a scripted timeline of scenarios (see timeline.py) on the shared
+    deadline queue. The JSON body is a list of entries or an object with
+    "Entries" and an optional "Speed".
+    """
+    import timeline
+    sim = current_simulator()
+    body = request.get_json(silent=True)
+    entries = body.get("Entries") if isinstance(body, dict) else body
+    if not isinstance(entries, list):
+        return jsonify({"error": "Expected a list of timeline entries"}), 400
+    try:
+        speed = float(body.get("Speed", 1.0)) if isinstance(body, dict) else 1.0
+        if not (math.isfinite(speed) and speed > 0):
+            raise ValueError("Speed must be a positive number")
+        # The body is already in memory, so check every entry up front
+        previous_at = last_start = 0.0
+        for raw in entries:
+            entry = timeline.parse_entry(raw, sim.scenarios)
+            if entry["At"] < previous_at:
+                raise ValueError("Timeline entries must be in order of At")
+            previous_at = entry["At"]
+            last_start = max(last_start, entry["At"] + (entry["Repeat"] - 1) * entry["Every"])
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    timeline.play_timeline(sim, entries, speed=speed)
+    sim.deadline_queue.start()
+    return jsonify({"Entries": len(entries), "Speed": speed, "LastStartSeconds": last_start / speed}), 202
 
-@app.route('/auto-run-scenario', methods=['POST'])
+@bp.route('/auto-run-scenario', methods=['POST'])
 def auto_run_scenario_route():
-    global active_scenario, auto_run_thread, stop_auto_run
-    if not active_scenario:
+    sim = current_simulator()
+    if not sim.active_scenario:
         flash("No active scenario. Please set a scenario first.", "error")
-        return redirect(url_for('index'))
-    stop_auto_run.set()  # Stop any previous auto-run
-    stop_auto_run = threading.Event()  # Reset event
-    def run():
-        auto_run_scenario()
-    auto_run_thread = threading.Thread(target=run, daemon=True)
-    auto_run_thread.start()
+        return redirect(url_for('.index'))
+    if "ScaleSet" in sim.scenarios[sim.active_scenario]:
+        sim.stop_auto_run.set()  # Stop any previous auto-run
+        sim.stop_auto_run = threading.Event()  # Reset event
+        overrides = {
+            key: request.form[field]
+            for key, field in [
+                ("UpdateDomains", "update_domains"),
+                ("InstancesPerDomain", "instances_per_domain"),
+                ("MaxConcurrentDomains", "max_concurrent_domains")
+            ]
+            if request.form.get(field, "").isdigit() and int(request.form[field]) > 0
+        }
+        sim.clear_playback()
+        sim.start_rolling_maintenance(sim.active_scenario, **overrides)
+        sim.deadline_queue.start()
+        flash("Rolling maintenance through the scale set.", "success")
+        return redirect(url_for('.index'))
+    sim.start_auto_run()
     flash("Automatically running scenario.", "success")
-    return redirect(url_for('index'))
+    return redirect(url_for('.index'))
 
-@app.route('/stop-auto-run', methods=['POST'])
+@bp.route('/stop-auto-run', methods=['POST'])
 def stop_auto_run_route():
-    global stop_auto_run, last_event
-    stop_auto_run.set()
-    stop_auto_run = threading.Event()
-    last_event = None
+    current_simulator().reset()
     flash("Event playback stopped and reset.", "success")
-    return redirect(url_for('index'))
+    return redirect(url_for('.index'))
 
-if __name__ == '__main__':
-    # Start the Flask web server
-    app.run(host='127.0.0.1', port=80, debug=False)
+def create_app(config=None):
+    """
+    Build a mock IMDS app with its own Simulator. config overrides
+    DEFAULT_CONFIG and may also set CLOCK (e.g. a ManualClock) and SCENARIOS.
+    Apps share nothing, so any number can run side by side in one process.
+    """
+    app = Flask(__name__)
+    app.config.update(DEFAULT_CONFIG)
+    app.config["RESOURCE_BY_CALLER"] = {}
+    if config:
+        app.config.update(config)
+    app.extensions["simulator"] = Simulator(app.config)
+    app.register_blueprint(bp)
+    if app.config["PROFILE_DIR"]:
+        profiling.RequestProfiler(
+            app.config["PROFILE_DIR"],
+            every_n=app.config["PROFILE_EVERY_N"],
+            header=app.config["PROFILE_HEADER"],
+            keep=app.config["PROFILE_KEEP"]
+        ).init_app(app)
+    if app.config["BLOB_STORE"]:
+        import blobstore
+        blobstore.init_app(app, app.config["BLOB_STORE"])
+    return app
 
+# The app behind main.app / main.scenarios, built on first use so importing
+# the module doesn't build a simulator nobody asked for
+_default_app = None
+_default_app_lock = threading.Lock()
 
+def default_app():
+    global _default_app
+    with _default_app_lock:
+        if _default_app is None:
+            _default_app = create_app()
+        return _default_app
+
+def __getattr__(name):
+    if name == "app":
+        return default_app()
+    if name == "scenarios":
+        return default_app().extensions["simulator"].scenarios
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Defaults sized for thousands of pollers hitting one mock server. All state
+# lives in this process, so concurrency comes from threads rather than
+# separate worker processes.
+SERVE_DEFAULTS = {
+    "host": "127.0.0.1",
+    "port": 80,
+    "threads": 32,
+    "backlog": 2048,
+    "connection_limit": 4096,
+    "channel_timeout": 120,
+    "cleanup_interval": 30,
+}
+
+def serve(argv=None, app=None):
+    """
+    Run the app (the default app unless one is given) under the waitress
+    production WSGI server. Every setting can be passed on the command line or
+    through a SE_MOCK_<SETTING> environment variable, e.g. SE_MOCK_THREADS=64.
+    """
+    def default(name):
+        return type(SERVE_DEFAULTS[name])(os.environ.get(f"SE_MOCK_{name.upper()}", SERVE_DEFAULTS[name]))
+
+    parser = argparse.ArgumentParser(description="Scheduled Events Mock Server")
+    parser.add_argument("--host", type=str, default=default("host"), help="Address to bind")
+    parser.add_argument("--port", type=int, default=default("port"), help="Port to bind")
+    parser.add_argument("--threads", type=int, default=default("threads"), help="Worker threads handling requests")
+    parser.add_argument("--backlog", type=int, default=default("backlog"), help="Listen backlog for pending connections")
+    parser.add_argument("--connection-limit", type=int, default=default("connection_limit"), help="Maximum open connections")
+    parser.add_argument("--channel-timeout", type=int, default=default("channel_timeout"), help="Seconds an idle keep-alive connection is kept open")
+    parser.add_argument("--cleanup-interval", type=int, default=default("cleanup_interval"), help="Seconds between checks for idle connections")
+    parser.add_argument("--dev", action="store_true", help="Use the Flask development server instead")
+    args = parser.parse_args(argv)
+    app = app or default_app()
+
+    if args.dev:
+        print(f"Serving on http://{args.host}:{args.port} with the Flask development server")
+        app.run(host=args.host, port=args.port, debug=False, threaded=True)
+        return
+
+    try:
+        from waitress import serve as waitress_serve
+    except ImportError:
+        raise SystemExit("waitress is not installed; run 'pip install waitress' or start with --dev")
+
+    print(f"Serving on http://{args.host}:{args.port} with waitress")
+    print(f"  threads:          {args.threads}")
+    print(f"  listen backlog:   {args.backlog}")
+    print(f"  connection limit: {args.connection_limit}")
+    print(f"  keep-alive:       {args.channel_timeout}s (checked every {args.cleanup_interval}s)")
+    waitress_serve(
+        app,
+        host=args.host,
+        port=args.port,
+        threads=args.threads,
+        backlog=args.backlog,
+        connection_limit=args.connection_limit,
+        channel_timeout=args.channel_timeout,
+        cleanup_interval=args.cleanup_interval,
+        # poll() instead of select() so more than 1024 pollers can connect
+        asyncore_use_poll=True,
+        ident="scheduled-events-mock"
+    )
+
+if __name__ == '__main__':
+    serve()
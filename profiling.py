@@ -0,0 +1,220 @@
+"""
+Opt-in request profiling for the mock server.
+
+RequestProfiler profiles one request in every N, and any request carrying the
+trigger header, on any route. Each profiled request leaves a cProfile dump
+(<name>.prof, readable with pstats or snakeviz) and a <name>.json summary with
+the total time and the time spent in each phase of the request (state lookup,
+rendering, JSON serialization, building the response) in a rotating directory. GET /profiles lists them
+and GET /profiles/<name> downloads one.
+
+Nothing is installed unless the app is configured with PROFILE_DIR, so a
+server without profiling pays nothing per request. phase() timers in the
+request path cost one thread-local lookup when the request isn't profiled.
+"""
+import cProfile
+import io
+import itertools
+import json
+import os
+import pstats
+import re
+import threading
+import time
+from datetime import datetime, timezone
+
+from flask import Blueprint, Response, abort, current_app, g, jsonify, request, send_from_directory
+
+# Timings of the request being profiled on this thread, if any
+_active = threading.local()
+
+
+class _NullPhase:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class _Phase:
+    __slots__ = ("timings", "name", "start", "nested", "parent")
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.parent = getattr(_active, "phase", None)
+        _active.phase = self
+        self.nested = 0.0
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        _active.phase = self.parent
+        if self.parent is not None:
+            self.parent.nested += elapsed
+        self.timings[self.name] = self.timings.get(self.name, 0.0) + elapsed - self.nested
+        return False
+
+
+def phase(name):
+    """
+    Time a block as one phase of the current request:
+
+        with profiling.phase("render"):
+            ...
+
+    Time is added up per name. Phases nest: time spent in an inner phase is
+    counted under the inner name only, not under the enclosing one. Outside a
+    profiled request this is a no-op.
+    """
+    timings = getattr(_active, "timings", None)
+    if timings is None:
+        return _NULL_PHASE
+    return _Phase(timings, name)
+
+
+class RequestProfiler:
+    """
+    Profiles sampled requests of an app into directory, keeping the newest
+    keep profiles. every_n samples one request in N (0 turns sampling off);
+    header names the request header that asks for a profile of that request.
+    """
+    def __init__(self, directory, every_n=0, header="X-Profile-Request", keep=100):
+        self.directory = directory
+        self.every_n = every_n
+        self.header = header
+        self.keep = keep
+        self._counter = itertools.count(1)
+        self._sequence = itertools.count(1)
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def init_app(self, app):
+        app.extensions["profiler"] = self
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+        app.register_blueprint(bp)
+
+    def _trigger(self):
+        if request.blueprint == bp.name:
+            return None
+        if self.header and request.headers.get(self.header):
+            return "header"
+        if self.every_n and next(self._counter) % self.every_n == 0:
+            return "sample"
+        return None
+
+    def _before_request(self):
+        trigger = self._trigger()
+        if trigger is None:
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12+ allows one cProfile at a time per process; a
+            # request overlapping another profiled one only gets timings
+            profile = None
+        _active.timings = {}
+        g.profile = (profile, trigger, time.perf_counter(), datetime.now(timezone.utc))
+
+    def _teardown_request(self, exc=None):
+        state = g.pop("profile", None)
+        if state is None:
+            return
+        profile, trigger, start, started_at = state
+        if profile is not None:
+            profile.disable()
+        total = time.perf_counter() - start
+        timings = _active.__dict__.pop("timings", {})
+        _active.__dict__.pop("phase", None)
+        self._write(profile, {
+            "Method": request.method,
+            "Path": request.full_path.rstrip("?"),
+            "Trigger": trigger,
+            "StartedAt": started_at.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+            "TotalMs": round(total * 1000, 3),
+            "PhasesMs": {name: round(seconds * 1000, 3) for name, seconds in timings.items()},
+            "Error": repr(exc) if exc else None
+        })
+
+    def _write(self, profile, summary):
+        slug = re.sub(r"[^A-Za-z0-9]+", "-", request.path).strip("-") or "root"
+        name = f"{summary['StartedAt'][:19].replace(':', '')}-{next(self._sequence):06d}-{request.method}-{slug}"
+        summary["Name"] = name
+        summary["Profile"] = profile is not None
+        if profile is not None:
+            profile.dump_stats(os.path.join(self.directory, name + ".prof"))
+        with open(os.path.join(self.directory, name + ".json"), "w") as f:
+            json.dump(summary, f)
+        with self._lock:
+            self._rotate()
+
+    def _rotate(self):
+        names = self.names()
+        for name in names[:max(len(names) - self.keep, 0)]:
+            for suffix in (".json", ".prof"):
+                try:
+                    os.remove(os.path.join(self.directory, name + suffix))
+                except FileNotFoundError:
+                    pass
+
+    def names(self):
+        """
+        Profile names, oldest first.
+        """
+        return sorted(entry[:-5] for entry in os.listdir(self.directory) if entry.endswith(".json"))
+
+    def summary(self, name):
+        with open(os.path.join(self.directory, name + ".json")) as f:
+            return json.load(f)
+
+
+bp = Blueprint("profiles", __name__)
+
+
+def _profiler():
+    return current_app.extensions["profiler"]
+
+
+@bp.route('/profiles', methods=['GET'])
+def list_profiles():
+    """
+    List the stored profiles, newest first, with their timings.
+    """
+    profiler = _profiler()
+    profiles = []
+    for name in reversed(profiler.names()):
+        try:
+            profiles.append(profiler.summary(name))
+        except (FileNotFoundError, ValueError):
+            continue  # rotated away or still being written
+    return jsonify({
+        "EveryN": profiler.every_n,
+        "Header": profiler.header,
+        "Profiles": profiles
+    }), 200
+
+
+@bp.route('/profiles/<name>', methods=['GET'])
+def download_profile(name):
+    """
+    Download a profile as a cProfile dump, or ?format=text for the top
+    functions by cumulative time.
+    """
+    profiler = _profiler()
+    if name not in profiler.names() or not os.path.exists(os.path.join(profiler.directory, name + ".prof")):
+        abort(404)
+    if request.args.get("format") == "text":
+        output = io.StringIO()
+        stats = pstats.Stats(os.path.join(profiler.directory, name + ".prof"), stream=output)
+        stats.sort_stats("cumulative").print_stats(request.args.get("limit", 50, type=int))
+        return Response(output.getvalue(), mimetype="text/plain")
+    return send_from_directory(os.path.abspath(profiler.directory), name + ".prof", as_attachment=True)
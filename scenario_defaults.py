@@ -0,0 +1,345 @@
+"""
+The predefined maintenance scenarios and the default event-type mix.
+
+Kept free of Flask and NumPy so that tools which only need the scenario
+definitions, such as listener_replay.py, can import them without loading the
+server.
+"""
+from collections import OrderedDict
+import math
+import uuid
+
+# Default event-type mix, weighted towards the freezes that make up most
+# platform maintenance. Keys are scenario names or EventTypes.
+DEFAULT_MIX = {
+    "Host Agent Maintenance": 0.55,
+    "Live Migration": 0.25,
+    "User Reboot": 0.08,
+    "Redeploy": 0.07,
+    "Spot Eviction": 0.05,
+}
+
+
+def default_scenarios():
+    """
+    Return a fresh copy of the predefined scenarios. Each simulator gets its
+    own copy, so scenarios added or changed on one app don't leak into another.
+    """
+    # Dev timing scenarios have all their timings in seconds
+    # So instead of waiting 15 minutes for an event to appear, it'll take 15 seconds
+    # to prevent waiting when testing locally.
+    # The other scenarios have the timings convert the times to minutes to match what
+    # would happen in production
+    return {
+        "Live Migration - Dev Timing": {
+            "EventId": str(uuid.uuid4()),
+            "NotBeforeDelayInMinutes": 15,
+            "NotBeforeDelayInSeconds": 15,
+            "StartedDurationInMinutes": 5,
+            "EventStatus": OrderedDict([
+                ("Scheduled", 15),
+                ("Started", 5),
+                ("Completed", 0)
+            ]),
+            "EventType": "Freeze",
+            "Description": "Virtual machine is being paused because of a memory-preserving Live Migration operation.",
+            "ScenarioDescription": """This scenario simulates a live migration. LMs 
+                can be triggered by the platform in the case of host maintenance or if 
+                there is a predicted host failure.""",
+            "EventSource": "Platform",
+            "DurationInSeconds": 5,
+        },
+        "User Reboot - Dev Timing": {
+            "EventId": str(uuid.uuid4()),
+            "NotBeforeDelayInMinutes": 15,
+            "NotBeforeDelayInSeconds": 15,
+            "StartedDurationInMinutes": 10,
+            "EventStatus": OrderedDict([
+                ("Scheduled", 15),
+                ("Started", 10),
+                ("Completed", 0)
+            ]),
+            "EventType": "Reboot",
+            "Description": "Virtual machine is going to be restarted as requested by authorized user.",
+            "ScenarioDescription": """This scenario simulates a reboot initiated by 
+                the user. This can be triggered via the portal or CLI if you'd like 
+                to test with a real reboot""",
+            "EventSource": "User",
+            "DurationInSeconds": -1,
+        },
+        "Host Agent Maintenance - Dev Timing": {
+            "EventId": str(uuid.uuid4()),
+            "NotBeforeDelayInMinutes": 15,
+            "NotBeforeDelayInSeconds": 15,
+            "StartedDurationInMinutes": 10,
+            "EventStatus": OrderedDict([
+                ("Scheduled", 15),
+                ("Started", 10),
+                ("Completed", 0)
+            ]),
+            "EventType": "Freeze",
+            "Description": "Host server is undergoing maintenance.",
+            "ScenarioDescription": """This scenario simulates host maintenance, which 
+                is the most common reason for a scheduled event. The VM is typically frozen for 
+                between 1 and 15 seconds, but the time between the started and completed 
+                events is longer to allow Azure to run health checks after the maintenance.""",
+            "EventSource": "Platform",
+            "DurationInSeconds": 9,
+        },
+        "Redeploy - Dev Timing": {
+            "EventId": str(uuid.uuid4()),
+            "NotBeforeDelayInMinutes": 15,
+            "NotBeforeDelayInSeconds": 15,
+            "StartedDurationInMinutes": 10,
+            "EventStatus": OrderedDict([
+                ("Scheduled", 15),
+                ("Started", 10),
+                ("Completed", 0)
+            ]),
+            "EventType": "Redeploy",
+            "Description": "Virtual machine has encountered a failure.",
+            "ScenarioDescription": """This scenario simulates a platform-initiated redeploy "
+                due to a host failure.""",
+            "EventSource": "Platform",
+            "DurationInSeconds": -1
+        },
+        "User Redeploy - Dev Timing": {
+            "EventId": str(uuid.uuid4()),
+            "NotBeforeDelayInMinutes": 15,
+            "NotBeforeDelayInSeconds": 15,
+            "StartedDurationInMinutes": 10,
+            "EventStatus": OrderedDict([
+                ("Scheduled", 15),
+                ("Started", 10),
+                ("Completed", 0)
+            ]),
+            "EventType": "Redeploy",
+            "Description": "Virtual machine is going to be redeployed as requested by authorized user.",
+            "ScenarioDescription": """This scenario simulates a redeploy initiated by 
+                the user. This event can also be triggered via the portal or CLI""",
+            "EventSource": "User",
+            "DurationInSeconds": -1
+        },
+        "Canceled Maintenance - Dev Timing": {
+            "EventId": str(uuid.uuid4()),
+            "NotBeforeDelayInMinutes": 15,
+            "NotBeforeDelayInSeconds": 15,
+            "StartedDurationInMinutes": 10,
+            "EventStatus": OrderedDict([
+                ("Scheduled", 8),
+                ("Canceled", 0)
+            ]),
+            "EventType": "Freeze",
+            "Description": "Host server is undergoing maintenance.",
+            "ScenarioDescription": """This scenario simulates the rare case where a 
+                maintenance event that was canceled. This can happen if Azure detects other 
+                hosts receiving the same maintenance event are failing health checks. The 
+                system will cancel any pending maintenance events and pause the maintenance until
+                a root cause can be determined.""",
+            "EventSource": "Platform",
+            "DurationInSeconds": 9,
+        },
+        "Live Migration": {
+            "EventId": str(uuid.uuid4()),
+            "NotBeforeDelayInMinutes": 15,
+            "StartedDurationInMinutes": 5,
+            "EventStatus": OrderedDict([
+                ("Scheduled", 15 * 60),
+                ("Started", 5 * 60),
+                ("Completed", 0)
+            ]),
+            "EventType": "Freeze",
+            "Description": "Virtual machine is being paused because of a memory-preserving Live Migration operation.",
+            "ScenarioDescription": """This scenario simulates a live migration. LMs 
+                can be triggered by the platform in the case of host maintenance or if 
+                there is a predicted host failure.""",
+            "EventSource": "Platform",
+            "DurationInSeconds": 5,
+        },
+        "User Reboot": {
+            "EventId": str(uuid.uuid4()),
+            "NotBeforeDelayInMinutes": 15,
+            "StartedDurationInMinutes": 10,
+            "EventStatus": OrderedDict([
+                ("Scheduled", 15 * 60),
+                ("Started", 10 * 60),
+                ("Completed", 0)
+            ]),
+            "EventType": "Reboot",
+            "Description": "Virtual machine is going to be restarted as requested by authorized user.",
+            "ScenarioDescription": """This scenario simulates a reboot initiated by 
+                the user. This can be triggered via the portal or CLI if you'd like 
+                to test with a real reboot""",
+            "EventSource": "User",
+            "DurationInSeconds": -1,
+        },
+        "Host Agent Maintenance": {
+            "EventId": str(uuid.uuid4()),
+            "NotBeforeDelayInMinutes": 15,
+            "StartedDurationInMinutes": 10,
+            "EventStatus": OrderedDict([
+                ("Scheduled", 15 * 60),
+                ("Started", 10 * 60),
+                ("Completed", 0)
+            ]),
+            "EventType": "Freeze",
+            "Description": "Host server is undergoing maintenance.",
+            "ScenarioDescription": """This scenario simulates host maintenance, which 
+                is the most common reason for a scheduled event. The VM is typically frozen for 
+                between 1 and 15 seconds, but the time between the started and completed 
+                events is longer to allow Azure to run health checks after the maintenance.""",
+            "EventSource": "Platform",
+            "DurationInSeconds": 9,
+        },
+        "Redeploy": {
+            "EventId": str(uuid.uuid4()),
+            "NotBeforeDelayInMinutes": 15,
+            "StartedDurationInMinutes": 10,
+            "EventStatus": OrderedDict([
+                ("Scheduled", 15 * 60),
+                ("Started", 10 * 60),
+                ("Completed", 0)
+            ]),
+            "EventType": "Redeploy",
+            "Description": "Virtual machine has encountered a failure.",
+            "ScenarioDescription": """This scenario simulates a platform-initiated redeploy "
+                due to a host failure.""",
+            "EventSource": "Platform",
+            "DurationInSeconds": -1
+        },
+        "User Redeploy": {
+            "EventId": str(uuid.uuid4()),
+            "NotBeforeDelayInMinutes": 15,
+            "StartedDurationInMinutes": 10,
+            "EventStatus": OrderedDict([
+                ("Scheduled", 15 * 60),
+                ("Started", 10 * 60),
+                ("Completed", 0)
+            ]),
+            "EventType": "Redeploy",
+            "Description": "Virtual machine is going to be redeployed as requested by authorized user.",
+            "ScenarioDescription": """This scenario simulates a redeploy initiated by 
+                the user. This event can also be triggered via the portal or CLI""",
+            "EventSource": "User",
+            "DurationInSeconds": -1
+        },
+        "Canceled Maintenance": {
+            "EventId": str(uuid.uuid4()),
+            "NotBeforeDelayInMinutes": 15,
+            "StartedDurationInMinutes": 10,
+            "EventStatus": OrderedDict([
+                ("Scheduled", 8 * 60),
+                ("Canceled", 0)
+            ]),
+            "EventType": "Freeze",
+            "Description": "Host server is undergoing maintenance.",
+            "ScenarioDescription": """This scenario simulates the rare case where a 
+                maintenance event that was canceled. This can happen if Azure detects other 
+                hosts receiving the same maintenance event are failing health checks. The 
+                system will cancel any pending maintenance events and pause the maintenance until
+                a root cause can be determined.""",
+            "EventSource": "Platform",
+            "DurationInSeconds": 9,
+        },
+        # Add scenario for Spot VM Eviction
+        "Spot Eviction": {
+            "EventId": str(uuid.uuid4()),
+            "NotBeforeDelayInMinutes": 15,
+            "NotBeforeDelayInSeconds": 15,
+            "StartedDurationInMinutes": 5,
+            "ResourceType": "VirtualMachine",
+            "Resources": [
+                "vm1"
+            ],
+            "EventStatus": OrderedDict([
+                ("Scheduled", 15),
+                ("Started", 5),
+                ("Completed", 0)
+            ]),
+            "EventType": "Preempt",
+            "Description": "The Virtual Machine will be evicted.",
+            "ScenarioDescription": """This scenario simulates eviction of a Spot Virtual Machine.
+                The Spot Virtual Machine is being deleted (ephemeral disks are lost). This event is made available on a best effort basis""",
+            "EventSource": "Platform",
+            "DurationInSeconds": -1,
+        },
+        # Scale set scenarios roll a maintenance wave through the update domains,
+        # one event per domain covering that domain's instances
+        "VMSS Rolling Maintenance - Dev Timing": {
+            "EventId": str(uuid.uuid4()),
+            "NotBeforeDelayInMinutes": 15,
+            "NotBeforeDelayInSeconds": 15,
+            "StartedDurationInMinutes": 10,
+            "EventStatus": OrderedDict([
+                ("Scheduled", 15),
+                ("Started", 10),
+                ("Completed", 0)
+            ]),
+            "EventType": "Freeze",
+            "Description": "Host server is undergoing maintenance.",
+            "ScenarioDescription": """This scenario simulates platform maintenance rolling through 
+                a virtual machine scale set. Each update domain gets its own event covering the 
+                instances in that domain, and the next domain starts once the previous one completes.""",
+            "EventSource": "Platform",
+            "DurationInSeconds": 9,
+            "ScaleSet": {
+                "Name": "vmss",
+                "UpdateDomains": 5,
+                "InstancesPerDomain": 4,
+                "MaxConcurrentDomains": 1
+            },
+        },
+        "VMSS Rolling Maintenance": {
+            "EventId": str(uuid.uuid4()),
+            "NotBeforeDelayInMinutes": 15,
+            "StartedDurationInMinutes": 10,
+            "EventStatus": OrderedDict([
+                ("Scheduled", 15 * 60),
+                ("Started", 10 * 60),
+                ("Completed", 0)
+            ]),
+            "EventType": "Freeze",
+            "Description": "Host server is undergoing maintenance.",
+            "ScenarioDescription": """This scenario simulates platform maintenance rolling through 
+                a virtual machine scale set. Each update domain gets its own event covering the 
+                instances in that domain, and the next domain starts once the previous one completes.""",
+            "EventSource": "Platform",
+            "DurationInSeconds": 9,
+            "ScaleSet": {
+                "Name": "vmss",
+                "UpdateDomains": 5,
+                "InstancesPerDomain": 4,
+                "MaxConcurrentDomains": 1
+            },
+        }
+        # Add more scenarios as needed
+    }
+
+
+def resolve_mix(mix, scenarios):
+    """
+    Turn a mix keyed by scenario name or EventType (Freeze/Reboot/Redeploy/
+    Preempt) into parallel lists of scenario names and normalized weights.
+    EventTypes resolve to the first production-timing scenario of that type.
+    """
+    names = []
+    weights = []
+    for key, weight in mix.items():
+        if key in scenarios:
+            name = key
+        else:
+            name = next(
+                (
+                    scenario_name for scenario_name, scenario in scenarios.items()
+                    if scenario["EventType"] == key and not scenario_name.endswith("Dev Timing")
+                ),
+                None
+            )
+            if name is None:
+                raise ValueError(f"Unknown scenario or event type in mix: {key}")
+        names.append(name)
+        weights.append(float(weight))
+    total = sum(weights)
+    if not weights or not all(math.isfinite(weight) and weight >= 0 for weight in weights) or not total > 0:
+        raise ValueError("Mix weights must be finite, non-negative and not all zero")
+    return names, [weight / total for weight in weights]
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Long-duration soak run of the mock server on an accelerated clock.
+
+An isolated app (main.create_app) on a ManualClock loops every scenario in
+`scenarios` over a simulated week: playback events for the polling VMs, UI
+traffic (set-scenario, generate-event and auto-run through the routes, with
+redirects followed like a browser) and pollers that GET the document and
+approve what they see. At a fixed simulated interval it samples RSS, thread
+count, tracemalloc totals and the size of every long-lived structure, then
+reports which of them kept growing through the second half of the run.
+
+History, the delta change log, reaction and transition tracking are bounded
+buffers; the soak shrinks them (--history-size, --reaction-max-events) so they
+fill during the first half and anything still growing after that points at a
+leak.
+
+    python soak.py                       # one simulated week
+    python soak.py --days 28 --pollers 50 --report soak_report.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import tracemalloc
+
+import main
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Metrics reported per sample, besides SimulatedHours
+METRICS = [
+    "RssBytes", "Threads", "TracedBytes", "EventStore", "ResourceIndex", "PendingTransitions",
+    "DeadlineQueue", "History", "ChangeLog", "ReactionEvents", "TransitionSamples", "RenderedDocuments", "RenderedEvents",
+    "StaticFragments", "SessionCookieBytes"
+]
+
+
+def rss_bytes():
+    """
+    Current resident set size: psutil when installed, else /proc on Linux.
+    """
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def take_sample(simulator, ui_client, hours, traced):
+    cookie = ui_client.get_cookie("session")
+    return {
+        "SimulatedHours": round(hours, 2),
+        "RssBytes": rss_bytes(),
+        "Threads": threading.active_count(),
+        "TracedBytes": tracemalloc.get_traced_memory()[0] if traced else None,
+        "EventStore": len(simulator.event_store),
+        "ResourceIndex": len(simulator._events_by_resource),
+        "PendingTransitions": len(simulator._pending_transitions),
+        "DeadlineQueue": len(simulator.deadline_queue),
+        "History": len(simulator.history),
+        "ChangeLog": len(simulator.change_log),
+        "ReactionEvents": len(simulator.reaction_tracker._events),
+        "TransitionSamples": len(simulator.transition_tracker),
+        "RenderedDocuments": len(simulator._rendered_documents),
+        "RenderedEvents": len(simulator._rendered_events),
+        "StaticFragments": len(simulator._static_fragments),
+        "SessionCookieBytes": len(cookie.value) if cookie is not None else 0
+    }
+
+
+def find_growth(samples, tolerance=0.05):
+    """
+    Return the metrics that never went down over the second half of the
+    samples and ended more than tolerance above where that half started.
+    Bounded structures that fill up early and then plateau aren't flagged.
+    """
+    tail = samples[len(samples) // 2:]
+    growing = {}
+    if len(tail) < 3:
+        return growing
+    for metric in METRICS:
+        values = [sample[metric] for sample in tail]
+        if any(value is None for value in values):
+            continue
+        first, last = values[0], values[-1]
+        if all(b >= a for a, b in zip(values, values[1:])) and last > first * (1 + tolerance) and last > first + 1:
+            growing[metric] = {"From": first, "To": last}
+    return growing
+
+
+class Soak:
+    def __init__(self, days=7, pollers=10, step_seconds=60, sample_hours=6, approve_rate=0.5, seed=0, traced=True,
+                 history_size=1000, reaction_max_events=1000):
+        self.app = main.create_app({
+            "CLOCK": main.ManualClock(),
+            "HISTORY_SIZE": history_size,
+            "CHANGE_LOG_SIZE": history_size,
+            "REACTION_MAX_EVENTS": reaction_max_events,
+            "TRANSITION_MAX_SAMPLES": reaction_max_events
+        })
+        self.simulator = self.app.extensions["simulator"]
+        self.duration = days * 24 * 3600
+        self.step_seconds = step_seconds
+        self.sample_seconds = sample_hours * 3600
+        self.approve_rate = approve_rate
+        self.random = random.Random(seed)
+        self.traced = traced
+        self.vms = [f"soak_vm{i}" for i in range(pollers)]
+        self.poller_clients = [self.app.test_client(use_cookies=False) for _ in self.vms]
+        self.ui_client = self.app.test_client()
+        self.scenario_names = list(self.simulator.scenarios)
+        self.cycles = 0
+        self.requests = 0
+
+    def start_next_scenario(self):
+        """
+        Play the next scenario from `scenarios` for the polling VMs, and drive
+        the UI through the same scenario.
+        """
+        simulator = self.simulator
+        scenario_name = self.scenario_names[self.cycles % len(self.scenario_names)]
+        scenario = simulator.scenarios[scenario_name]
+        self.cycles += 1
+        if "ScaleSet" in scenario:
+            simulator.start_rolling_maintenance(scenario_name, UpdateDomains=2, InstancesPerDomain=2, MaxConcurrentDomains=1)
+        else:
+            simulator.start_playback_event(scenario_name, list(self.vms))
+
+        client = self.ui_client
+        client.post("/set-scenario", data={"scenario": scenario_name}, follow_redirects=True)
+        for status in scenario["EventStatus"]:
+            client.post("/generate-event", data={"event_status": status, "resources": ",".join(self.vms[:2])}, follow_redirects=True)
+        if self.cycles % 5 == 0 and "ScaleSet" not in scenario:
+            client.post("/auto-run-scenario", follow_redirects=True)
+            # Auto-run sleeps on the ManualClock, so it finishes straight away;
+            # a thread still alive here is one that would never exit
+            simulator.auto_run_thread.join(timeout=5)
+            client.post("/stop-auto-run", follow_redirects=True)
+        self.requests += 3 + len(scenario["EventStatus"])
+
+    def poll(self):
+        for vm, client in zip(self.vms, self.poller_clients):
+            data = client.get(f"/metadata/scheduledevents?resource={vm}", headers={"X-Client-Id": vm}).get_json()
+            self.requests += 1
+            approvals = [
+                {"EventId": event["EventId"]}
+                for event in data["Events"]
+                if event["EventStatus"] == "Scheduled" and self.random.random() < self.approve_rate
+            ]
+            if approvals:
+                client.post("/metadata/scheduledevents", json={"StartRequests": approvals}, headers={"X-Client-Id": vm})
+                self.requests += 1
+
+    def run(self, progress=None):
+        simulator = self.simulator
+        clock = simulator.clock
+        if self.traced:
+            tracemalloc.start()
+        samples = []
+        first_snapshot = None
+        next_sample = 0
+        try:
+            while clock.monotonic() < self.duration:
+                if not simulator.event_store and simulator.deadline_queue.next_deadline() is None:
+                    self.start_next_scenario()
+                self.poll()
+                simulator.deadline_queue.run_until(clock.monotonic() + self.step_seconds)
+                if clock.monotonic() >= next_sample:
+                    samples.append(take_sample(simulator, self.ui_client, clock.monotonic() / 3600, self.traced))
+                    if self.traced and first_snapshot is None and clock.monotonic() >= self.duration / 2:
+                        first_snapshot = tracemalloc.take_snapshot()
+                    if progress:
+                        progress(samples[-1])
+                    next_sample += self.sample_seconds
+            samples.append(take_sample(simulator, self.ui_client, clock.monotonic() / 3600, self.traced))
+            top_growth = []
+            if self.traced and first_snapshot is not None:
+                for stat in tracemalloc.take_snapshot().compare_to(first_snapshot, "lineno")[:10]:
+                    frame = stat.traceback[0]
+                    top_growth.append({
+                        "Location": f"{frame.filename}:{frame.lineno}",
+                        "SizeDiffBytes": stat.size_diff,
+                        "SizeBytes": stat.size,
+                        "Count": stat.count
+                    })
+        finally:
+            if self.traced:
+                tracemalloc.stop()
+            simulator.close()
+        return {
+            "SimulatedDays": round(self.duration / 86400, 2),
+            "Pollers": len(self.vms),
+            "ScenarioCycles": self.cycles,
+            "Requests": self.requests,
+            "Samples": samples,
+            "Growing": find_growth(samples),
+            "TopAllocationGrowth": top_growth
+        }
+
+
+def _format(value):
+    return "-" if value is None else f"{value:,}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Soak the mock server over simulated days on an accelerated clock")
+    parser.add_argument("--days", type=float, default=7, help="Simulated days to run")
+    parser.add_argument("--pollers", type=int, default=10, help="Polling VMs")
+    parser.add_argument("--step", type=float, default=60, help="Simulated seconds between polls")
+    parser.add_argument("--sample-hours", type=float, default=6, help="Simulated hours between samples")
+    parser.add_argument("--approve-rate", type=float, default=0.5, help="Chance a poller approves a Scheduled event it sees")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for poller approvals")
+    parser.add_argument("--history-size", type=int, default=1000, help="History and change log size for the soak")
+    parser.add_argument("--reaction-max-events", type=int, default=1000, help="Events kept by reaction and transition tracking for the soak")
+    parser.add_argument("--no-tracemalloc", action="store_true", help="Skip tracemalloc sampling (faster)")
+    parser.add_argument("--report", type=str, help="Write the full report as JSON to this file")
+    args = parser.parse_args()
+
+    print(f"{'Hours':>8} {'RSS':>14} {'Threads':>8} {'Traced':>14} {'Store':>6} {'History':>8} {'Cookie':>7}")
+    soak = Soak(
+        args.days, args.pollers, args.step, args.sample_hours, args.approve_rate, args.seed,
+        not args.no_tracemalloc, args.history_size, args.reaction_max_events
+    )
+    report = soak.run(lambda s: print(
+        f"{s['SimulatedHours']:>8} {_format(s['RssBytes']):>14} {s['Threads']:>8} {_format(s['TracedBytes']):>14} "
+        f"{s['EventStore']:>6} {s['History']:>8} {s['SessionCookieBytes']:>7}"
+    ))
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+
+    print(f"\n{report['Requests']:,} requests over {report['SimulatedDays']} simulated days, {report['ScenarioCycles']} scenario cycles")
+    if report["TopAllocationGrowth"]:
+        print("\nLargest allocation growth over the second half:")
+        for entry in report["TopAllocationGrowth"]:
+            print(f"  {entry['SizeDiffBytes']:>+12,} B  {entry['Location']}")
+    if report["Growing"]:
+        print("\nStill growing over the second half of the run:")
+        for metric, growth in report["Growing"].items():
+            print(f"- {metric}: {_format(growth['From'])} -> {_format(growth['To'])}")
+        sys.exit(1)
+    print("\nNo monotonic growth over the second half of the run.")
@@ -0,0 +1,147 @@
+import pytest
+import threading
+import main
+
+@pytest.fixture(params=['memory', 'directory'])
+def app(request, tmp_path):
+    location = 'memory' if request.param == 'memory' else str(tmp_path / 'blobs')
+    app = main.create_app({'TESTING': True, 'BLOB_STORE': location})
+    yield app
+    app.extensions['simulator'].close()
+
+def test_blob_store_is_off_by_default():
+    app = main.create_app({'TESTING': True})
+    with app.test_client() as client:
+        assert client.put('/blob/spotvmentity/a.json', data=b'{}').status_code == 404
+
+def test_block_blob_upload_and_download(app):
+    with app.test_client() as client:
+        assert client.put('/blob/spotvmentity?restype=container').status_code == 201
+        resp = client.put('/blob/spotvmentity/RestartVM/1.json', data=b'{"EventId": "1"}',
+                          headers={'x-ms-blob-type': 'BlockBlob', 'x-ms-version': '2021-08-06'})
+        assert resp.status_code == 201
+        assert resp.headers['ETag'] and resp.headers['Last-Modified'].endswith('GMT')
+        assert client.get('/blob/spotvmentity/RestartVM/1.json').data == b'{"EventId": "1"}'
+        assert client.get('/blob').get_json()['Blobs'] == [{'Container': 'spotvmentity', 'Name': 'RestartVM/1.json', 'Size': 16}]
+        resp = client.get('/blob/spotvmentity/missing.json')
+        assert resp.status_code == 404
+        assert resp.headers['x-ms-error-code'] == 'BlobNotFound'
+        metrics = client.get('/metrics/blob').get_json()
+        assert metrics['Uploads'] >= 1
+        assert metrics['Bytes'] >= 16
+        assert metrics['LatencyMs']['Max'] >= metrics['LatencyMs']['P50'] >= 0
+
+def test_append_blob(app):
+    with app.test_client() as client:
+        assert client.put('/blob/c/log.ndjson?comp=appendblock', data=b'x').status_code == 404
+        assert client.put('/blob/c/log.ndjson', headers={'x-ms-blob-type': 'AppendBlob', 'If-None-Match': '*'}).status_code == 201
+        assert client.put('/blob/c/log.ndjson', headers={'x-ms-blob-type': 'AppendBlob', 'If-None-Match': '*'}).status_code == 409
+        first = client.put('/blob/c/log.ndjson?comp=appendblock', data=b'{"a":1}\n')
+        second = client.put('/blob/c/log.ndjson?comp=appendblock', data=b'{"a":2}\n')
+        assert (first.headers['x-ms-blob-append-offset'], second.headers['x-ms-blob-append-offset']) == ('0', '8')
+        resp = client.get('/blob/c/log.ndjson')
+        assert resp.data == b'{"a":1}\n{"a":2}\n'
+        assert resp.headers['x-ms-blob-type'] == 'AppendBlob'
+    store = app.extensions['blob_store']
+    assert store.blob_type('c', 'log.ndjson') == 'AppendBlob'
+    assert store.blob_type('c', 'missing.ndjson') is None
+
+def _block_list(*blocks):
+    body = ''.join(f'<{kind}>{block_id}</{kind}>' for kind, block_id in blocks)
+    return f'<?xml version="1.0" encoding="utf-8"?><BlockList>{body}</BlockList>'.encode()
+
+def test_block_list_upload(app):
+    store = app.extensions['blob_store']
+    with app.test_client() as client:
+        assert client.put('/blob/c/big.bin?comp=block&blockid=QUFB', data=b'aaa').status_code == 201
+        assert client.put('/blob/c/big.bin?comp=block&blockid=QkJC', data=b'bbb').status_code == 201
+        assert store.staged_block_ids('c', 'big.bin') == ['QUFB', 'QkJC']
+        assert store.blob_type('c', 'big.bin') is None
+        resp = client.put('/blob/c/big.bin?comp=blocklist', data=_block_list(('Latest', 'QkJC'), ('Uncommitted', 'QUFB')))
+        assert resp.status_code == 201
+        assert client.get('/blob/c/big.bin').data == b'bbbaaa'
+        assert store.blob_type('c', 'big.bin') == 'BlockBlob'
+        assert store.committed_block_ids('c', 'big.bin') == ['QkJC', 'QUFB']
+        assert store.staged_block_ids('c', 'big.bin') == []
+        # Committed blocks can be reused alongside newly staged ones
+        client.put('/blob/c/big.bin?comp=block&blockid=Q0ND', data=b'ccc')
+        resp = client.put('/blob/c/big.bin?comp=blocklist', data=_block_list(('Committed', 'QUFB'), ('Latest', 'Q0ND')))
+        assert resp.status_code == 201
+        assert client.get('/blob/c/big.bin').data == b'aaaccc'
+
+def test_block_list_rejects_unknown_and_restaged_blocks(app):
+    store = app.extensions['blob_store']
+    with app.test_client() as client:
+        client.put('/blob/c/big.bin?comp=block&blockid=QUFB', data=b'aaa')
+        resp = client.put('/blob/c/big.bin?comp=block&blockid=QUFB', data=b'zzz')
+        assert resp.status_code == 400
+        assert resp.headers['x-ms-error-code'] == 'InvalidBlockList'
+        for block_list in (
+            _block_list(('Latest', 'QUFB'), ('Latest', 'bmV2ZXI=')),
+            _block_list(('Committed', 'QUFB')),
+        ):
+            resp = client.put('/blob/c/big.bin?comp=blocklist', data=block_list)
+            assert resp.status_code == 400
+            assert resp.headers['x-ms-error-code'] == 'InvalidBlockList'
+        assert store.blob_type('c', 'big.bin') is None
+        assert store.staged_block_ids('c', 'big.bin') == ['QUFB']
+        assert client.put('/blob/c/big.bin?comp=blocklist', data=b'<BlockList>').status_code == 400
+        assert client.put('/blob/c/big.bin?comp=block', data=b'x').status_code == 400
+        assert client.put('/blob/c/big.bin?comp=blocklist', data=_block_list(('Latest', 'QUFB'))).status_code == 201
+        assert client.get('/blob/c/big.bin').data == b'aaa'
+
+def test_directory_store_stays_inside_its_root(tmp_path):
+    app = main.create_app({'TESTING': True, 'BLOB_STORE': str(tmp_path / 'blobs')})
+    with app.test_client() as client:
+        assert client.put('/blob/c/..%2F..%2Fescape', data=b'x').status_code == 400
+        assert client.put('/blob/c/RestartVM/2.json', data=b'{}').status_code == 201
+    assert not (tmp_path / 'escape').exists()
+    assert (tmp_path / 'blobs' / 'c' / 'RestartVM' / '2.json').read_bytes() == b'{}'
+
+def test_ranged_download(app):
+    with app.test_client() as client:
+        client.put('/blob/c/data.bin', data=b'0123456789')
+        resp = client.get('/blob/c/data.bin', headers={'x-ms-range': 'bytes=2-5'})
+        assert resp.status_code == 206
+        assert resp.data == b'2345'
+        assert resp.headers['Content-Range'] == 'bytes 2-5/10'
+        resp = client.get('/blob/c/data.bin', headers={'Range': 'bytes=8-'})
+        assert (resp.status_code, resp.data, resp.headers['Content-Range']) == (206, b'89', 'bytes 8-9/10')
+        assert client.get('/blob/c/data.bin', headers={'x-ms-range': 'bytes=4-99'}).data == b'456789'
+        resp = client.get('/blob/c/data.bin', headers={'x-ms-range': 'bytes=10-'})
+        assert resp.status_code == 416
+        assert resp.headers['Content-Range'] == 'bytes */10'
+        assert client.get('/blob/c/data.bin', headers={'x-ms-range': 'lines=1'}).status_code == 400
+
+def test_azure_sdk_round_trip(app):
+    blob = pytest.importorskip('azure.storage.blob')
+    from werkzeug.serving import make_server
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        # Small download chunks, so download_blob() makes several ranged requests
+        service = blob.BlobServiceClient(
+            account_url=f'http://127.0.0.1:{server.server_port}/blob',
+            max_single_get_size=1024, max_chunk_get_size=1024
+        )
+        payload = bytes(range(256)) * 20
+        block_blob = service.get_blob_client(container='spotvmentity', blob='RestartVM/1.json')
+        block_blob.upload_blob(payload, overwrite=True)
+        assert block_blob.download_blob().readall() == payload
+        # Small single-put and block sizes, so upload_blob() stages blocks and commits them
+        chunked = blob.BlobServiceClient(
+            account_url=f'http://127.0.0.1:{server.server_port}/blob',
+            max_single_put_size=1024, max_block_size=1024
+        )
+        chunked.get_blob_client(container='spotvmentity', blob='RestartVM/big.json').upload_blob(payload, overwrite=True)
+        assert service.get_blob_client(container='spotvmentity', blob='RestartVM/big.json').download_blob().readall() == payload
+        assert len(app.extensions['blob_store'].committed_block_ids('spotvmentity', 'RestartVM/big.json')) == 5
+        append_blob = service.get_blob_client(container='spotvmentity', blob='RestartVM/vm1/2025070110.ndjson')
+        append_blob.create_append_blob()
+        assert append_blob.download_blob().readall() == b''
+        append_blob.append_block(b'{"EventId":"1"}\n')
+        append_blob.append_block(b'{"EventId":"2"}\n')
+        assert append_blob.download_blob().readall() == b'{"EventId":"1"}\n{"EventId":"2"}\n'
+    finally:
+        server.shutdown()
@@ -0,0 +1,107 @@
+import time
+import pytest
+import main
+import fleet
+
+@pytest.fixture
+def app():
+    app = main.create_app({'TESTING': True, 'CLOCK': main.ManualClock()})
+    yield app
+    app.extensions['simulator'].close()
+
+@pytest.fixture
+def simulator(app):
+    return app.extensions['simulator']
+
+def test_schedule_is_sorted_and_deterministic():
+    schedule = fleet.generate_schedule(1000, 7, rate_per_day=0.5, seed=42)
+    again = fleet.generate_schedule(1000, 7, rate_per_day=0.5, seed=42)
+    assert len(schedule) == len(again)
+    assert (schedule.times == again.times).all()
+    assert (schedule.times[1:] >= schedule.times[:-1]).all()
+    assert schedule.times.min() >= 0
+    assert schedule.times.max() <= 7 * fleet.SECONDS_PER_DAY
+    assert schedule.vm_indices.max() < 1000
+
+def test_event_type_mix_resolves_to_scenarios():
+    schedule = fleet.generate_schedule(2000, 10, rate_per_day=1, mix={"Freeze": 3, "Preempt": 1}, seed=1)
+    counts = schedule.count_by_scenario()
+    assert set(counts) == {"Live Migration", "Spot Eviction"}
+    assert counts["Live Migration"] > counts["Spot Eviction"] * 2
+    with pytest.raises(ValueError):
+        fleet.generate_schedule(10, 1, mix={"NotAnEventType": 1})
+
+def test_waves_cluster_arrivals():
+    schedule = fleet.generate_schedule(5000, 30, rate_per_day=0.2, arrival="waves", wave_count=3, wave_width_hours=1, seed=7)
+    hours = (schedule.times // 3600).astype(int)
+    # Three one-hour-wide waves should cover a small fraction of the 720 hours
+    assert len(set(hours.tolist())) < 60
+
+def test_for_vm_returns_only_that_vm():
+    schedule = fleet.generate_schedule(50, 30, rate_per_day=1, seed=3)
+    rows = schedule.for_vm(5)
+    assert rows
+    assert all(vm_name == 'vm5' for _, vm_name, _ in rows)
+    assert [offset for offset, _, _ in rows] == sorted(offset for offset, _, _ in rows)
+
+def test_large_fleet_builds_in_seconds():
+    start = time.perf_counter()
+    schedule = fleet.generate_schedule(100000, 30, rate_per_day=0.1, seed=0)
+    assert time.perf_counter() - start < 5
+    assert len(schedule) > 100000
+
+def test_playback_streams_into_event_store(app, simulator):
+    schedule = fleet.generate_schedule(20, 1, rate_per_day=2, seed=5)
+    start_incarnation = simulator.last_doc_incarnation
+    fleet.play_schedule(simulator, schedule, speed=60)
+    first_arrival = schedule.times[0] / 60
+    simulator.deadline_queue.run_until(first_arrival)
+    assert len(simulator.event_store) >= 1
+    with app.test_client() as client:
+        data = client.get('/metadata/scheduledevents').get_json()
+    vm_names = {resource for event in data['Events'] for resource in event['Resources']}
+    assert schedule.row(0)[1] in vm_names
+    simulator.deadline_queue.run_until_idle()
+    assert len(simulator.event_store) == 0
+    assert len(simulator.deadline_queue) == 0
+    # Each event is published once per state
+    states = sum(len(simulator.scenarios[name]['EventStatus']) for _, _, name in schedule.rows())
+    assert simulator.last_doc_incarnation - start_incarnation == states
+
+def test_startrequest_approves_stored_event(app, simulator):
+    with app.test_client() as client:
+        client.post('/stop-auto-run')
+        event = simulator.start_playback_event('Live Migration', ['vm7'])
+        resp = client.post(
+            '/metadata/scheduledevents',
+            json={"StartRequests": [{"EventId": event['EventId']}]}
+        )
+        assert resp.status_code == 200
+        events = resp.get_json()['Events']
+        assert events[0]['EventId'] == event['EventId']
+        assert events[0]['EventStatus'] == 'Started'
+        assert events[0]['NotBefore'] == ''
+
+def test_fleet_schedule_route(app, simulator):
+    with app.test_client() as client:
+        resp = client.post('/fleet-schedule', json={
+            "fleet_size": 100, "span_days": 2, "rate_per_day": 1, "seed": 9, "speed": 100
+        })
+        assert resp.status_code == 202
+        summary = resp.get_json()
+        assert summary['FleetSize'] == 100
+        assert summary['Events'] == sum(summary['EventsByScenario'].values())
+        resp = client.post('/fleet-schedule', json={"fleet_size": 10, "arrival": "bursty"})
+        assert resp.status_code == 400
+        for speed in ("abc", 0, -5, "nan", "inf"):
+            resp = client.post('/fleet-schedule', json={"fleet_size": 10, "speed": speed})
+            assert resp.status_code == 400
+            assert 'error' in resp.get_json()
+        for params in ({"span_days": "nan"}, {"span_days": "inf"}, {"span_days": 0},
+                       {"rate_per_day": "nan"}, {"rate_per_day": "-inf"}, {"mix": {"Freeze": "nan"}}):
+            resp = client.post('/fleet-schedule', json=dict(params, fleet_size=10))
+            assert resp.status_code == 400, params
+        # Zero VMs and a zero rate are allowed: an empty schedule
+        resp = client.post('/fleet-schedule', json={"fleet_size": 0, "rate_per_day": 0})
+        assert resp.status_code == 202
+        assert resp.get_json()['Events'] == 0
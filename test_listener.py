@@ -0,0 +1,327 @@
+import json
+import sys
+import threading
+import time
+import types
+
+import pytest
+
+import Listener
+
+
+class FakeAppendBlob:
+    """
+    Stands in for an azure-storage-blob BlobClient: appended blocks are kept
+    in blobs, and append_block fails once on the calls listed in fail_on.
+    """
+    def __init__(self, blobs, name, calls, fail_on):
+        self.blobs = blobs
+        self.name = name
+        self.calls = calls
+        self.fail_on = fail_on
+
+    def create_append_blob(self, match_condition=None):
+        self.blobs.setdefault(self.name, bytearray())
+
+    def append_block(self, data):
+        self.calls.append(len(data))
+        if len(self.calls) in self.fail_on:
+            raise IOError("storage unavailable")
+        assert len(data) <= Listener.PreemptBatchWriter.BLOCK_SIZE
+        self.blobs[self.name] += data
+
+
+class FakeBlobService:
+    def __init__(self):
+        self.blobs = {}
+        self.calls = []
+        self.fail_on = set()
+
+    def get_blob_client(self, container, blob):
+        return FakeAppendBlob(self.blobs, blob, self.calls, self.fail_on)
+
+
+@pytest.fixture
+def vm(monkeypatch):
+    monkeypatch.setattr(Listener, '_vm_identity', ('vm1', 'sub', 'rg'))
+    with Listener._timings_lock:
+        Listener.handler_timings.clear()
+    return 'vm1'
+
+
+@pytest.fixture
+def blob_service(monkeypatch, vm):
+    # _append_blob imports from azure.core, which the tests don't need installed
+    azure = types.ModuleType('azure')
+    core = types.ModuleType('azure.core')
+    exceptions = types.ModuleType('azure.core.exceptions')
+    core.MatchConditions = types.SimpleNamespace(IfMissing='IfMissing')
+    exceptions.ResourceExistsError = type('ResourceExistsError', (Exception,), {})
+    for name, module in [('azure', azure), ('azure.core', core), ('azure.core.exceptions', exceptions)]:
+        monkeypatch.setitem(sys.modules, name, module)
+    service = FakeBlobService()
+    monkeypatch.setattr(Listener, 'blob_service_client', lambda: service)
+    return service
+
+
+def _record(event_id, detected_at='2025-07-01T10:15:00+00:00', size=0):
+    return {'EventId': event_id, 'EventType': 'Preempt', 'DetectedAt': detected_at, 'Padding': 'x' * size}
+
+
+def _lines(data):
+    return [json.loads(line)['EventId'] for line in data.splitlines()]
+
+
+def test_batch_writer_recovers_journal_after_crash(tmp_path, vm):
+    journal = tmp_path / 'journal.ndjson'
+    journal.write_bytes(
+        json.dumps(_record('a')).encode() + b'\n' + json.dumps(_record('b')).encode() + b'\n' + b'{"EventId": "c", "Ev'
+    )
+    writer = Listener.PreemptBatchWriter(str(journal), 1 << 20, 60, directory=str(tmp_path / 'out'))
+    # The torn last line was never acknowledged and is dropped
+    assert writer.recover() == 2
+    writer.close()
+    assert _lines((tmp_path / 'out' / 'vm1-2025070110.ndjson').read_bytes()) == ['a', 'b']
+    assert journal.read_bytes() == b''
+
+
+def test_batch_writer_flushes_on_size_and_age(tmp_path, vm):
+    out = tmp_path / 'out'
+    writer = Listener.PreemptBatchWriter(str(tmp_path / 'journal.ndjson'), 300, 60, directory=str(out))
+    writer.append(_record('a'))
+    assert not out.exists()
+    writer.append(_record('b', size=300))
+    assert _lines((out / 'vm1-2025070110.ndjson').read_bytes()) == ['a', 'b']
+    writer.close()
+
+    aged = Listener.PreemptBatchWriter(str(tmp_path / 'aged.ndjson'), 1 << 20, 0.05, directory=str(tmp_path / 'aged'))
+    aged.append(_record('c'))
+    deadline = time.monotonic() + 5
+    while not (tmp_path / 'aged').exists() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert _lines((tmp_path / 'aged' / 'vm1-2025070110.ndjson').read_bytes()) == ['c']
+    aged.close()
+    assert Listener.handler_timings['batch_write']['calls'] == 2
+
+
+def test_batch_writer_buckets_records_by_their_own_hour(tmp_path, vm):
+    writer = Listener.PreemptBatchWriter(str(tmp_path / 'journal.ndjson'), 1 << 20, 60, directory=str(tmp_path))
+    writer.append(_record('before', '2025-07-01T10:59:59.900000+00:00'))
+    writer.append(_record('after', '2025-07-01T11:00:00.100000+00:00'))
+    writer.close()
+    assert _lines((tmp_path / 'vm1-2025070110.ndjson').read_bytes()) == ['before']
+    assert _lines((tmp_path / 'vm1-2025070111.ndjson').read_bytes()) == ['after']
+
+
+def test_batch_writer_retries_failed_blocks_without_duplicates(tmp_path, blob_service):
+    block = Listener.PreemptBatchWriter.BLOCK_SIZE
+    blob_service.fail_on = {2}
+    journal = tmp_path / 'journal.ndjson'
+    writer = Listener.PreemptBatchWriter(str(journal), 1 << 30, 60)
+    writer.append(_record('big', size=block + 100))
+    writer.append(_record('small'))
+    # The second 4 MiB block fails; the batch stays journaled
+    with pytest.raises(IOError):
+        writer.flush()
+    journal_size = journal.stat().st_size
+    assert journal_size > block
+    assert Listener.handler_timings['batch_write']['errors'] == 1
+    # The retry appends only the block that didn't make it
+    writer.flush()
+    assert blob_service.calls[0] == block
+    assert blob_service.calls[1:] == [journal_size - block] * 2
+    assert _lines(blob_service.blobs['RestartVM/vm1/2025070110.ndjson']) == ['big', 'small']
+    assert journal.read_bytes() == b''
+    writer.close()
+
+
+def test_batch_writer_close_keeps_unwritten_batch_in_journal(tmp_path, blob_service):
+    blob_service.fail_on = {1}
+    journal = tmp_path / 'journal.ndjson'
+    writer = Listener.PreemptBatchWriter(str(journal), 1 << 20, 60)
+    writer.append(_record('a'))
+    # A storage failure at shutdown is logged, not raised
+    writer.close()
+    assert _lines(journal.read_bytes()) == ['a']
+    assert blob_service.blobs['RestartVM/vm1/2025070110.ndjson'] == b''
+
+
+@pytest.fixture
+def handlers(monkeypatch):
+    # An empty registry and processed cache, so only the test's handlers run
+    monkeypatch.setattr(Listener, 'HANDLERS', [])
+    with Listener._processed_lock:
+        Listener.processed_events.clear()
+        Listener._in_flight.clear()
+    with Listener._timings_lock:
+        Listener.handler_timings.clear()
+    yield Listener.HANDLERS
+    with Listener._processed_lock:
+        Listener.processed_events.clear()
+        Listener._in_flight.clear()
+
+
+def _event(event_id, event_type='Reboot', source='Platform', status='Scheduled'):
+    return {'EventId': event_id, 'EventType': event_type, 'EventSource': source, 'EventStatus': status}
+
+
+def test_first_registered_handler_wins(handlers):
+    handled = []
+
+    @Listener.handler(event_type='Freeze', when=lambda event: event['EventId'] == 'short')
+    def short_freeze(event):
+        handled.append(('short_freeze', event['EventId']))
+
+    @Listener.handler(event_source='User')
+    def user_event(event):
+        handled.append(('user_event', event['EventId']))
+
+    @Listener.handler()
+    def anything(event):
+        handled.append(('anything', event['EventId']))
+
+    Listener.dispatch_events([
+        _event('short', 'Freeze', 'User'), _event('long', 'Freeze'), _event('user', source='User')
+    ])
+    assert sorted(handled) == [('anything', 'long'), ('short_freeze', 'short'), ('user_event', 'user')]
+    # Each event state is handled once across polls
+    Listener.dispatch_events([_event('short', 'Freeze', 'User'), _event('short', 'Freeze', 'User', 'Started')])
+    assert len(handled) == 4 and handled[-1] == ('short_freeze', 'short')
+    assert {name: timing['calls'] for name, timing in Listener.handler_timings.items()} == {
+        'short_freeze': 2, 'user_event': 1, 'anything': 1
+    }
+
+
+def test_handlers_run_concurrently(handlers):
+    # Each handler waits for the other, so running them one by one would time out
+    barrier = threading.Barrier(2, timeout=5)
+
+    @Listener.handler(event_type='Reboot')
+    def reboot(event):
+        barrier.wait()
+
+    @Listener.handler(event_type='Preempt', pool='io')
+    def preempt(event):
+        barrier.wait()
+
+    Listener.dispatch_events([_event('a'), _event('b', 'Preempt')])
+    assert Listener.handler_timings['reboot']['errors'] == 0
+    assert Listener.handler_timings['preempt']['errors'] == 0
+    assert Listener.handler_timings['preempt']['max'] < 5
+
+
+def test_failed_handler_is_retried_on_next_poll(handlers):
+    attempts = []
+
+    @Listener.handler()
+    def flaky(event):
+        attempts.append(event['EventId'])
+        if len(attempts) == 1:
+            raise RuntimeError('confirm failed')
+
+    Listener.dispatch_events([_event('a')])
+    assert Listener.handler_timings['flaky']['errors'] == 1
+    assert ('a', 'Scheduled') not in Listener.processed_events
+    Listener.dispatch_events([_event('a')])
+    assert attempts == ['a', 'a']
+    assert ('a', 'Scheduled') in Listener.processed_events
+    assert Listener.handler_timings['flaky']['calls'] == 2
+
+
+def test_timed_out_handler_does_not_hold_up_the_document(handlers):
+    release = threading.Event()
+    done = threading.Event()
+
+    @Listener.handler(event_type='Preempt', pool='io', timeout=0.05)
+    def slow(event):
+        release.wait(5)
+        done.set()
+
+    @Listener.handler()
+    def fast(event):
+        pass
+
+    start = time.monotonic()
+    Listener.dispatch_events([_event('slow', 'Preempt'), _event('fast')])
+    assert time.monotonic() - start < 1
+    assert Listener.handler_timings['slow']['timeouts'] == 1
+    assert Listener.handler_timings['fast']['calls'] == 1
+    # Still running, so the next poll doesn't start it again
+    Listener.dispatch_events([_event('slow', 'Preempt')])
+    assert Listener.handler_timings['slow']['timeouts'] == 1
+    release.set()
+    assert done.wait(5)
+    deadline = time.monotonic() + 5
+    while ('slow', 'Scheduled') not in Listener.processed_events and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert ('slow', 'Scheduled') in Listener.processed_events
+    assert Listener.handler_timings['slow']['calls'] == 1
+
+
+@pytest.fixture
+def processed_cache(monkeypatch, tmp_path):
+    monkeypatch.setattr(Listener, 'PROCESSED_CACHE_SIZE', 3)
+    with Listener._processed_lock:
+        Listener.processed_events.clear()
+        Listener._in_flight.clear()
+    yield str(tmp_path / 'processed_events.json')
+    with Listener._processed_lock:
+        Listener.processed_events.clear()
+
+
+def test_processed_cache_is_a_bounded_lru(processed_cache):
+    for event_id in 'abc':
+        assert Listener._claim_event(_event(event_id))
+        Listener._finish_event(_event(event_id), True)
+    # Seeing 'a' again makes it the most recently used, so 'b' is evicted next
+    assert not Listener._claim_event(_event('a'))
+    assert Listener._claim_event(_event('d'))
+    Listener._finish_event(_event('d'), True)
+    assert list(Listener.processed_events) == [('c', 'Scheduled'), ('a', 'Scheduled'), ('d', 'Scheduled')]
+
+
+def test_processed_cache_round_trips_through_file(processed_cache):
+    for event_id in 'abcd':
+        Listener._claim_event(_event(event_id))
+        Listener._finish_event(_event(event_id), True)
+    Listener.save_processed_events(processed_cache)
+    with Listener._processed_lock:
+        Listener.processed_events.clear()
+    Listener.load_processed_events(processed_cache)
+    assert list(Listener.processed_events) == [('b', 'Scheduled'), ('c', 'Scheduled'), ('d', 'Scheduled')]
+    assert not Listener._claim_event(_event('d'))
+
+
+@pytest.mark.parametrize('content', [
+    '{"a": 1}', '{"a": 1, "b": 2}', '[["a", "Scheduled", "extra"]]', '[1, 2]', '[["a", ["x"]]]', '["ab"]',
+    '[["a", "Scheduled"], "ab"]', '[[1, 2]]', 'null', '[["a"'
+])
+def test_corrupt_processed_cache_loads_as_empty(processed_cache, content):
+    # An earlier cache must not survive a corrupt load either
+    Listener.processed_events[('stale', 'Scheduled')] = None
+    with open(processed_cache, 'w') as f:
+        f.write(content)
+    Listener.load_processed_events(processed_cache)
+    assert len(Listener.processed_events) == 0
+
+
+def test_rejected_approval_is_retried(handlers, monkeypatch):
+    class RejectingTransport:
+        def __init__(self):
+            self.status_codes = [500, 200]
+            self.confirmed = []
+
+        def confirm_scheduled_event(self, event_id):
+            self.confirmed.append(event_id)
+            return self.status_codes.pop(0)
+
+    transport = RejectingTransport()
+    monkeypatch.setattr(Listener, 'transport', transport)
+    Listener.handler(event_source='User')(Listener.handle_user_event)
+    Listener.dispatch_events([_event('a', source='User')])
+    # IMDS rejected the approval, so the event state is not marked processed
+    assert Listener.handler_timings['handle_user_event']['errors'] == 1
+    assert ('a', 'Scheduled') not in Listener.processed_events
+    Listener.dispatch_events([_event('a', source='User')])
+    assert transport.confirmed == ['a', 'a']
+    assert ('a', 'Scheduled') in Listener.processed_events
@@ -0,0 +1,45 @@
+import os
+import subprocess
+import sys
+
+import Listener
+import listener_replay
+
+
+def test_replay_records_every_decision_offline():
+    report = listener_replay.replay(listener_replay.generate_documents(500, seed=1))
+    assert report['DocumentsServed'] == report['DocumentsAvailable'] == 500
+    by_type = report['ByEventType']
+    # Preempt events are logged and uploaded, user reboots confirmed
+    preempt = by_type['Preempt']['Decisions']
+    assert preempt['upload'] > 0 and preempt['log'] >= preempt['upload']
+    assert by_type['Reboot']['Decisions']['confirm'] > 0
+    assert report['Decisions'] == sum(sum(entry['Decisions'].values()) for entry in by_type.values())
+    # Latency is the wait for the next one-second poll plus processing
+    assert all(0 <= entry['LatencyMs']['P50'] <= entry['LatencyMs']['Max'] < 1100 for entry in by_type.values())
+    assert report['DecisionsPerSecond'] > 0
+    # The Listener is left talking HTTP again
+    assert isinstance(Listener.transport, Listener.HttpTransport)
+    assert isinstance(Listener.clock, Listener.SystemClock)
+
+
+def test_recorded_stream_replays_like_the_generated_one(tmp_path):
+    path = str(tmp_path / 'stream.jsonl')
+    listener_replay.save_documents(path, listener_replay.generate_documents(200, seed=2))
+    recorded = listener_replay.replay(listener_replay.load_documents(path))
+    generated = listener_replay.replay(listener_replay.generate_documents(200, seed=2))
+    assert recorded['DocumentsServed'] == 200
+    assert {t: e['Decisions'] for t, e in recorded['ByEventType'].items()} == {
+        t: e['Decisions'] for t, e in generated['ByEventType'].items()
+    }
+
+
+def test_replay_does_not_load_the_server():
+    code = (
+        "import sys, listener_replay; "
+        "listener_replay.replay(listener_replay.generate_documents(50)); "
+        "print(sorted({'flask', 'numpy', 'main', 'fleet'} & set(sys.modules)))"
+    )
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert result.stdout.strip() == "[]"
@@ -1,13 +1,28 @@
 import pytest
+import json
+import threading
+import main
 from main import app, scenarios
-from collections import OrderedDict
+from collections import OrderedDict, deque
 import uuid
 
 @pytest.fixture
-def client():
+def simulator():
+    return app.extensions['simulator']
+
+@pytest.fixture
+def client(simulator):
     app.config['TESTING'] = True
     with app.test_client() as client:
         yield client
+    # Don't let auto-run threads started by a test leak into the next one
+    simulator.stop_auto_run.set()
+
+@pytest.fixture
+def manual_clock(simulator, monkeypatch):
+    manual = main.ManualClock()
+    monkeypatch.setattr(simulator, 'clock', manual)
+    return manual
 
 def test_imds_scheduledevents_valid_event_for_each_scenario(client):
     for scenario_name in scenarios.keys():
@@ -370,3 +385,660 @@ def test_api_version_query_param(client):
     data = resp.get_json()
     assert 'DocumentIncarnation' in data
     assert 'Events' in data
+
+def test_index_matches_imds_document(client):
+    """Test that the dashboard shows the same NotBefore the IMDS endpoint returns."""
+    scenario_name = list(scenarios.keys())[0]
+    client.post('/set-scenario', data={'scenario': scenario_name})
+    client.post('/generate-event', data={'event_status': 'Scheduled'})
+    data = client.get('/metadata/scheduledevents').get_json()
+    page = client.get('/').get_data(as_text=True)
+    assert data['Events'][0]['NotBefore'] in page
+    assert data['Events'][0]['EventId'] in page
+
+def test_render_document_is_memoized(client, simulator):
+    """Test that an event state is rendered once per incarnation and api-version."""
+    import main
+    scenario_name = list(scenarios.keys())[0]
+    client.post('/set-scenario', data={'scenario': scenario_name})
+    client.post('/generate-event', data={'event_status': 'Scheduled'})
+    first = simulator.render_document(simulator.last_event, simulator.last_doc_incarnation, '2020-07-01')
+    second = simulator.render_document(simulator.last_event, simulator.last_doc_incarnation, '2020-07-01')
+    assert first is second
+    other_version = simulator.render_document(simulator.last_event, simulator.last_doc_incarnation, None)
+    assert other_version is not first
+    assert other_version.body == first.body
+
+def test_notbefore_uses_injected_clock(client, manual_clock):
+    """Test that NotBefore is computed from the injected clock."""
+    client.post('/set-scenario', data={'scenario': 'Live Migration'})
+    client.post('/generate-event', data={'event_status': 'Scheduled'})
+    data = client.get('/metadata/scheduledevents').get_json()
+    assert data['Events'][0]['NotBefore'] == '2025-07-01T00:15:00Z'
+    manual_clock.advance(60)
+    client.post('/generate-event', data={'event_status': 'Scheduled'})
+    data = client.get('/metadata/scheduledevents').get_json()
+    assert data['Events'][0]['NotBefore'] == '2025-07-01T00:16:00Z'
+
+def test_autorun_every_scenario_with_manual_clock(client, simulator, manual_clock):
+    """Test that auto-run plays every scenario to its final state without real sleeps."""
+    for scenario_name, scenario in list(scenarios.items()):
+        if not scenario['EventStatus']:
+            continue
+        client.post('/set-scenario', data={'scenario': scenario_name})
+        start = manual_clock.monotonic()
+        simulator.auto_run_scenario(threading.Event())
+        assert manual_clock.monotonic() - start == sum(scenario['EventStatus'].values())
+        assert simulator.last_event['EventStatus'] == list(scenario['EventStatus'])[-1]
+
+def test_autorun_advances_early_on_startrequest(client, simulator, monkeypatch):
+    """Test that approving a Scheduled event mid-playback cuts the Scheduled wait short."""
+    class ApprovingClock(main.ManualClock):
+        def sleep(self, seconds):
+            super().sleep(seconds)
+            if self.monotonic() == 3 and simulator.last_event['EventStatus'] == 'Scheduled':
+                client.post(
+                    '/metadata/scheduledevents',
+                    json={"StartRequests": [{"EventId": simulator.last_event['EventId']}]}
+                )
+    approving_clock = ApprovingClock()
+    monkeypatch.setattr(simulator, 'clock', approving_clock)
+    scenario_name = 'Live Migration - Dev Timing'
+    client.post('/set-scenario', data={'scenario': scenario_name})
+    simulator.auto_run_scenario(threading.Event())
+    assert simulator.last_event['EventStatus'] == 'Completed'
+    assert approving_clock.monotonic() == 3 + scenarios[scenario_name]['EventStatus']['Started']
+
+def test_stop_auto_run_stops_running_playback(client, simulator, manual_clock):
+    """Test that Stop Playback stops the run it was started for."""
+    client.post('/set-scenario', data={'scenario': 'Live Migration'})
+    stop_event = threading.Event()
+    stop_event.set()
+    simulator.auto_run_scenario(stop_event)
+    assert simulator.last_event is None
+    assert manual_clock.monotonic() == 0
+
+def test_update_domain_resources_are_shared():
+    """Test that scale set resource sets are built once and shared."""
+    domains = main.update_domain_resources('vmss', 5, 1000)
+    assert len(domains) == 5
+    assert all(len(resources) == 1000 for resources in domains)
+    assert domains[1][:2] == ('vmss_1', 'vmss_6')
+    assert main.update_domain_resources('vmss', 5, 1000) is domains
+
+def test_rolling_maintenance_walks_update_domains(client, simulator, manual_clock):
+    """Test that a rolling wave gives each update domain its own event, with limited concurrency."""
+    scenario_name = 'VMSS Rolling Maintenance - Dev Timing'
+    client.post('/stop-auto-run')
+    domains = simulator.start_rolling_maintenance(scenario_name, MaxConcurrentDomains=2)
+    seen = {}
+    max_in_flight = 0
+    while len(simulator.deadline_queue):
+        max_in_flight = max(max_in_flight, len(simulator.event_store))
+        for event in simulator.event_store.values():
+            seen.setdefault(event['Resources'], set()).add(event['EventStatus'])
+        simulator.deadline_queue.run_until(manual_clock.monotonic() + 1)
+    assert max_in_flight == 2
+    assert len(simulator.event_store) == 0
+    assert set(seen) == set(domains)
+    assert all(statuses == {'Scheduled', 'Started'} for statuses in seen.values())
+    # Five domains, two at a time, 25 seconds per domain
+    assert manual_clock.monotonic() == 75
+
+def test_rolling_maintenance_route(client, manual_clock):
+    """Test that auto-run of a scale set scenario publishes one event per domain in flight."""
+    client.post('/set-scenario', data={'scenario': 'VMSS Rolling Maintenance - Dev Timing'})
+    page = client.get('/').get_data(as_text=True)
+    assert 'max_concurrent_domains' in page
+    client.post('/auto-run-scenario', data={'update_domains': '3', 'instances_per_domain': '2', 'max_concurrent_domains': '3'})
+    data = client.get('/metadata/scheduledevents').get_json()
+    assert len(data['Events']) == 3
+    assert sorted(r for event in data['Events'] for r in event['Resources']) == sorted(
+        f'vmss_{i}' for i in range(6)
+    )
+    client.post('/stop-auto-run')
+
+def test_resource_filter_returns_only_matching_events(client, simulator, manual_clock):
+    """Test that ?resource= returns only the events naming that resource."""
+    client.post('/stop-auto-run')
+    client.post('/set-scenario', data={'scenario': 'Live Migration'})
+    client.post('/generate-event', data={'event_status': 'Scheduled', 'resources': 'vm_a,vm_b'})
+    simulator.start_rolling_maintenance('VMSS Rolling Maintenance', UpdateDomains=3, InstancesPerDomain=2, MaxConcurrentDomains=3)
+    full = client.get('/metadata/scheduledevents').get_json()
+    assert len(full['Events']) == 4
+
+    data = client.get('/metadata/scheduledevents?resource=vmss_4').get_json()
+    assert data['DocumentIncarnation'] == full['DocumentIncarnation']
+    assert len(data['Events']) == 1
+    assert 'vmss_4' in data['Events'][0]['Resources']
+
+    data = client.get('/metadata/scheduledevents?resource=vm_b').get_json()
+    assert [event['Resources'] for event in data['Events']] == [['vm_a', 'vm_b']]
+
+    data = client.get('/metadata/scheduledevents?resource=unknown_vm').get_json()
+    assert data['Events'] == []
+    client.post('/stop-auto-run')
+
+def test_resource_index_follows_transitions(client, simulator, manual_clock):
+    """Test that the inverted index drops events once they complete."""
+    client.post('/stop-auto-run')
+    event = simulator.start_playback_event('Live Migration - Dev Timing', ['vm_x'])
+    assert list(simulator._events_by_resource['vm_x']) == [event['EventId']]
+    simulator.deadline_queue.run_until(15)
+    data = client.get('/metadata/scheduledevents?resource=vm_x').get_json()
+    assert data['Events'][0]['EventStatus'] == 'Started'
+    simulator.deadline_queue.run_until_idle()
+    assert 'vm_x' not in simulator._events_by_resource
+    assert client.get('/metadata/scheduledevents?resource=vm_x').get_json()['Events'] == []
+
+def test_resource_filter_from_caller_address(client, monkeypatch):
+    """Test that RESOURCE_BY_CALLER filters polls by the caller's address."""
+    monkeypatch.setitem(app.config, 'RESOURCE_BY_CALLER', {'10.0.0.5': 'vm_c'})
+    client.post('/stop-auto-run')
+    client.post('/set-scenario', data={'scenario': 'Live Migration'})
+    client.post('/generate-event', data={'event_status': 'Scheduled', 'resources': 'vm_d'})
+    data = client.get('/metadata/scheduledevents', environ_base={'REMOTE_ADDR': '10.0.0.5'}).get_json()
+    assert data['Events'] == []
+    data = client.get('/metadata/scheduledevents', environ_base={'REMOTE_ADDR': '10.0.0.6'}).get_json()
+    assert len(data['Events']) == 1
+
+def test_history_records_transitions_with_source(client, simulator, manual_clock):
+    """Test that generated, approved and auto-run transitions all land in the history."""
+    client.post('/set-scenario', data={'scenario': 'Live Migration - Dev Timing'})
+    client.post('/generate-event', data={'event_status': 'Scheduled', 'resources': 'vm_h'})
+    event_id = simulator.last_event['EventId']
+    client.post('/metadata/scheduledevents', json={"StartRequests": [{"EventId": event_id}]})
+    records = client.get('/history?resource=vm_h').get_json()['Records']
+    assert [(r['EventStatus'], r['Source']) for r in records[-2:]] == [
+        ('Scheduled', 'generate-event'), ('Started', 'start-request')
+    ]
+    assert records[-1]['Caller'] == '127.0.0.1'
+    assert records[-1]['DocumentIncarnation'] == simulator.last_doc_incarnation
+
+    simulator.auto_run_scenario(threading.Event())
+    data = client.get('/history?source=auto-run&scenario=Live Migration - Dev Timing').get_json()
+    assert [r['EventStatus'] for r in data['Records'][-3:]] == ['Scheduled', 'Started', 'Completed']
+
+def test_history_cursor_pagination(client, simulator, monkeypatch):
+    """Test that cursors walk the history without gaps or repeats."""
+    client.post('/set-scenario', data={'scenario': 'Live Migration'})
+    monkeypatch.setattr(simulator, 'history', deque(maxlen=50))
+    for _ in range(12):
+        client.post('/generate-event', data={'event_status': 'Scheduled'})
+    sequences = []
+    cursor = 0
+    while True:
+        data = client.get(f'/history?cursor={cursor}&limit=5').get_json()
+        sequences.extend(r['Sequence'] for r in data['Records'])
+        assert not data['Truncated']
+        if data['NextCursor'] is None:
+            break
+        cursor = data['NextCursor']
+    assert len(sequences) == 12
+    assert sequences == list(range(sequences[0], sequences[0] + 12))
+    assert client.get('/history?limit=abc').status_code == 400
+
+def test_history_page_filters_and_pages_without_the_route():
+    """Test that Simulator.history_page pages and filters on its own."""
+    sim = main.create_app({'TESTING': True, 'CLOCK': main.ManualClock()}).extensions['simulator']
+    for vm in ['vm_1', 'vm_2', 'vm_1']:
+        sim.start_playback_event('Live Migration - Dev Timing', [vm])
+    page = sim.history_page(limit=2, resource='vm_1')
+    assert [r['Resources'] for r in page['Records']] == [['vm_1'], ['vm_1']]
+    assert page['NextCursor'] == page['Records'][-1]['Sequence'] and not page['Truncated']
+    assert sim.history_page(page['NextCursor'], resource='vm_1')['Records'] == []
+    page = sim.history_page(filters=[('EventStatus', 'Scheduled'), ('Source', 'playback')])
+    assert len(page['Records']) == 3 and page['NextCursor'] is None
+    sim.close()
+
+def test_history_is_bounded_and_overflows_to_file(client, simulator, monkeypatch, tmp_path):
+    """Test that the ring buffer keeps a constant size and spills evicted records to a file."""
+    overflow_path = tmp_path / 'history.jsonl'
+    client.post('/set-scenario', data={'scenario': 'Live Migration'})
+    monkeypatch.setattr(simulator, 'history', deque(maxlen=3))
+    monkeypatch.setattr(simulator, '_history_overflow_file', None)
+    monkeypatch.setitem(app.config, 'HISTORY_OVERFLOW_PATH', str(overflow_path))
+    for _ in range(5):
+        client.post('/generate-event', data={'event_status': 'Scheduled'})
+    assert len(simulator.history) == 3
+    simulator._history_overflow_file.close()
+    spilled = [json.loads(line) for line in overflow_path.read_text().splitlines()]
+    assert len(spilled) == 2
+    assert spilled[-1]['Sequence'] + 1 == simulator.history[0]['Sequence']
+    data = client.get(f"/history?cursor={spilled[0]['Sequence']}").get_json()
+    assert data['Truncated']
+    assert len(data['Records']) == 3
+    assert not client.get('/history').get_json()['Truncated']
+
+def test_reaction_latency_per_client(client, simulator, manual_clock):
+    """Test that detection and approval latency are measured per EventId and client."""
+    client.post('/set-scenario', data={'scenario': 'Live Migration'})
+    client.post('/generate-event', data={'event_status': 'Scheduled'})
+    event_id = simulator.last_event['EventId']
+    manual_clock.advance(2)
+    client.get('/metadata/scheduledevents', headers={'X-Client-Id': 'listener-a'})
+    manual_clock.advance(1)
+    client.get('/metadata/scheduledevents', headers={'X-Client-Id': 'listener-b'})
+    manual_clock.advance(3)
+    client.get('/metadata/scheduledevents', headers={'X-Client-Id': 'listener-a'})
+    client.post(
+        '/metadata/scheduledevents',
+        json={"StartRequests": [{"EventId": event_id}]},
+        headers={'X-Client-Id': 'listener-a'}
+    )
+    report = client.get('/metrics/reaction').get_json()
+    rows = {row['Client']: row for row in report['Events'] if row['EventId'] == event_id}
+    assert rows['listener-a']['DetectionMs'] == 2000
+    assert rows['listener-a']['ApprovalMs'] == 4000
+    assert rows['listener-a']['EndToEndMs'] == 6000
+    assert rows['listener-b']['DetectionMs'] == 3000
+    assert rows['listener-b']['ApprovalMs'] is None
+    assert report['Histograms']['Detection']['Total'] >= 2
+    assert report['Summary']['ApprovalMs']['Count'] >= 1
+
+def test_reaction_only_counts_approvals_that_start_the_event(client, simulator, manual_clock):
+    """Test that approving an event that is not Scheduled (or already started) is not an approval."""
+    client.post('/set-scenario', data={'scenario': 'Live Migration'})
+    client.post('/generate-event', data={'event_status': 'Scheduled'})
+    event_id = simulator.last_event['EventId']
+    end_to_end = simulator.reaction_tracker.report()['Histograms']['EndToEnd']['Total']
+    client.get('/metadata/scheduledevents', headers={'X-Client-Id': 'listener-a'})
+    client.get('/metadata/scheduledevents', headers={'X-Client-Id': 'listener-b'})
+    manual_clock.advance(1)
+    for listener in ('listener-a', 'listener-b'):
+        client.post(
+            '/metadata/scheduledevents',
+            json={"StartRequests": [{"EventId": event_id}, {"EventId": "not-an-event"}]},
+            headers={'X-Client-Id': listener}
+        )
+    report = client.get('/metrics/reaction').get_json()
+    rows = {row['Client']: row for row in report['Events'] if row['EventId'] == event_id}
+    assert rows['listener-a']['ApprovalMs'] == 1000
+    assert rows['listener-b']['ApprovalMs'] is None
+    assert report['Histograms']['EndToEnd']['Total'] == end_to_end + 1
+
+def test_reaction_detection_after_document_changes(client, simulator, manual_clock):
+    """Test that re-serving a document is skipped but a changed document is still stamped."""
+    client.post('/set-scenario', data={'scenario': 'Live Migration'})
+    client.post('/generate-event', data={'event_status': 'Scheduled'})
+    first = simulator.last_event['EventId']
+    client.get('/metadata/scheduledevents')
+    client.get('/metadata/scheduledevents')
+    manual_clock.advance(1)
+    client.post('/generate-event', data={'event_status': 'Scheduled'})
+    second = simulator.last_event['EventId']
+    manual_clock.advance(1)
+    client.get('/metadata/scheduledevents')
+    report = client.get('/metrics/reaction').get_json()
+    detection = {row['EventId']: row['DetectionMs'] for row in report['Events'] if row['EventId'] in (first, second)}
+    assert detection == {first: 0, second: 1000}
+
+def test_reaction_histogram_counts_are_per_bucket():
+    """Test that each histogram count only holds the samples in its own bucket."""
+    clock = main.ManualClock()
+    tracker = main.ReactionTracker(clock)
+    for event_id, delay in (("a", 0.005), ("b", 0.2), ("c", 0.2), ("d", 1000)):
+        tracker.published({"EventId": event_id, "Scenario": "Live Migration", "ActiveScenario": {"EventType": "Freeze"}})
+        clock.advance(delay)
+        tracker.served((event_id,), "listener")
+    counts = tracker.report()['Histograms']['Detection']['Counts']
+    assert counts[0] == 1
+    assert counts[main.ReactionTracker.BUCKETS_MS.index(250)] == 2
+    assert counts[-1] == 1
+    assert sum(counts) == 4
+
+def test_reaction_report_csv_export(client, simulator, manual_clock):
+    """Test that the reaction report exports as CSV."""
+    client.post('/set-scenario', data={'scenario': 'Live Migration'})
+    client.post('/generate-event', data={'event_status': 'Scheduled'})
+    client.get('/metadata/scheduledevents')
+    resp = client.get('/metrics/reaction?format=csv')
+    assert resp.mimetype == 'text/csv'
+    lines = resp.get_data(as_text=True).splitlines()
+    assert lines[0].startswith('EventId,EventType,Scenario,Client')
+    assert any(simulator.last_event['EventId'] in line for line in lines[1:])
+
+def test_encoded_document_matches_imds_shape(client, simulator):
+    """Test that the spliced byte encoding decodes to the full IMDS event."""
+    client.post('/set-scenario', data={'scenario': 'Live Migration'})
+    client.post('/generate-event', data={'event_status': 'Scheduled', 'resources': 'vm_e'})
+    resp = client.get('/metadata/scheduledevents')
+    assert resp.mimetype == 'application/json'
+    scenario = scenarios['Live Migration']
+    assert resp.get_json() == {
+        "DocumentIncarnation": simulator.last_doc_incarnation,
+        "Events": [{
+            "EventId": simulator.last_event['EventId'],
+            "EventStatus": "Scheduled",
+            "EventType": scenario['EventType'],
+            "ResourceType": "VirtualMachine",
+            "Resources": ["vm_e"],
+            "EventSource": scenario['EventSource'],
+            "NotBefore": simulator.last_event['NotBefore'],
+            "Description": scenario['Description'],
+            "DurationInSeconds": scenario['DurationInSeconds']
+        }]
+    }
+
+@pytest.mark.parametrize('backend', sorted(main.JSON_BACKENDS))
+def test_json_backends_render_the_same_document(client, simulator, backend):
+    """Test that every JSON backend produces the same document."""
+    client.post('/set-scenario', data={'scenario': 'Spot Eviction'})
+    client.post('/generate-event', data={'event_status': 'Scheduled', 'resources': 'vm_ü'})
+    expected = client.get('/metadata/scheduledevents').get_json()
+    try:
+        simulator.set_json_backend(backend)
+        assert client.get('/metadata/scheduledevents').get_json() == expected
+        resp = client.post('/metadata/scheduledevents', data='not json')
+        assert resp.status_code == 400
+    finally:
+        simulator.set_json_backend('orjson' if 'orjson' in main.JSON_BACKENDS else 'json')
+
+def test_static_fragments_are_shared_per_scenario(client, simulator, manual_clock):
+    """Test that a scenario's static fields are encoded once for all of its events."""
+    client.post('/stop-auto-run')
+    simulator.start_rolling_maintenance('VMSS Rolling Maintenance', UpdateDomains=4, InstancesPerDomain=1, MaxConcurrentDomains=4)
+    simulator._static_fragments.clear()
+    data = client.get('/metadata/scheduledevents').get_json()
+    assert len(data['Events']) == 4
+    assert len(simulator._static_fragments) == 1
+    client.post('/stop-auto-run')
+
+def test_serve_passes_concurrency_settings_to_waitress(monkeypatch, capsys):
+    """Test that serve() hands CLI and environment settings to waitress."""
+    waitress = pytest.importorskip('waitress')
+    calls = []
+    monkeypatch.setattr(waitress, 'serve', lambda wsgi_app, **kwargs: calls.append((wsgi_app, kwargs)))
+    monkeypatch.setenv('SE_MOCK_BACKLOG', '512')
+    main.serve(['--host', '0.0.0.0', '--port', '8080', '--threads', '64'])
+    wsgi_app, kwargs = calls[0]
+    assert wsgi_app is app
+    assert kwargs['host'] == '0.0.0.0'
+    assert kwargs['port'] == 8080
+    assert kwargs['threads'] == 64
+    assert kwargs['backlog'] == 512
+    assert kwargs['connection_limit'] == main.SERVE_DEFAULTS['connection_limit']
+    assert 'threads:          64' in capsys.readouterr().out
+
+def test_create_app_instances_are_isolated():
+    """Test that apps built by create_app() don't share scenarios, events or clocks."""
+    first = main.create_app({'TESTING': True, 'CLOCK': main.ManualClock()})
+    second = main.create_app({'TESTING': True, 'CLOCK': main.ManualClock(), 'HISTORY_SIZE': 5})
+    first.extensions['simulator'].scenarios['Only First'] = dict(scenarios['Live Migration'])
+    with first.test_client() as first_client, second.test_client() as second_client:
+        first_client.post('/set-scenario', data={'scenario': 'Only First'})
+        first_client.post('/generate-event', data={'event_status': 'Scheduled', 'resources': 'vm_first'})
+        assert len(first_client.get('/metadata/scheduledevents').get_json()['Events']) == 1
+        assert second_client.get('/metadata/scheduledevents').get_json() == {'DocumentIncarnation': 1, 'Events': []}
+        second_client.post('/set-scenario', data={'scenario': 'Only First'})
+        assert second.extensions['simulator'].active_scenario is None
+    first.extensions['simulator'].clock.advance(60)
+    assert second.extensions['simulator'].clock.monotonic() == 0
+    assert second.extensions['simulator'].history.maxlen == 5
+    assert 'Only First' not in scenarios
+
+def test_rendered_events_are_dropped_with_their_event(client, simulator, manual_clock):
+    """Test that stored event renderings only live as long as the event and its current state."""
+    client.post('/stop-auto-run')
+    event = simulator.start_playback_event('Live Migration - Dev Timing', ['vm_r'])
+    client.get('/metadata/scheduledevents')
+    client.get('/metadata/scheduledevents?api-version=2020-07-01')
+    assert list(simulator._rendered_events[event['EventId']]) == [('Scheduled', None), ('Scheduled', '2020-07-01')]
+    simulator.deadline_queue.run_until(manual_clock.monotonic() + 15)
+    client.get('/metadata/scheduledevents')
+    assert list(simulator._rendered_events[event['EventId']]) == [('Started', None)]
+    simulator.deadline_queue.run_until_idle()
+    assert event['EventId'] not in simulator._rendered_events
+
+def _apply_delta(events, delta):
+    if delta['Full']:
+        events.clear()
+    for event_id in delta['Removed']:
+        events.pop(event_id, None)
+    for event in delta['Events']:
+        events[event['EventId']] = event
+    return delta['DocumentIncarnation']
+
+def test_delta_feed_tracks_the_document():
+    """Test that applying deltas keeps a client's copy equal to the full document."""
+    delta_app = main.create_app({'TESTING': True, 'CLOCK': main.ManualClock()})
+    sim = delta_app.extensions['simulator']
+    with delta_app.test_client() as client:
+        events = {}
+        incarnation = _apply_delta(events, client.get('/metadata/scheduledevents/delta').get_json())
+        assert incarnation == 1 and events == {}
+
+        client.post('/set-scenario', data={'scenario': 'Live Migration - Dev Timing'})
+        client.post('/generate-event', data={'event_status': 'Scheduled', 'resources': 'vm_a'})
+        playback = sim.start_playback_event('Live Migration - Dev Timing', ['vm_b'])
+        sim.start_playback_event('Live Migration - Dev Timing', ['vm_c'])
+        sim.clock.advance(15)
+        sim.deadline_queue.run_due()
+        client.post('/generate-event', data={'event_status': 'Started', 'resources': 'vm_a'})
+
+        delta = client.get(f'/metadata/scheduledevents/delta?since={incarnation}').get_json()
+        assert not delta['Full'] and delta['Since'] == incarnation
+        incarnation = _apply_delta(events, delta)
+        full = client.get('/metadata/scheduledevents').get_json()
+        assert incarnation == full['DocumentIncarnation']
+        assert sorted(events.values(), key=lambda e: e['EventId']) == sorted(full['Events'], key=lambda e: e['EventId'])
+
+        # Only what changed comes back: the playback events completing
+        sim.clock.advance(15)
+        sim.deadline_queue.run_due()
+        delta = client.get(f'/metadata/scheduledevents/delta?since={incarnation}').get_json()
+        assert delta['Events'] == [] and playback['EventId'] in delta['Removed']
+        _apply_delta(events, delta)
+        assert list(events.values()) == client.get('/metadata/scheduledevents').get_json()['Events']
+
+        # Up to date clients get an empty delta; resource filters apply
+        delta = client.get(f'/metadata/scheduledevents/delta?since={sim.last_doc_incarnation}').get_json()
+        assert (delta['Events'], delta['Removed']) == ([], [])
+        delta = client.get('/metadata/scheduledevents/delta?since=1&resource=vm_b').get_json()
+        assert (delta['Events'], delta['Removed']) == ([], [playback['EventId']])
+        assert client.get('/metadata/scheduledevents/delta?since=abc').status_code == 400
+
+def test_delta_reports_events_dropped_by_set_scenario_and_reset():
+    """Test that a delta client drops the interactive event when set-scenario or reset replaces it."""
+    delta_app = main.create_app({'TESTING': True, 'CLOCK': main.ManualClock()})
+    sim = delta_app.extensions['simulator']
+    with delta_app.test_client() as client:
+        client.post('/set-scenario', data={'scenario': 'Live Migration'})
+        client.post('/generate-event', data={'event_status': 'Scheduled', 'resources': 'vm_a'})
+        event_id = sim.last_event['EventId']
+        events = {}
+        incarnation = _apply_delta(events, client.get('/metadata/scheduledevents/delta').get_json())
+        assert list(events) == [event_id]
+
+        client.post('/set-scenario', data={'scenario': 'User Reboot'})
+        delta = client.get(f'/metadata/scheduledevents/delta?since={incarnation}').get_json()
+        assert not delta['Full'] and delta['Removed'] == [event_id]
+        incarnation = _apply_delta(events, delta)
+        assert events == {}
+        assert incarnation == client.get('/metadata/scheduledevents').get_json()['DocumentIncarnation']
+
+        client.post('/generate-event', data={'event_status': 'Scheduled', 'resources': 'vm_a'})
+        event_id = sim.last_event['EventId']
+        incarnation = _apply_delta(events, client.get(f'/metadata/scheduledevents/delta?since={incarnation}').get_json())
+        sim.reset()
+        delta = client.get(f'/metadata/scheduledevents/delta?since={incarnation}').get_json()
+        assert not delta['Full'] and delta['Removed'] == [event_id]
+        _apply_delta(events, delta)
+        assert events == {}
+        # Nothing left to drop: no new incarnation
+        before = sim.last_doc_incarnation
+        client.post('/set-scenario', data={'scenario': 'Live Migration'})
+        assert sim.last_doc_incarnation == before
+
+def test_delta_falls_back_to_a_snapshot_once_evicted():
+    """Test that a since older than the change log, or before a clear, gets the full document."""
+    delta_app = main.create_app({'TESTING': True, 'CLOCK': main.ManualClock(), 'CHANGE_LOG_SIZE': 3})
+    sim = delta_app.extensions['simulator']
+    with delta_app.test_client() as client:
+        for vm in ['vm_1', 'vm_2', 'vm_3', 'vm_4']:
+            sim.start_playback_event('Live Migration - Dev Timing', [vm])
+        assert len(sim.change_log) == 3
+        delta = client.get('/metadata/scheduledevents/delta?since=1').get_json()
+        assert delta['Full'] and len(delta['Events']) == 4
+        delta = client.get('/metadata/scheduledevents/delta?since=2').get_json()
+        assert not delta['Full'] and len(delta['Events']) == 3
+
+        since = sim.last_doc_incarnation
+        sim.clear_playback()
+        delta = client.get(f'/metadata/scheduledevents/delta?since={since}').get_json()
+        assert delta['Full'] and delta['Events'] == []
+        assert client.get('/metadata/scheduledevents/delta?since=999').get_json()['Full']
+
+@pytest.mark.parametrize('api_version, fields, resources', [
+    ('2017-03-01', set(), ['_vm_v']),
+    ('2017-08-01', set(), ['vm_v']),
+    ('2019-04-01', {'Description'}, ['vm_v']),
+    ('2019-08-01', {'Description', 'EventSource'}, ['vm_v']),
+    ('2020-07-01', {'Description', 'EventSource', 'DurationInSeconds'}, ['vm_v']),
+])
+def test_api_version_shapes_events(client, api_version, fields, resources):
+    """Test that each api-version gets the fields and resource names it defines."""
+    client.post('/stop-auto-run')
+    client.post('/set-scenario', data={'scenario': 'Live Migration'})
+    client.post('/generate-event', data={'event_status': 'Scheduled', 'resources': 'vm_v'})
+    event = client.get(f'/metadata/scheduledevents?api-version={api_version}').get_json()['Events'][0]
+    base = {'EventId', 'EventStatus', 'EventType', 'ResourceType', 'Resources', 'NotBefore'}
+    assert set(event) == base | fields
+    assert event['Resources'] == resources
+
+def test_api_version_hides_newer_event_types(client):
+    """Test that Preempt events are left out of versions older than 2017-11-01."""
+    client.post('/stop-auto-run')
+    client.post('/set-scenario', data={'scenario': 'Spot Eviction'})
+    client.post('/generate-event', data={'event_status': 'Scheduled'})
+    assert client.get('/metadata/scheduledevents?api-version=2017-08-01').get_json()['Events'] == []
+    assert len(client.get('/metadata/scheduledevents?api-version=2017-11-01').get_json()['Events']) == 1
+
+def test_unknown_api_version_is_rejected(client):
+    """Test that unknown api-versions get the IMDS 400 with the newest versions."""
+    for resp in [
+        client.get('/metadata/scheduledevents?api-version=2030-01-01'),
+        client.post('/metadata/scheduledevents?api-version=latest', json={'StartRequests': []}),
+        client.get('/metadata/scheduledevents/delta?since=1&api-version=2017-01-01'),
+    ]:
+        assert resp.status_code == 400
+        data = resp.get_json()
+        assert 'api-version' in data['error']
+        assert data['newest-versions'][0] == main.NEWEST_API_VERSION
+
+def test_unapproved_events_start_exactly_at_notbefore():
+    """Test that playback moves Scheduled events to Started at their NotBefore deadline, not before."""
+    race_app = main.create_app({'TESTING': True, 'CLOCK': main.ManualClock()})
+    sim = race_app.extensions['simulator']
+    sim.clock.advance(0.4)
+    waiting = sim.start_playback_event('Live Migration - Dev Timing', ['vm_wait'])
+    approved = sim.start_playback_event('Live Migration - Dev Timing', ['vm_approve'])
+    # NotBefore has whole-second resolution and is rounded up, so the event can't start early
+    assert waiting['NotBefore'] == '2025-07-01T00:00:16Z'
+    assert waiting['NotBeforeDeadline'] == 16.0
+    sim.deadline_queue.run_until(15.999)
+    assert sim.event_store[waiting['EventId']]['EventStatus'] == 'Scheduled'
+    sim.approve({approved['EventId']})
+    assert sim.event_store[approved['EventId']]['EventStatus'] == 'Started'
+    sim.deadline_queue.run_until(16.0)
+    assert sim.event_store[waiting['EventId']]['EventStatus'] == 'Started'
+    with race_app.test_client() as client:
+        report = client.get('/metrics/transitions').get_json()
+    assert [(row['EventStatus'], row['ErrorMs']) for row in report['Transitions']] == [('Started', 0.0)]
+    assert report['Histogram']['Total'] == 1
+
+def test_notbefore_wins_over_scheduled_duration():
+    """Test that a scenario whose Scheduled duration disagrees with NotBefore starts at NotBefore."""
+    drift_app = main.create_app({'TESTING': True, 'CLOCK': main.ManualClock()})
+    sim = drift_app.extensions['simulator']
+    sim.scenarios['Drift'] = dict(
+        sim.scenarios['Live Migration - Dev Timing'],
+        NotBeforeDelayInSeconds=30,
+        EventStatus=OrderedDict([('Scheduled', 5), ('Started', 5), ('Completed', 0)])
+    )
+    event = sim.start_playback_event('Drift', ['vm_drift'])
+    sim.deadline_queue.run_until(29)
+    assert sim.event_store[event['EventId']]['EventStatus'] == 'Scheduled'
+    sim.deadline_queue.run_until(30)
+    assert sim.event_store[event['EventId']]['EventStatus'] == 'Started'
+
+    # Auto-run waits for NotBefore too, sleeping exactly up to it
+    sim.scenarios['Drift']['NotBeforeDelayInSeconds'] = 7.5
+    sim.active_scenario = 'Drift'
+    start = sim.clock.monotonic()
+    sim.auto_run_scenario(threading.Event())
+    records = [r for r in sim.history if r['Source'] == 'auto-run']
+    assert [r['EventStatus'] for r in records] == ['Scheduled', 'Started', 'Completed']
+    assert sim.clock.monotonic() - start == 8 + 5
+    assert all(row['ErrorMs'] == 0 for row in sim.transition_tracker.report()['Transitions'])
+
+def test_deadline_popped_before_startrequest_does_not_advance_twice():
+    """Test that a due transition that loses the race to a StartRequest leaves the event alone."""
+    race_app = main.create_app({'TESTING': True, 'CLOCK': main.ManualClock()})
+    sim = race_app.extensions['simulator']
+    event = sim.start_playback_event('Live Migration - Dev Timing', ['vm_race'])
+    sim.clock.advance(event['NotBeforeDeadline'])
+    # Pop the due entry the way run_due() does, then approve before its callback runs
+    entry = sim.deadline_queue._heap[0]
+    sim.deadline_queue._heap.clear()
+    _, _, callback, args, _ = entry
+    sim.approve({event['EventId']})
+    callback(*args)
+    assert sim.event_store[event['EventId']]['EventStatus'] == 'Started'
+    assert [(r['EventStatus'], r['Source']) for r in sim.history] == [
+        ('Scheduled', 'playback'), ('Started', 'start-request')
+    ]
+    assert len(sim.transition_tracker) == 0
+    # The Started window still runs its full duration from the approval
+    sim.deadline_queue.run_until_idle()
+    assert sim.history[-1]['Source'] == 'playback' and sim.history[-1]['EventStatus'] == 'Completed'
+    assert len(sim.history) == 3
+
+def test_concurrent_changes_get_distinct_incarnations():
+    """Test that request threads and playback publish every change under its own incarnation, in order."""
+    busy_app = main.create_app({'TESTING': True, 'CLOCK': main.ManualClock()})
+    sim = busy_app.extensions['simulator']
+    sim.active_scenario = 'Live Migration - Dev Timing'
+
+    def generate():
+        for _ in range(200):
+            sim.generate_event('Scheduled', ['vm_gen'])
+
+    def playback():
+        for _ in range(200):
+            sim.start_playback_event('Live Migration - Dev Timing', ['vm_play'])
+
+    threads = [threading.Thread(target=target) for target in (generate, generate, playback, playback)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    incarnations = [record['DocumentIncarnation'] for record in sim.history]
+    assert incarnations == list(range(2, 2 + 800))
+    assert [incarnation for incarnation, _ in sim.change_log] == incarnations
+
+def test_autorun_starts_at_notbefore_on_the_deadline_queue():
+    """Test that auto-run queues Scheduled -> Started on the shared deadline queue and carries on from it."""
+    started_by_queue = []
+
+    class QueueThreadClock(main.ManualClock):
+        # Runs the deadline queue after each sleep, as its thread would on the SystemClock
+        def sleep(self, seconds):
+            super().sleep(seconds)
+            before = sim.last_event['EventStatus']
+            sim.deadline_queue.run_due()
+            if sim.last_event['EventStatus'] != before:
+                started_by_queue.append(self.monotonic())
+
+    queue_app = main.create_app({'TESTING': True, 'CLOCK': QueueThreadClock()})
+    sim = queue_app.extensions['simulator']
+    scenario = sim.scenarios['Live Migration - Dev Timing']
+    sim.active_scenario = 'Live Migration - Dev Timing'
+    sim.auto_run_scenario(threading.Event())
+    assert started_by_queue == [scenario['NotBeforeDelayInSeconds']]
+    # Each state is published once, and the transition error is measured at the deadline
+    assert [(r['EventStatus'], r['Source']) for r in sim.history] == [
+        ('Scheduled', 'auto-run'), ('Started', 'auto-run'), ('Completed', 'auto-run')
+    ]
+    assert [row['ErrorMs'] for row in sim.transition_tracker.report()['Transitions']] == [0.0, 0.0]
+    assert len(sim.deadline_queue) == 0
@@ -0,0 +1,77 @@
+import pstats
+import time
+import pytest
+import main
+import profiling
+
+@pytest.fixture
+def app(tmp_path):
+    app = main.create_app({
+        'TESTING': True,
+        'CLOCK': main.ManualClock(),
+        'PROFILE_DIR': str(tmp_path / 'profiles'),
+        'PROFILE_EVERY_N': 3,
+        'PROFILE_KEEP': 4
+    })
+    yield app
+    app.extensions['simulator'].close()
+
+def test_profiling_is_off_without_profile_dir():
+    app = main.create_app({'TESTING': True})
+    assert 'profiler' not in app.extensions
+    assert not app.before_request_funcs
+    with app.test_client() as client:
+        assert client.get('/profiles').status_code == 404
+
+def test_every_nth_request_is_profiled_with_phase_timings(app, tmp_path):
+    with app.test_client() as client:
+        client.post('/set-scenario', data={'scenario': 'Live Migration'})
+        client.post('/generate-event', data={'event_status': 'Scheduled'})
+        for _ in range(4):
+            client.get('/metadata/scheduledevents')
+        profiles = client.get('/profiles').get_json()['Profiles']
+    # Requests 3 and 6 of the 6 above were sampled
+    assert [p['Path'] for p in profiles] == ['/metadata/scheduledevents'] * 2
+    assert all(p['Trigger'] == 'sample' for p in profiles)
+    # Served from the cached document, so nothing was encoded
+    assert set(profiles[0]['PhasesMs']) == {'render', 'state', 'response'}
+    assert profiles[0]['TotalMs'] >= sum(profiles[0]['PhasesMs'].values())
+    stats = pstats.Stats(str(tmp_path / 'profiles' / (profiles[0]['Name'] + '.prof')))
+    assert any(function == 'imds_scheduledevents' for _, _, function in stats.stats)
+
+def test_encoding_is_timed_as_serialization_not_render(app):
+    app.extensions['profiler'].every_n = 0
+    with app.test_client() as client:
+        client.post('/set-scenario', data={'scenario': 'Live Migration'})
+        client.post('/generate-event', data={'event_status': 'Scheduled'})
+        client.get('/metadata/scheduledevents', headers={'X-Profile-Request': '1'})
+        phases = client.get('/profiles').get_json()['Profiles'][0]['PhasesMs']
+    assert set(phases) == {'render', 'state', 'serialization', 'response'}
+
+def test_nested_phase_time_is_only_counted_once():
+    timings = {}
+    profiling._active.timings = timings
+    try:
+        with profiling.phase('render'):
+            with profiling.phase('serialization'):
+                time.sleep(0.02)
+    finally:
+        del profiling._active.timings
+    assert timings['serialization'] >= 0.02
+    assert timings['render'] < 0.01
+
+def test_header_requests_a_profile_and_directory_rotates(app):
+    app.extensions['profiler'].every_n = 0
+    with app.test_client() as client:
+        for _ in range(6):
+            client.get('/history', headers={'X-Profile-Request': '1'})
+        client.get('/history')
+        profiles = client.get('/profiles').get_json()['Profiles']
+        assert len(profiles) == 4
+        assert all(p['Trigger'] == 'header' for p in profiles)
+        name = profiles[0]['Name']
+        resp = client.get(f'/profiles/{name}')
+        assert resp.status_code == 200
+        assert 'attachment' in resp.headers['Content-Disposition']
+        assert 'cumulative' in client.get(f'/profiles/{name}?format=text').get_data(as_text=True)
+        assert client.get('/profiles/not-a-profile').status_code == 404
@@ -0,0 +1,22 @@
+import soak
+
+def test_find_growth_flags_only_monotonic_growth_in_second_half():
+    samples = [dict.fromkeys(soak.METRICS, 0) for _ in range(8)]
+    for i, sample in enumerate(samples):
+        sample['History'] = min(i, 3) * 100      # fills up, then plateaus
+        sample['EventStore'] = i * 10            # keeps growing
+        sample['Threads'] = 2 + i % 2            # goes up and down
+        sample['RssBytes'] = None                # not available
+    growing = soak.find_growth(samples)
+    assert growing == {'EventStore': {'From': 40, 'To': 70}}
+
+def test_short_soak_has_no_growth():
+    report = soak.Soak(days=0.5, pollers=3, step_seconds=120, sample_hours=1, traced=False,
+                       history_size=50, reaction_max_events=20).run()
+    assert report['ScenarioCycles'] > len(soak.main.default_scenarios())
+    assert len(report['Samples']) >= 12
+    assert report['Growing'] == {}
+    last = report['Samples'][-1]
+    assert last['History'] == 50
+    assert last['ReactionEvents'] <= 20
+    assert last['SessionCookieBytes'] == 0
@@ -0,0 +1,90 @@
+import json
+import os
+import pytest
+import main
+import timeline
+
+EXAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'timelines', 'freeze-reboot-preempt.json')
+
+@pytest.fixture
+def app():
+    app = main.create_app({'TESTING': True, 'CLOCK': main.ManualClock()})
+    yield app
+    app.extensions['simulator'].close()
+
+@pytest.fixture
+def simulator(app):
+    return app.extensions['simulator']
+
+def statuses_for(simulator, resource):
+    return sorted(
+        (event['ActiveScenario']['EventType'], event['EventStatus'])
+        for event in simulator.event_store.values() if resource in event['Resources']
+    )
+
+def test_preempt_overlaps_scheduled_reboot(simulator):
+    player = timeline.play_timeline(simulator, timeline.load_timeline(EXAMPLE))
+    simulator.deadline_queue.run_until(1000)
+    # The two halves of the freeze wave overlap
+    assert statuses_for(simulator, 'vm0') == [('Freeze', 'Started')]
+    assert statuses_for(simulator, 'vm2') == [('Freeze', 'Scheduled')]
+    simulator.deadline_queue.run_until(1510)
+    assert statuses_for(simulator, 'vm1') == [('Preempt', 'Scheduled'), ('Reboot', 'Scheduled')]
+    simulator.deadline_queue.run_until_idle()
+    assert player.done and player.error is None
+    assert player.started == 4 + 3
+    assert len(simulator.event_store) == 0
+    assert len(simulator.deadline_queue) == 0
+
+def test_large_timeline_is_read_lazily(simulator, tmp_path):
+    path = tmp_path / 'large.jsonl'
+    with open(path, 'w') as f:
+        for i in range(5000):
+            f.write(json.dumps({'Scenario': 'Live Migration - Dev Timing', 'At': i * 10, 'Resources': [f'vm{i}']}) + '\n')
+    read = []
+    def entries():
+        for entry in timeline.load_timeline(str(path)):
+            read.append(entry)
+            yield entry
+    player = timeline.play_timeline(simulator, entries())
+    assert len(read) == 1
+    max_in_flight = max_queued = 0
+    while not player.done:
+        simulator.deadline_queue.run_until(simulator.clock.monotonic() + 10)
+        max_in_flight = max(max_in_flight, len(simulator.event_store))
+        max_queued = max(max_queued, len(simulator.deadline_queue))
+        assert len(read) <= player.started + 1
+    simulator.deadline_queue.run_until_idle()
+    assert player.started == 5000
+    # Each event lasts 20s and one starts every 10s
+    assert max_in_flight <= 3
+    assert max_queued <= 4
+
+def test_repeats_and_bad_lazy_entries(simulator):
+    entries = [
+        {'Scenario': 'Spot Eviction', 'At': 0, 'Resources': ['vm_s'], 'Repeat': 3, 'Every': 100},
+        {'Scenario': 'Spot Eviction', 'At': 150},
+        {'Scenario': 'No Such Scenario', 'At': 400},
+    ]
+    player = timeline.play_timeline(simulator, entries)
+    simulator.deadline_queue.run_until_idle()
+    assert player.started == 4
+    assert 'No Such Scenario' in player.error
+    starts = [r['Timestamp'] for r in simulator.history if r['Resources'] == ['vm_s'] and r['EventStatus'] == 'Scheduled']
+    assert starts == ['2025-07-01T00:00:00.000000Z', '2025-07-01T00:01:40.000000Z', '2025-07-01T00:03:20.000000Z']
+
+def test_timeline_route(app, simulator):
+    with app.test_client() as client:
+        with open(EXAMPLE) as f:
+            resp = client.post('/timeline', json=dict(json.load(f), Speed=60))
+        assert resp.status_code == 202
+        assert resp.get_json() == {'Entries': 5, 'Speed': 60.0, 'LastStartSeconds': (3600 + 2 * 7200) / 60}
+        simulator.deadline_queue.run_until(1)
+        assert statuses_for(simulator, 'vm0') == [('Freeze', 'Scheduled')]
+        assert client.post('/timeline', json=[{'Scenario': 'Nope'}]).status_code == 400
+        assert client.post('/timeline', json=[{'Scenario': 'Spot Eviction', 'At': 10}, {'Scenario': 'Spot Eviction', 'At': 5}]).status_code == 400
+        assert client.post('/timeline', json={'Entries': 'x'}).status_code == 400
+        assert client.post('/timeline', json=[{'Scenario': 'Spot Eviction', 'At': 'nan'}]).status_code == 400
+        assert client.post('/timeline', json=[{'Scenario': 'Spot Eviction', 'Repeat': 2, 'Every': 'inf'}]).status_code == 400
+        for speed in (0, 'nan', 'inf'):
+            assert client.post('/timeline', json={'Entries': [], 'Speed': speed}).status_code == 400
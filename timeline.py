@@ -0,0 +1,166 @@
+"""
+Scripted scenario timelines.
+
+A timeline is a list of entries, each playing one scenario from `scenarios`
+at an offset from the start of the timeline:
+
+    {"Scenario": "User Reboot", "At": 120, "Resources": ["vm1"], "Repeat": 3, "Every": 3600}
+
+- At: seconds from the start of the timeline (default 0).
+- Resources: VMs the event names (default ["vmss_vm1"]). Scale set scenarios
+  without Resources walk their update domains as a maintenance wave.
+- Repeat/Every: play the entry Repeat times, Every seconds apart.
+
+Entries overlap freely: each one becomes its own event in the simulator's
+event store, moved through its states by the shared deadline queue. Entries
+must be listed in order of At. They are read lazily and only the next due
+entry is queued, so a timeline of thousands of entries held in a JSON Lines
+file costs memory for the events in flight (and entries still repeating), not
+for the whole script.
+"""
+import heapq
+import itertools
+import json
+import math
+
+
+def parse_entry(raw, scenarios):
+    """
+    Validate one timeline entry and return it with defaults filled in.
+    """
+    if not isinstance(raw, dict):
+        raise ValueError(f"Timeline entries must be objects: {raw!r}")
+    scenario_name = raw.get("Scenario")
+    if scenario_name not in scenarios:
+        raise ValueError(f"Unknown scenario in timeline: {scenario_name}")
+    at = float(raw.get("At", 0))
+    repeat = int(raw.get("Repeat", 1))
+    every = float(raw.get("Every", 0))
+    if not (math.isfinite(at) and math.isfinite(every)) or at < 0 or repeat < 1 or (repeat > 1 and every <= 0):
+        raise ValueError(f"Invalid timing for {scenario_name}: At and Every must be finite, At >= 0, Repeat >= 1 and Every > 0 when repeating")
+    resources = raw.get("Resources")
+    if resources is not None and (not isinstance(resources, list) or not all(isinstance(r, str) for r in resources)):
+        raise ValueError(f"Resources for {scenario_name} must be a list of names")
+    if resources is None and "ScaleSet" not in scenarios[scenario_name]:
+        resources = ["vmss_vm1"]
+    return {"Scenario": scenario_name, "At": at, "Resources": resources, "Repeat": repeat, "Every": every}
+
+
+def load_timeline(path):
+    """
+    Yield the raw entries of a timeline file without reading it all first.
+    .jsonl files hold one entry per line; other files hold a JSON list of
+    entries or an object with an "Entries" list.
+    """
+    if path.endswith(".jsonl"):
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        return
+    with open(path) as f:
+        document = json.load(f)
+    yield from document["Entries"] if isinstance(document, dict) else document
+
+
+class TimelinePlayer:
+    """
+    Plays timeline entries into a simulator. Holds the next unread entry and
+    the next occurrence of each entry that is still repeating; the deadline
+    queue holds a single wake-up for the whole timeline.
+    """
+    def __init__(self, simulator, entries, speed=1.0):
+        self.simulator = simulator
+        self.speed = speed
+        self.started = 0
+        self.error = None
+        self._entries = iter(entries)
+        self._next_entry = None
+        self._last_at = 0.0
+        self._repeats = []
+        self._counter = itertools.count()
+        self._queue_entry = None
+        self._start = None
+
+    def _read_entry(self):
+        raw = next(self._entries, None)
+        if raw is None:
+            return None
+        entry = parse_entry(raw, self.simulator.scenarios)
+        if entry["At"] < self._last_at:
+            raise ValueError(f"Timeline entries must be in order of At: {entry['At']} after {self._last_at}")
+        self._last_at = entry["At"]
+        return entry
+
+    def start(self):
+        self._start = self.simulator.clock.monotonic()
+        self._next_entry = self._read_entry()
+        self._queue_next()
+        return self
+
+    def _next_at(self):
+        candidates = []
+        if self._next_entry is not None:
+            candidates.append(self._next_entry["At"])
+        if self._repeats:
+            candidates.append(self._repeats[0][0])
+        return min(candidates) if candidates else None
+
+    @property
+    def done(self):
+        return self._next_at() is None
+
+    def _queue_next(self):
+        at = self._next_at()
+        self._queue_entry = None
+        if at is not None:
+            self._queue_entry = self.simulator.deadline_queue.call_at(self._start + at / self.speed, self._fire)
+
+    def _play(self, entry):
+        self.started += 1
+        if entry["Resources"] is None:
+            self.simulator.start_rolling_maintenance(entry["Scenario"], speed=self.speed)
+        else:
+            self.simulator.start_playback_event(entry["Scenario"], entry["Resources"], speed=self.speed)
+
+    def _fire(self):
+        # Play everything due by now, in timeline order, then queue one wake-up
+        elapsed = (self.simulator.clock.monotonic() - self._start) * self.speed
+        while True:
+            at = self._next_at()
+            if at is None or at > elapsed:
+                break
+            if self._repeats and self._repeats[0][0] == at:
+                _, _, entry, remaining = heapq.heappop(self._repeats)
+            else:
+                entry, remaining = self._next_entry, self._next_entry["Repeat"]
+                try:
+                    self._next_entry = self._read_entry()
+                except ValueError as e:
+                    # Lazily read entries are checked as they come up; a bad
+                    # one ends the timeline rather than the deadline queue
+                    self.error = str(e)
+                    self._next_entry = None
+            self._play(entry)
+            if remaining > 1:
+                heapq.heappush(self._repeats, (at + entry["Every"], next(self._counter), entry, remaining - 1))
+        self._queue_next()
+
+    def cancel(self):
+        """
+        Stop playing further entries. Events already started run to the end.
+        """
+        if self._queue_entry is not None:
+            self.simulator.deadline_queue.cancel(self._queue_entry)
+            self._queue_entry = None
+        self._next_entry = None
+        self._repeats.clear()
+
+
+def play_timeline(simulator, entries, speed=1.0):
+    """
+    Start playing entries (an iterable of raw entries, e.g. from
+    load_timeline()) on the simulator's deadline queue. speed > 1 plays the
+    timeline and every event in it faster than the clock.
+    """
+    return TimelinePlayer(simulator, entries, speed).start()